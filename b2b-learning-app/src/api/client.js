@@ -20,12 +20,70 @@ export const getQuestions = async (payload) => {
   return response.data;
 };
 
-export const tutorChat = async (messages, exerciseContext = '') => {
-  const response = await api.post('/tutor_chat', {
-    messages: messages.map(m => ({ role: m.sender === 'user' ? 'user' : 'assistant', content: m.text })),
-    exercise_context: exerciseContext,
-  });
+// sessionId lets the server keep a summary of the older turns of a chat.
+const toTutorPayload = (messages, exerciseContext, sessionId) => ({
+  messages: messages.map(m => ({ role: m.sender === 'user' ? 'user' : 'assistant', content: m.text })),
+  exercise_context: exerciseContext,
+  session_id: sessionId || '',
+});
+
+export const tutorChat = async (messages, exerciseContext = '', sessionId = '') => {
+  const response = await api.post('/tutor_chat', toTutorPayload(messages, exerciseContext, sessionId));
   return response.data;
 };
 
+// Reads a Server-Sent Events response, calling onToken for every "token"
+// event. Resolves with the "done" payload. Uses fetch because axios cannot
+// stream in the browser and EventSource cannot POST. No overall timeout:
+// tokens keep arriving for as long as the answer is being written.
+const readEventStream = async (response, onToken) => {
+  if (!response.ok || !response.body) {
+    throw new Error(`Streaming request failed with status ${response.status}`);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of raw.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data += line.slice(5).trim();
+      }
+      if (!data) continue;
+      const payload = JSON.parse(data);
+      if (event === 'token') onToken(payload.delta);
+      else if (event === 'error') throw new Error(payload.detail);
+      else if (event === 'done') return payload;
+    }
+  }
+  throw new Error('Stream ended before completion.');
+};
+
+export const tutorChatStream = async (messages, exerciseContext = '', onToken = () => {}, signal, sessionId = '') => {
+  const response = await fetch(`${api.defaults.baseURL}/tutor_chat/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream' },
+    body: JSON.stringify(toTutorPayload(messages, exerciseContext, sessionId)),
+    signal,
+  });
+  return readEventStream(response, onToken);
+};
+
+export const queryStream = async (userQuery, onToken = () => {}, signal) => {
+  const params = new URLSearchParams({ user_query: userQuery });
+  const response = await fetch(`${api.defaults.baseURL}/query/stream?${params}`, {
+    headers: { Accept: 'text/event-stream' },
+    signal,
+  });
+  return readEventStream(response, onToken);
+};
+
 export default api;
@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef } from 'react';
 import ExerciseModule from './ExerciseModule';
-import { tutorChat } from '../api/client';
+import { tutorChatStream } from '../api/client';
 
 // --- Mock Data for Leitner Levels ---
 // This data can be replaced with data from backend
@@ -85,6 +85,7 @@ const AITutorChat = ({ exerciseContext = '' }) => {
     const [inputMessage, setInputMessage] = useState('');
     const [isLoading, setIsLoading] = useState(false);
     const chatEndRef = useRef(null);
+    const sessionIdRef = useRef(crypto.randomUUID());
 
     // Auto-scroll to bottom
     useEffect(() => {
@@ -103,15 +104,29 @@ const AITutorChat = ({ exerciseContext = '' }) => {
         try {
             // Send full history (excluding the initial bot greeting for clarity)
             const historyToSend = updatedMsgs.filter(m => m.id !== 1);
-            const data = await tutorChat(historyToSend, exerciseContext);
-            setMessages(prev => [...prev, {
-                id: Date.now() + 1,
-                sender: 'bot',
-                text: data.reply || 'No pude procesar tu pregunta. Intenta de nuevo.'
-            }]);
+            // The reply is shown as it streams in, token by token.
+            const botId = Date.now() + 1;
+            let started = false;
+            const setBotText = (update) => setMessages(prev => prev.map(m => (
+                m.id === botId ? { ...m, text: update(m.text) } : m
+            )));
+            const data = await tutorChatStream(historyToSend, exerciseContext, (delta) => {
+                if (!started) {
+                    started = true;
+                    setMessages(prev => [...prev, { id: botId, sender: 'bot', text: '' }]);
+                }
+                setBotText(text => text + delta);
+            }, undefined, sessionIdRef.current);
+            if (!started) {
+                setMessages(prev => [...prev, {
+                    id: botId,
+                    sender: 'bot',
+                    text: data.reply || 'No pude procesar tu pregunta. Intenta de nuevo.'
+                }]);
+            }
         } catch (err) {
             setMessages(prev => [...prev, {
-                id: Date.now() + 1,
+                id: Date.now() + 2,
                 sender: 'bot',
                 text: '⚠️ No pude conectarme al tutor ahora mismo. Revisa tu conexión e intenta de nuevo.'
             }]);
@@ -0,0 +1,56 @@
+import argparse
+import json
+from typing import Any, Dict, Optional
+
+# Prints per-metric changes between two bench.run reports; exits non-zero
+# when any latency grows beyond --threshold percent.
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+METRICS = LATENCY_METRICS + ("throughput_rps", "peak_rss_mb")
+
+
+def _change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.1f}"
+
+
+def _rows(old: Dict[str, Any], new: Dict[str, Any]):
+    build_old, build_new = old.get("initialize_index", {}), new.get("initialize_index", {})
+    for metric in ("seconds", "peak_rss_mb"):
+        yield "initialize_index", metric, build_old.get(metric), build_new.get(metric)
+    for name in sorted(set(old.get("endpoints", {})) | set(new.get("endpoints", {}))):
+        a, b = old.get("endpoints", {}).get(name, {}), new.get("endpoints", {}).get(name, {})
+        for metric in METRICS:
+            yield name, metric, a.get(metric), b.get(metric)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports.")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed latency regression, in percent")
+    args = parser.parse_args()
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    regressions = 0
+    for name, metric, a, b in _rows(old, new):
+        change = _change(a, b)
+        flag = ""
+        if change is not None and change > args.threshold and (metric in LATENCY_METRICS or metric == "seconds"):
+            flag = "  REGRESSION"
+            regressions += 1
+        shown = f"{change:+.1f}%" if change is not None else "n/a"
+        print(f"{name:16} {metric:14} {_fmt(a):>10} -> {_fmt(b):>10}  {shown}{flag}")
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
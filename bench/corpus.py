@@ -0,0 +1,57 @@
+import argparse
+import os
+import random
+from typing import List
+
+# Synthetic study material for index-build benchmarks: files of technical
+# prose built from a fixed vocabulary, reproducible from the seed.
+TERMS = [
+    "useState", "useEffect", "props", "componente", "JSX", "estado", "render", "hook", "contexto",
+    "Express", "middleware", "router", "req.body", "res.json", "async", "await", "promesa", "Node.js",
+    "SELECT", "JOIN", "WHERE", "ORDER BY", "GROUP BY", "índice", "clave primaria", "transacción",
+    "flexbox", "grid", "selector", "HTML", "CSS", "fetch", "JSON", "API REST", "token", "JWT",
+]
+FILLER = [
+    "el", "la", "de", "que", "para", "con", "una", "se", "por", "como", "cuando", "permite", "usa",
+    "define", "devuelve", "ejemplo", "función", "valor", "datos", "servidor", "cliente", "consulta",
+]
+
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    out: List[str] = []
+    for _ in range(words):
+        out.append(rng.choice(TERMS) if rng.random() < 0.2 else rng.choice(FILLER))
+    return " ".join(out).capitalize() + "."
+
+
+def write_corpus(out_dir: str, n_files: int, words_per_file: int = 800, seed: int = 0) -> List[str]:
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n_files):
+        paragraphs = []
+        remaining = words_per_file
+        while remaining > 0:
+            size = min(remaining, rng.randint(40, 120))
+            paragraphs.append(_paragraph(rng, size))
+            remaining -= size
+        path = os.path.join(out_dir, f"doc_{i:05d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"Tema {i}: {rng.choice(TERMS)}\n\n" + "\n\n".join(paragraphs))
+        paths.append(path)
+    return paths
+
+
+def queries(n: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [f"¿Cómo se usa {rng.choice(TERMS)} con {rng.choice(TERMS)}?" for _ in range(n)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic corpus for index benchmarks.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--words", type=int, default=800)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"Wrote {len(write_corpus(args.out_dir, args.files, args.words, args.seed))} files to {args.out_dir}")
@@ -0,0 +1,138 @@
+import hashlib
+import json
+import time
+import uuid
+from typing import Any, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+# In-memory stand-in for the Firebase Realtime Database REST API, enough for
+# the calls in src/firebase_client.py. Run with:
+#   uvicorn bench.fake_firebase:app --port 9000
+# and point FIREBASE_DB_URL at http://127.0.0.1:9000.
+
+app = FastAPI()
+app.state.root = None
+
+
+def _split(path: str) -> List[str]:
+    return [part for part in path.strip("/").split("/") if part]
+
+
+def _resolve_server_values(value: Any) -> Any:
+    if isinstance(value, dict):
+        if value == {".sv": "timestamp"}:
+            return int(time.time() * 1000)
+        return {k: _resolve_server_values(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve_server_values(v) for v in value]
+    return value
+
+
+def _normalize(value: Any) -> Any:
+    # Firebase stores arrays as objects keyed by index and drops empty containers.
+    if isinstance(value, list):
+        value = {str(i): v for i, v in enumerate(value)}
+    if isinstance(value, dict):
+        cleaned = {k: _normalize(v) for k, v in value.items()}
+        cleaned = {k: v for k, v in cleaned.items() if v is not None}
+        return cleaned or None
+    return value
+
+
+def _denormalize(value: Any) -> Any:
+    if isinstance(value, dict):
+        value = {k: _denormalize(v) for k, v in value.items()}
+        if value and all(k.isdigit() for k in value):
+            indexes = sorted(int(k) for k in value)
+            if indexes == list(range(len(indexes))):
+                return [value[str(i)] for i in indexes]
+    return value
+
+
+def get_value(parts: List[str]) -> Any:
+    node = app.state.root
+    for part in parts:
+        if not isinstance(node, dict) or part not in node:
+            return None
+        node = node[part]
+    return node
+
+
+def _remove(node: Any, parts: List[str]) -> None:
+    # Like Firebase, deleting creates no nodes and drops emptied parents.
+    if not isinstance(node, dict) or parts[0] not in node:
+        return
+    if len(parts) > 1:
+        _remove(node[parts[0]], parts[1:])
+        if node[parts[0]] != {}:
+            return
+    node.pop(parts[0])
+
+
+def set_value(parts: List[str], value: Any) -> None:
+    value = _normalize(_resolve_server_values(value))
+    if not parts:
+        app.state.root = value
+        return
+    if value is None:
+        _remove(app.state.root, parts)
+        if app.state.root == {}:
+            app.state.root = None
+        return
+    if not isinstance(app.state.root, dict):
+        app.state.root = {}
+    node = app.state.root
+    for part in parts[:-1]:
+        if not isinstance(node.get(part), dict):
+            node[part] = {}
+        node = node[part]
+    node[parts[-1]] = value
+
+
+def etag_of(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _json_response(value: Any, status_code: int = 200, etag: bool = False) -> Response:
+    headers = {"ETag": etag_of(value)} if etag else None
+    return Response(
+        json.dumps(_denormalize(value)),
+        status_code=status_code,
+        media_type="application/json",
+        headers=headers,
+    )
+
+
+@app.api_route("/{path:path}", methods=["GET", "PUT", "POST", "PATCH", "DELETE"])
+async def handle(path: str, request: Request) -> Response:
+    if not path.endswith(".json"):
+        return Response(status_code=404)
+    parts = _split(path[: -len(".json")])
+    body = await request.body()
+    payload = json.loads(body) if body else None
+
+    want_etag = request.headers.get("x-firebase-etag") == "true"
+    if_match = request.headers.get("if-match")
+    if if_match is not None and if_match != etag_of(get_value(parts)):
+        return _json_response(get_value(parts), status_code=412, etag=True)
+
+    if request.method == "GET":
+        value = get_value(parts)
+        if request.query_params.get("shallow") == "true" and isinstance(value, dict):
+            return Response(json.dumps({key: True for key in value}), media_type="application/json")
+        return _json_response(value, etag=want_etag)
+    if request.method == "PUT":
+        set_value(parts, payload)
+        return _json_response(get_value(parts), etag=if_match is not None)
+    if request.method == "POST":
+        name = f"-{uuid.uuid4().hex[:19]}"
+        set_value(parts + [name], payload)
+        return _json_response({"name": name})
+    if request.method == "PATCH":
+        for key, value in (payload or {}).items():
+            set_value(parts + _split(key), value)
+        return _json_response(payload)
+    set_value(parts, None)
+    return _json_response(None)
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# Stand-in for the parts of the OpenAI API the server uses: embeddings and
+# chat completions (plain, JSON mode and streamed). Run with:
+#   uvicorn bench.fake_openai:app --port 9100
+# and point OPENAI_BASE_URL at http://127.0.0.1:9100/v1.
+#
+# Embeddings are derived from the text's hash, so the same text always gets
+# the same vector. Latency is configurable so benchmarks can model the real
+# service:
+#   FAKE_OPENAI_EMBED_LATENCY_MS   per embeddings request (default 30)
+#   FAKE_OPENAI_CHAT_LATENCY_MS    before the first token (default 300)
+#   FAKE_OPENAI_TOKEN_LATENCY_MS   between streamed tokens (default 10)
+EMBED_LATENCY = float(os.getenv("FAKE_OPENAI_EMBED_LATENCY_MS", "30")) / 1000
+CHAT_LATENCY = float(os.getenv("FAKE_OPENAI_CHAT_LATENCY_MS", "300")) / 1000
+TOKEN_LATENCY = float(os.getenv("FAKE_OPENAI_TOKEN_LATENCY_MS", "10")) / 1000
+EMBED_DIM = int(os.getenv("FAKE_OPENAI_EMBED_DIM", "1536"))
+
+app = FastAPI()
+app.state.requests = {"embeddings": 0, "chat": 0}
+
+TOPICS = ["HTML y CSS", "JavaScript moderno", "React", "Node.js y Express", "SQL", "Autenticación", "Despliegue"]
+
+
+def embed(text: str, dim: int = EMBED_DIM) -> List[float]:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _curriculum() -> Dict[str, Any]:
+    return {
+        "nombre": "App de ejemplo",
+        "curriculum": [
+            {"titulo": f"Introducción a {topic}", "nivel_dificultad": level, "tarea_aprendizaje": topic}
+            for level, topic in enumerate(TOPICS, start=1)
+        ],
+    }
+
+
+def _exercises(topic: str) -> Dict[str, Any]:
+    return {
+        "modulo": topic,
+        "ejercicios": [
+            {
+                "titulo": f"Ejercicio {i} de {topic}",
+                "tipo": "test",
+                "nivel": "básico",
+                "descripcion_teorica": f"Repaso de {topic}.",
+                "enunciado": f"Responde la pregunta {i} sobre {topic}.",
+                "respuesta_correcta": "A",
+            }
+            for i in range(1, 4)
+        ],
+    }
+
+
+def _completion_text(body: Dict[str, Any]) -> str:
+    messages = body.get("messages", [])
+    system = messages[0]["content"] if messages else ""
+    last = messages[-1]["content"] if messages else ""
+    if body.get("response_format", {}).get("type") == "json_object":
+        if '"curriculum"' in system:
+            return json.dumps(_curriculum(), ensure_ascii=False)
+        try:
+            topic = json.loads(last).get("topic", "el tema")
+        except (ValueError, AttributeError):
+            topic = "el tema"
+        return json.dumps(_exercises(topic), ensure_ascii=False)
+    words = f"Respuesta de prueba sobre: {last[:200]}".split()
+    return " ".join(words[:60])
+
+
+def _chunk(body: Dict[str, Any], delta: Dict[str, Any], finish_reason: Any = None, usage: Any = None) -> str:
+    chunk = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if usage is not None:
+        # Like the real API: the last chunk carries usage and no choices.
+        chunk["choices"] = []
+        chunk["usage"] = usage
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+def _usage(body: Dict[str, Any], text: str) -> Dict[str, int]:
+    # Word counts stand in for token counts.
+    prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+    completion_tokens = len(text.split())
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    app.state.requests["embeddings"] += 1
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(EMBED_LATENCY)
+    dim = int(body.get("dimensions") or EMBED_DIM)
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": embed(str(text), dim)} for i, text in enumerate(inputs)],
+        "model": body.get("model", "fake"),
+        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    app.state.requests["chat"] += 1
+    text = _completion_text(body)
+    await asyncio.sleep(CHAT_LATENCY)
+
+    if body.get("stream"):
+        async def events():
+            yield _chunk(body, {"role": "assistant", "content": ""})
+            for word in text.split(" "):
+                yield _chunk(body, {"content": word + " "})
+                await asyncio.sleep(TOKEN_LATENCY)
+            yield _chunk(body, {}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield _chunk(body, {}, usage=_usage(body, text))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+        "usage": _usage(body, text),
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return app.state.requests
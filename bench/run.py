@@ -0,0 +1,267 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+import httpx
+import numpy as np
+
+from bench.corpus import queries, write_corpus
+
+# Offline benchmark: starts the fake OpenAI and Firebase servers, builds an
+# index over a synthetic corpus, serves src.app from a scratch directory and
+# drives its hot endpoints. Writes one JSON report per run:
+#   python -m bench.run --files 200 --requests 200 --concurrency 16
+#   python -m bench.compare bench/results/<old>.json bench/results/<new>.json
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "bench", "results")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _rss_mb(pid: int, field: str = "VmRSS") -> Optional[float]:
+    # Linux only; other platforms report null.
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def _wait_for_port(port: int, proc: subprocess.Popen, timeout: float = 120.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Process exited with {proc.returncode} before listening on {port}.")
+        with socket.socket() as s:
+            if s.connect_ex(("127.0.0.1", port)) == 0:
+                return
+        time.sleep(0.1)
+    raise TimeoutError(f"Nothing listening on port {port} after {timeout}s.")
+
+
+@contextmanager
+def _server(app: str, port: int, cwd: str, env: Dict[str, str]) -> Iterator[subprocess.Popen]:
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--port", str(port), "--log-level", "warning"],
+        cwd=cwd,
+        env=env,
+    )
+    try:
+        _wait_for_port(port, proc)
+        yield proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def summarize(latencies: List[float], errors: int, wall: float, peak_rss_mb: Optional[float]) -> Dict[str, Any]:
+    ms = np.asarray(latencies, dtype=np.float64) * 1000
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": float(np.percentile(ms, 50)) if len(ms) else None,
+        "p95_ms": float(np.percentile(ms, 95)) if len(ms) else None,
+        "p99_ms": float(np.percentile(ms, 99)) if len(ms) else None,
+        "mean_ms": float(ms.mean()) if len(ms) else None,
+        "throughput_rps": len(latencies) / wall if wall > 0 else None,
+        "wall_s": wall,
+        "peak_rss_mb": peak_rss_mb,
+    }
+
+
+async def _sample_rss(pid: int, peak: List[float], stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        rss = _rss_mb(pid)
+        if rss is not None:
+            peak[0] = max(peak[0], rss)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.05)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def load_test(
+    call: Callable[[int], Awaitable[httpx.Response]],
+    n_requests: int,
+    concurrency: int,
+    server_pid: int,
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(n_requests))
+    peak = [0.0]
+    stop = asyncio.Event()
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await call(i)
+                if response.status_code >= 400:
+                    errors += 1
+                    continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    sampler = asyncio.ensure_future(_sample_rss(server_pid, peak, stop))
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - wall_start
+    stop.set()
+    await sampler
+    return summarize(latencies, errors, wall, peak[0] or None)
+
+
+def bench_initialize_index(workdir: str, env: Dict[str, str]) -> Dict[str, Any]:
+    # A fresh process per build so peak RSS belongs to the build alone.
+    code = (
+        "import resource, time, json\n"
+        "from src.llama_index_template import initialize_index\n"
+        "t = time.perf_counter(); index = initialize_index(force_rebuild=True); t = time.perf_counter() - t\n"
+        "print(json.dumps({'seconds': t, 'nodes': len(index.index_struct.nodes_dict),\n"
+        "                  'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))\n"
+    )
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=workdir, env=env, text=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+async def bench_endpoints(base_url: str, server_pid: int, args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        # The index loads in the background after startup; time requests, not the load.
+        while (ready := await client.get("/ready")).status_code != 200:
+            if ready.json()["status"] == "failed":
+                raise RuntimeError(f"Index failed to load: {ready.json()['error']}")
+            await asyncio.sleep(0.1)
+        user_id = (await client.post("/create_client")).json()["id"]
+
+        results["create_project"] = await load_test(
+            lambda i: client.post("/create_project", json={"description": f"App de prueba {i}", "userId": user_id}),
+            args.projects,
+            min(args.concurrency, args.projects),
+            server_pid,
+        )
+        projects = [p["id"] for p in (await client.get(f"/client_projects/{user_id}")).json()]
+        if not projects:
+            raise RuntimeError("create_project produced no projects; see the server log.")
+        modules = len((await client.get(f"/project_details/{user_id}/{projects[0]}")).json()["curriculum"])
+
+        query_pool = queries(args.query_pool, seed=args.seed)
+        results["query"] = await load_test(
+            lambda i: client.get("/query", params={"user_query": query_pool[i % len(query_pool)]}),
+            args.requests,
+            args.concurrency,
+            server_pid,
+        )
+        results["get_questions"] = await load_test(
+            lambda i: client.post("/get_questions", json={
+                "userId": user_id,
+                "curriculumId": rng.choice(projects),
+                "moduleId": rng.randrange(modules),
+            }),
+            args.requests,
+            args.concurrency,
+            server_pid,
+        )
+        results["complete_module"] = await load_test(
+            lambda i: client.post("/complete_module", json={
+                "userId": user_id,
+                "projectId": rng.choice(projects),
+                "moduleId": str(rng.randrange(modules)),
+            }),
+            args.requests,
+            args.concurrency,
+            server_pid,
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmark of index builds and API hot paths.")
+    parser.add_argument("--files", type=int, default=100, help="synthetic corpus size")
+    parser.add_argument("--words", type=int, default=800, help="words per corpus file")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--projects", type=int, default=20, help="projects created (and timed) before the other endpoints")
+    parser.add_argument("--query-pool", type=int, default=50, help="distinct /query strings; fewer means more cache hits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help=f"report path (default {RESULTS_DIR}/<timestamp>-<commit>.json)")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    openai_port, firebase_port, app_port = _free_port(), _free_port(), _free_port()
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "FIREBASE_DB_URL": f"http://127.0.0.1:{firebase_port}",
+        "FIREBASE_DB_AUTH": "",
+    })
+    report: Dict[str, Any] = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "keep_workdir")},
+    }
+    try:
+        write_corpus(os.path.join(workdir, "data"), args.files, args.words, args.seed)
+        with _server("bench.fake_openai:app", openai_port, REPO_ROOT, env), \
+                _server("bench.fake_firebase:app", firebase_port, REPO_ROOT, env):
+            print(f"Building index over {args.files} files...", flush=True)
+            report["initialize_index"] = bench_initialize_index(workdir, env)
+            print(json.dumps(report["initialize_index"]), flush=True)
+            with _server("src.app:app", app_port, workdir, env) as app:
+                print("Load testing endpoints...", flush=True)
+                report["endpoints"] = asyncio.run(bench_endpoints(f"http://127.0.0.1:{app_port}", app.pid, args))
+                report["server_peak_rss_mb"] = _rss_mb(app.pid, "VmHWM")
+    finally:
+        if args.keep_workdir:
+            print(f"Workdir kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['timestamp'].replace(':', '')}-{report['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    for name, stats in report["endpoints"].items():
+        print(f"{name:16} p50 {stats['p50_ms'] or 0:8.1f} ms  p95 {stats['p95_ms'] or 0:8.1f} ms  "
+              f"p99 {stats['p99_ms'] or 0:8.1f} ms  {stats['throughput_rps'] or 0:7.1f} req/s  errors {stats['errors']}")
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.vector_search import VectorSearchEngine, normalize_rows
+
+# Approximate search is opt-in: set ANN_INDEX=ivf to build and use it.
+ANN_INDEX = os.getenv("ANN_INDEX", "").lower()
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))  # 0 -> derived from corpus size
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+# Below this size exact search is already fast, so the IVF lists are skipped.
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "20000"))
+
+IVF_CENTROIDS_FNAME = "ivf_centroids.npy"
+IVF_OFFSETS_FNAME = "ivf_offsets.npy"
+IVF_ROWS_FNAME = "ivf_rows.npy"
+IVF_META_FNAME = "ivf_meta.json"
+
+KMEANS_ITERATIONS = 20
+KMEANS_MAX_TRAINING_POINTS = 256
+
+
+def ids_fingerprint(ids: Sequence[str]) -> str:
+    digest = hashlib.sha1()
+    for node_id in ids:
+        digest.update(node_id.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def default_nlist(n_vectors: int) -> int:
+    return max(1, min(n_vectors, int(4 * np.sqrt(n_vectors))))
+
+
+def spherical_kmeans(matrix: np.ndarray, n_clusters: int, n_iter: int = KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # Train on a sample: centroid quality saturates long before the full corpus.
+    n_train = min(matrix.shape[0], n_clusters * KMEANS_MAX_TRAINING_POINTS)
+    train = normalize_rows(np.asarray(matrix[rng.choice(matrix.shape[0], n_train, replace=False)], dtype=np.float32))
+    centroids = train[rng.choice(n_train, n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assignment = np.argmax(train @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, train)
+        counts = np.bincount(assignment, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points instead of dropping them.
+            sums[empty] = train[rng.choice(n_train, int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray, fingerprint: str) -> None:
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.fingerprint = fingerprint
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, engine: VectorSearchEngine, nlist: int = 0, seed: int = 0) -> "IVFIndex":
+        n_vectors = len(engine)
+        nlist = min(nlist or default_nlist(n_vectors), n_vectors)
+        centroids = spherical_kmeans(engine.matrix, nlist, seed=seed)
+
+        # Assign in blocks so the score matrix never holds the whole corpus.
+        assignment = np.empty(n_vectors, dtype=np.int32)
+        block = 65536
+        for start in range(0, n_vectors, block):
+            assignment[start:start + block] = np.argmax(engine.matrix[start:start + block] @ centroids.T, axis=1)
+
+        # Inverted lists in CSR form: rows of list c are rows[offsets[c]:offsets[c + 1]].
+        rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+        return cls(centroids, offsets, rows, ids_fingerprint(engine.ids))
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = max(1, min(nprobe, self.nlist))
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.rows[self.offsets[c]:self.offsets[c + 1]] for c in probe])
+
+    def search_batch(
+        self,
+        engine: VectorSearchEngine,
+        queries: Sequence[Sequence[float]],
+        k: int,
+        nprobe: int = ANN_NPROBE,
+    ) -> Tuple[List[List[float]], List[List[str]]]:
+        q = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        all_scores, all_ids = [], []
+        for query in q:
+            scores, ids = engine.search(query, k, rows=np.sort(self.candidates(query, nprobe)))
+            all_scores.append(scores)
+            all_ids.append(ids)
+        return all_scores, all_ids
+
+    def save(self, persist_dir: str) -> None:
+        os.makedirs(persist_dir, exist_ok=True)
+        np.save(os.path.join(persist_dir, IVF_CENTROIDS_FNAME), self.centroids)
+        np.save(os.path.join(persist_dir, IVF_OFFSETS_FNAME), self.offsets)
+        np.save(os.path.join(persist_dir, IVF_ROWS_FNAME), self.rows)
+        with open(os.path.join(persist_dir, IVF_META_FNAME), "w", encoding="utf-8") as f:
+            json.dump({"type": "ivf", "nlist": self.nlist, "fingerprint": self.fingerprint}, f)
+
+    @classmethod
+    def load(cls, persist_dir: str, ids: Sequence[str]) -> Optional["IVFIndex"]:
+        meta_path = os.path.join(persist_dir, IVF_META_FNAME)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # Lists built for a different set of vectors would silently miss rows.
+        if meta.get("fingerprint") != ids_fingerprint(ids):
+            return None
+        return cls(
+            np.load(os.path.join(persist_dir, IVF_CENTROIDS_FNAME), mmap_mode="r"),
+            np.load(os.path.join(persist_dir, IVF_OFFSETS_FNAME)),
+            np.load(os.path.join(persist_dir, IVF_ROWS_FNAME), mmap_mode="r"),
+            meta["fingerprint"],
+        )
+
+
+def remove_ann_files(persist_dir: str) -> None:
+    for fname in (IVF_CENTROIDS_FNAME, IVF_OFFSETS_FNAME, IVF_ROWS_FNAME, IVF_META_FNAME):
+        path = os.path.join(persist_dir, fname)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def ann_enabled(n_vectors: int) -> bool:
+    return ANN_INDEX == "ivf" and n_vectors >= ANN_MIN_VECTORS
+
+
+def evaluate_recall(
+    engine: VectorSearchEngine,
+    ivf: IVFIndex,
+    k: int = 5,
+    nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32),
+    n_queries: int = 200,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    # Queries are perturbed corpus vectors, which resemble real query embeddings
+    # better than uniform noise does.
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(engine), min(n_queries, len(engine)), replace=False)
+    queries = np.asarray(engine.matrix[picks], dtype=np.float32)
+    queries = queries + rng.normal(scale=0.05 / np.sqrt(queries.shape[1]), size=queries.shape).astype(np.float32)
+
+    start = time.perf_counter()
+    _, exact_ids = engine.search_batch(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = []
+    for nprobe in nprobes:
+        latencies = []
+        hits = 0
+        for query, truth in zip(queries, exact_ids):
+            start = time.perf_counter()
+            _, approx_ids = ivf.search_batch(engine, [query], k, nprobe=nprobe)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(set(truth) & set(approx_ids[0]))
+        report.append({
+            "nprobe": nprobe,
+            "recall_at_k": hits / (k * len(queries)),
+            "mean_ms": float(np.mean(latencies)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "exact_mean_ms": exact_ms,
+        })
+    return report
+
+
+if __name__ == '__main__':
+    from src.mmap_vector_store import load_vectors
+
+    parser = argparse.ArgumentParser(description="Measure IVF recall against exact search.")
+    parser.add_argument("--persist-dir", default="./storage")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=ANN_NLIST)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    matrix, ids, _ = load_vectors(args.persist_dir)
+    engine = VectorSearchEngine(matrix, ids)
+    ivf = IVFIndex.load(args.persist_dir, ids) if not args.nlist else None
+    if ivf is None:
+        ivf = IVFIndex.build(engine, nlist=args.nlist)
+    print(f"{len(engine)} vectors, nlist={ivf.nlist}")
+    for row in evaluate_recall(engine, ivf, k=args.k, nprobes=args.nprobe, n_queries=args.queries):
+        print(json.dumps(row))
@@ -1,20 +1,131 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import os
+import random
+import socket
+import time
+import traceback
+from contextlib import asynccontextmanager
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from src.llama_index_template import initialize_index, query_index
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, ConfigDict, Field
+from src.retrieval_settings import RETRIEVAL_MAX_TOKENS, RETRIEVAL_MODE, RETRIEVAL_TOP_K
+from src.index_jobs import REBUILD_JOBS_DIR, IndexRebuilder
+from src.lazy_index import INDEX_RELOAD_POLL_SECONDS, INDEX_WARMUP, LazyIndex
+from src.serve import notify_master
+from src.metrics import MetricsMiddleware, registry, span, traced
+from src.pregeneration import ExercisePregenerator
+from src.singleflight import SingleFlight
+from src.openai_client import (
+    chat_completion_async,
+    chat_completion_stream_async,
+    close_async_openai_client,
+)
+from src.sse import sse_event, sse_response
+from src.structured import StructuredOutputError, generate_structured, get_structured_cache
+from src.tutor_context import TutorContext
 import uvicorn
-from openai import OpenAI
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 from dotenv import load_dotenv
 from src.prompts import CURRICULUM_AGENT_SYSTEM_PROMPT, EXERCISES_AGENT_SYSTEM_PROMPT
 
 load_dotenv()
 
-from src.firebase_client import firebase_post, firebase_get, firebase_put
+from src.firebase_client import (
+    FirebaseETagUnsupported,
+    cache_stats,
+    close_async_client,
+    firebase_children,
+    firebase_get_async,
+    firebase_get_with_etag_async,
+    firebase_patch_async,
+    firebase_post_async,
+    firebase_put_async,
+    firebase_put_if_match_async,
+    firebase_update_async,
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if INDEX_WARMUP:
+        rag_index.warm()
+    index_watch = asyncio.ensure_future(_watch_index_version()) if INDEX_RELOAD_POLL_SECONDS > 0 else None
+    yield
+    if index_watch is not None:
+        index_watch.cancel()
+    await exercise_pregenerator.stop()
+    await close_async_client()
+    await close_async_openai_client()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# src.llama_index_template pulls in LlamaIndex and the OpenAI SDK, seconds of
+# imports before the store is even parsed. It is imported inside the code
+# paths that retrieve, so startup and index-free routes never pay for it.
+
+
+def _load_index():
+    from src.llama_index_template import activate_index_version, current_index_version, initialize_index
+
+    index = initialize_index()
+    version = current_index_version()
+    activate_index_version(version)
+    return index, version
+
+
+def _build_index_version():
+    from src.llama_index_template import build_index_version
+
+    return build_index_version()
+
+
+rag_index = LazyIndex(_load_index)
+
+
+def _swap_index(index, version):
+    from src.llama_index_template import activate_index_version
+
+    # A single reference swap: in-flight queries keep the old object.
+    rag_index.swap(index, version)
+    activate_index_version(version)
+
+
+def _on_index_rebuilt(index, version):
+    if index is None:
+        # ./data was unchanged and the live version is still current.
+        return
+    _swap_index(index, version)
+    # Under src.serve the master reloads and replaces every worker.
+    notify_master()
 
-app = FastAPI()
-app.llama_index = initialize_index()
+
+def _reload_index_if_stale() -> bool:
+    # Catches up with a rebuild made by another worker process.
+    if not rag_index.ready:
+        return False
+    from src.llama_index_template import current_index_version, load_current_index
+
+    if current_index_version() == rag_index.version:
+        return False
+    index, version = load_current_index()
+    _swap_index(index, version)
+    return True
+
+
+async def _watch_index_version():
+    while True:
+        await asyncio.sleep(INDEX_RELOAD_POLL_SECONDS)
+        try:
+            await run_in_threadpool(_reload_index_if_stale)
+        except Exception:
+            traceback.print_exc()
+
+
+index_rebuilder = IndexRebuilder(_build_index_version, _on_index_rebuilt, REBUILD_JOBS_DIR)
 # Allow local frontend dev servers to call the API.
 app.add_middleware(
     CORSMiddleware,
@@ -25,22 +136,50 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(MetricsMiddleware)
 
 class CurriculumRequest(BaseModel):
     description: str = Field(..., min_length=1)
     userId: str = Field(..., min_length=1)
 
 
-class Module(BaseModel):
+class CurriculumTopic(BaseModel):
+    # One module as the curriculum agent returns it.
     titulo: str = Field(..., min_length=1)
-    moduleId: int  
     nivel_dificultad: int
     tarea_aprendizaje: str  # <-- CAMBIO 1: Cambiado a 'str' porque la IA devuelve "React", "Node", etc.
+
+
+class Module(CurriculumTopic):
+    moduleId: int  
     ejercicios: List[Any] = [] # <-- CAMBIO 2: Añadido '=[]' para que por defecto sea una lista vacía
     was_completed: bool = False
 
 
+class CurriculumAgentOutput(BaseModel):
+    nombre: str = Field(..., min_length=1)
+    curriculum: List[CurriculumTopic] = Field(..., min_length=1)
+
+
+class Exercise(BaseModel):
+    # Fields from EXERCISES_AGENT_SYSTEM_PROMPT; anything extra is kept.
+    model_config = ConfigDict(extra="allow")
+
+    titulo: str = Field(..., min_length=1)
+    tipo: str = Field(..., min_length=1)
+    nivel: str = ""
+    descripcion_teorica: str = ""
+    enunciado: str = Field(..., min_length=1)
+    respuesta_correcta: Any
+
+
+class ExercisesAgentOutput(BaseModel):
+    modulo: str = ""
+    ejercicios: List[Exercise] = Field(..., min_length=1)
+
+
 class CurriculumResponse(BaseModel):
     id: str
     nombre: str
@@ -56,30 +195,75 @@ class GetQuestionsRequest(BaseModel):
     userId: str = Field(..., min_length=1)
     moduleId: int
 
-def get_new_curr_id(user_id: str) -> str:
-    # Find existing curriculums for the user and return next numeric id.
-    existing = firebase_get(f"curriculums/{user_id}")
-    if not existing:
-        return "0"
+ID_ALLOCATION_RETRIES = 10
+
+# Used only when the database does not support ETags (e.g. some emulators):
+# ids are then serialised per user inside this process.
+_local_id_locks: Dict[str, asyncio.Lock] = {}
+_local_next_ids: Dict[str, int] = {}
+
+
+def _counter_path(user_id: str) -> str:
+    return f"curriculum_counters/{user_id}"
+
+
+async def _next_id_from_keys(user_id: str) -> int:
+    # Seeds a user's counter from existing projects; project keys are their
+    # ids, so a shallow read is enough.
+    existing = await firebase_get_async(f"curriculums/{user_id}", shallow=True)
+    numeric_ids = [int(key) for key in firebase_children(existing) if key.isdigit()]
+    return max(numeric_ids, default=-1) + 1
+
+
+async def _allocate_id_locally(user_id: str) -> str:
+    lock = _local_id_locks.setdefault(user_id, asyncio.Lock())
+    async with lock:
+        counter = await firebase_get_async(_counter_path(user_id))
+        next_id = max(
+            counter if isinstance(counter, int) else await _next_id_from_keys(user_id),
+            _local_next_ids.get(user_id, 0),
+        )
+        _local_next_ids[user_id] = next_id + 1
+        await firebase_put_async(_counter_path(user_id), next_id + 1)
+        return str(next_id)
 
-    # Stored ids are strings; filter numeric ids only.
-    max_id = -1
-    for item in existing.values():
-        try:
-            cid = int(item.get("id"))
-            if cid > max_id:
-                max_id = cid
-        except Exception:
-            continue
-    return str(max_id + 1)
 
-def store_curriculum(curriculum: Dict[str, Any], user_id: str | None = None) -> str:
+async def get_new_curr_id(user_id: str) -> str:
+    # curriculum_counters/{user} holds the next free id; claim it with a
+    # compare-and-set on its ETag so concurrent requests never share an id.
+    path = _counter_path(user_id)
+    try:
+        counter, etag = await firebase_get_with_etag_async(path)
+    except FirebaseETagUnsupported:
+        return await _allocate_id_locally(user_id)
+
+    for attempt in range(ID_ALLOCATION_RETRIES):
+        next_id = counter if isinstance(counter, int) else await _next_id_from_keys(user_id)
+        written, counter, etag = await firebase_put_if_match_async(path, next_id + 1, etag)
+        if written:
+            return str(next_id)
+        if etag is None:
+            counter, etag = await firebase_get_with_etag_async(path)
+        # Someone else took this id; back off a little so retries spread out.
+        await asyncio.sleep(random.uniform(0, min(1.0, 0.05 * (2 ** attempt))))
+    raise HTTPException(503, detail="Could not allocate a curriculum id, please retry.")
+
+
+def _project_summary(project_id: str, project_data: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": project_data.get("id", project_id),
+        "nombre": project_data.get("nombre", "Proyecto sin nombre"),
+        "created_at": project_data.get("created_at"),
+    }
+
+
+async def store_curriculum(curriculum: Dict[str, Any], user_id: str | None = None) -> str:
     # Store curriculum as a JSON object (future-proof for complex items).
     resolved_user_id = user_id or curriculum.get("userId")
     if not resolved_user_id:
         raise HTTPException(400, detail="userId is required to store curriculum.")
 
-    new_id = get_new_curr_id(resolved_user_id)
+    new_id = await get_new_curr_id(resolved_user_id)
     payload = {
         "id": new_id,
         "userId": resolved_user_id,
@@ -87,73 +271,58 @@ def store_curriculum(curriculum: Dict[str, Any], user_id: str | None = None) ->
         "curriculum": curriculum.get("curriculum", []),
         "created_at": {".sv": "timestamp"},
     }
-    firebase_put(f"curriculums/{resolved_user_id}/{new_id}", payload)
+    # The project and its summary in the per-user index are written together,
+    # so /client_projects never has to download curriculums.
+    await firebase_update_async({
+        f"curriculums/{resolved_user_id}/{new_id}": payload,
+        f"project_index/{resolved_user_id}/{new_id}": _project_summary(new_id, payload),
+    })
     return new_id
 
-def _call_curriculum_agent(payload: Dict[str, Any]) -> Dict[str, Any]:
-    client = OpenAI()
-    messages = [
-        {"role": "system", "content": CURRICULUM_AGENT_SYSTEM_PROMPT},
-        {"role": "user", "content": json.dumps(payload, ensure_ascii=True)},
-    ]
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=0.2,
-        )
-        content = response.choices[0].message.content
-    except Exception:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.2,
-        )
-        content = response.choices[0].message.content
-    return json.loads(content)
-
-def _call_exercises_agent(topic: str, notes: str) -> Dict[str, Any]:
-    client = OpenAI()
-    messages = [
-        {"role": "system", "content": EXERCISES_AGENT_SYSTEM_PROMPT},
-        {
-            "role": "user",
-            "content": json.dumps(
-                {"topic": topic, "notes": notes},
-                ensure_ascii=True,
-            ),
-        },
-    ]
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            response_format={"type": "json_object"},
-            temperature=0.2,
-        )
-        content = response.choices[0].message.content
-    except Exception:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.2,
-        )
-        content = response.choices[0].message.content
-    return json.loads(content)
-
-def _rag_notes_for_module(module: Module) -> str:
-    prompt = (
-        "Provide concise study notes to teach this topic and help create "
-        "theoretical and practical exercises. Focus on key concepts, steps, and pitfalls. "
-        f"Topic: {module["titulo"]}"
+@traced("curriculum_agent")
+async def _call_curriculum_agent(description: str) -> CurriculumAgentOutput:
+    # A module that fails validation is sent back for repair on its own;
+    # identical descriptions are answered from the structured-output cache.
+    return await generate_structured(
+        [
+            {"role": "system", "content": CURRICULUM_AGENT_SYSTEM_PROMPT},
+            {"role": "user", "content": json.dumps(description, ensure_ascii=True)},
+        ],
+        CurriculumAgentOutput,
+        list_field="curriculum",
     )
-    retrieval_result = query_index(app.llama_index, prompt)
-    return retrieval_result.response
+
+@traced("exercises_agent")
+async def _call_exercises_agent(topic: str, notes: str) -> ExercisesAgentOutput:
+    # Exercises that are still invalid after one repair are dropped rather
+    # than failing the whole module.
+    return await generate_structured(
+        [
+            {"role": "system", "content": EXERCISES_AGENT_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": json.dumps(
+                    {"topic": topic, "notes": notes},
+                    ensure_ascii=True,
+                ),
+            },
+        ],
+        ExercisesAgentOutput,
+        list_field="ejercicios",
+        drop_invalid_items=True,
+    )
+
+def _rag_notes_for_module(module_title: str) -> str:
+    # The exercises agent writes from the retrieved chunks directly; no
+    # intermediate LLM summary.
+    from src.llama_index_template import retrieve_context
+
+    chunks = retrieve_context(rag_index.get(), module_title, mmr=True)
+    return "\n\n---\n\n".join(chunk["text"] for chunk in chunks)
 
 
 TUTOR_SYSTEM_PROMPT = (
-    "Eres un tutor de programación experto y cercano para una plataforma de aprendizaje técnico. ",
+    "Eres un tutor de programación experto y cercano para una plataforma de aprendizaje técnico. "
     "Tu misión es ayudar al alumno a entender los conceptos del ejercicio actual sin darle directamente la respuesta. "
     "Usa el método socrático: guía con preguntas, pistas y analogías. "
     "Sé conciso (máximo 3-4 oraciones por respuesta), amigable y usa emojis con moderación. "
@@ -171,28 +340,35 @@ class TutorMessage(BaseModel):
 class TutorChatRequest(BaseModel):
     messages: List[TutorMessage]
     exercise_context: str = ""  # Title/description of the current exercise
+    session_id: str = ""  # Keys the server-side summary of older turns
+
+
+tutor_context = TutorContext()
+
+
+async def _tutor_messages(payload: TutorChatRequest) -> List[Dict[str, str]]:
+    # Build message history for OpenAI
+    system_msg = TUTOR_SYSTEM_PROMPT
+    if payload.exercise_context:
+        system_msg += f"\n\nContexto del ejercicio actual: {payload.exercise_context}"
+
+    history = [{"role": msg.role, "content": msg.content} for msg in payload.messages]
+    # Long sessions send the latest turns verbatim and the rest as a summary,
+    # so the prompt stays within a fixed token budget.
+    with span("tutor_context"):
+        return await tutor_context.build(system_msg, history, payload.session_id, payload.exercise_context)
 
 
 @app.post('/tutor_chat')
-def tutor_chat(payload: TutorChatRequest):
+async def tutor_chat(payload: TutorChatRequest):
     try:
-        client = OpenAI()
-
-        # Build message history for OpenAI
-        system_msg = TUTOR_SYSTEM_PROMPT
-        if payload.exercise_context:
-            system_msg += f"\n\nContexto del ejercicio actual: {payload.exercise_context}"
-
-        openai_messages = [{"role": "system", "content": system_msg}]
-        for msg in payload.messages:
-            openai_messages.append({"role": msg.role, "content": msg.content})
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=openai_messages,
-            temperature=0.7,
-            max_tokens=200,
-        )
+        openai_messages = await _tutor_messages(payload)
+        with span("tutor_chat"):
+            response = await chat_completion_async(
+                messages=openai_messages,
+                temperature=0.7,
+                max_tokens=200,
+            )
 
         reply = response.choices[0].message.content
         return {"reply": reply}
@@ -203,10 +379,37 @@ def tutor_chat(payload: TutorChatRequest):
         raise HTTPException(500, detail=str(e))
 
 
+@app.post('/tutor_chat/stream')
+async def tutor_chat_stream(payload: TutorChatRequest):
+    # Same reply as /tutor_chat, sent as Server-Sent Events: one "token" event
+    # per delta, then "done" with the full reply (or "error").
+    try:
+        openai_messages = await _tutor_messages(payload)
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+
+    async def events():
+        reply = []
+        try:
+            async for delta in chat_completion_stream_async(
+                messages=openai_messages,
+                temperature=0.7,
+                max_tokens=200,
+            ):
+                reply.append(delta)
+                yield sse_event({"delta": delta}, "token")
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, "error")
+            return
+        yield sse_event({"reply": "".join(reply)}, "done")
+
+    return sse_response(events())
+
+
 @app.post('/create_client', response_model=ClientResponse)
-def create_client():
+async def create_client():
     try:
-        new_id = firebase_post(
+        new_id = await firebase_post_async(
             "clients",
             {"created_at": {".sv": "timestamp"}},
         )
@@ -220,29 +423,18 @@ def create_client():
 
 @app.post('/create_project', response_model=CurriculumResponse)
 @app.post('/create_project', response_model=CurriculumResponse)
-def create_project(payload: CurriculumRequest):
+async def create_project(payload: CurriculumRequest):
     try:
-        agent_output = _call_curriculum_agent(payload.description)
-        nombre_proyecto = agent_output.get("nombre")
-        curriculum = agent_output.get("curriculum")
-        
-        if not isinstance(nombre_proyecto, str):
-            raise HTTPException(502, detail="Agent response missing 'nombre' string.")
-        if not isinstance(curriculum, list):
-            raise HTTPException(502, detail="Agent response missing 'curriculum' list of topics.")
-        
-        for index, item in enumerate(curriculum):
-            if not isinstance(item, dict):
-                raise HTTPException(502, detail=f"Curriculum item at index {index} must be an object.")
-            
+        agent_output = await _call_curriculum_agent(payload.description)
+        nombre_proyecto = agent_output.nombre
+        curriculum = []
+        for index, topic in enumerate(agent_output.curriculum):
             # Inyectamos los campos que la IA no nos da o que son valores iniciales
+            item = topic.model_dump()
             item["moduleId"] = index  # Se inyecta como entero
             item["was_completed"] = False
             item["ejercicios"] = []   # Garantizamos que exista la clave para Firebase
-            
-            # Validación de las claves requeridas que sí debe devolver la IA
-            if "titulo" not in item or "nivel_dificultad" not in item or "tarea_aprendizaje" not in item:
-                raise HTTPException(502, detail=f"Topic at index {index} is missing required fields.")
+            curriculum.append(item)
 
         curriculum_record = {
             "userId": payload.userId, 
@@ -250,40 +442,177 @@ def create_project(payload: CurriculumRequest):
             "curriculum": curriculum
         }
         
-        curriculum_id = store_curriculum(curriculum_record)
+        curriculum_id = await store_curriculum(curriculum_record)
         curriculum_record["id"] = curriculum_id
+        exercise_pregenerator.schedule(
+            payload.userId,
+            curriculum_id,
+            {str(position): item for position, item in enumerate(curriculum)},
+        )
 
         return curriculum_record
         
+    except StructuredOutputError as e:
+        raise HTTPException(502, detail=str(e))
     except Exception as e:
         if isinstance(e, HTTPException):
             raise
         raise HTTPException(500, detail=str(e))
 
-@app.post('/get_questions')
-def get_questions(payload: GetQuestionsRequest):
+def _matches_module(item: Any, module_id: Any) -> bool:
+    return isinstance(item, dict) and str(item.get("moduleId")) == str(module_id)
+
+
+async def _find_module(
+    project_path: str,
+    module_id: Any,
+    project_missing_detail: str,
+    module_missing_detail: str,
+) -> Tuple[str, Dict[str, Any]]:
+    # moduleId is the module's position when the curriculum is created, so
+    # try that single child first and only scan the curriculum if it moved.
+    direct = await firebase_get_async(f"{project_path}/curriculum/{module_id}", cached=True)
+    if _matches_module(direct, module_id):
+        return str(module_id), direct
+
+    modules = await firebase_get_async(f"{project_path}/curriculum", cached=True)
+    if not modules:
+        raise HTTPException(404, detail=project_missing_detail)
+    if not isinstance(modules, (list, dict)):
+        raise HTTPException(500, detail="Stored curriculum is invalid.")
+
+    for position, item in firebase_children(modules).items():
+        if _matches_module(item, module_id):
+            return str(position), item
+    raise HTTPException(404, detail=module_missing_detail)
+
+
+GENERATION_LEASE_SECONDS = float(os.getenv("GENERATION_LEASE_SECONDS", "180"))
+GENERATION_POLL_SECONDS = 1.0
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+exercise_flights = SingleFlight()
+
+
+def _lease_is_live(marker: Any) -> bool:
+    if not isinstance(marker, dict) or marker.get("state") != "generating":
+        return False
+    started_at = marker.get("started_at")
+    return isinstance(started_at, (int, float)) and time.time() * 1000 - started_at < GENERATION_LEASE_SECONDS * 1000
+
+
+async def _claim_generation(module_path: str) -> bool:
+    # The in-progress marker lets other workers wait for this generation
+    # instead of starting their own. Claimed with a compare-and-set so only
+    # one worker wins; returns False if a live claim already exists.
+    marker_path = f"{module_path}/ejercicios_status"
+    marker = {"state": "generating", "owner": WORKER_ID, "started_at": int(time.time() * 1000)}
     try:
-        stored = firebase_get(f"curriculums/{payload.userId}/{payload.curriculumId}")
-        if not stored:
-            raise HTTPException(404, detail="Curriculum not found.")
-
-        modules = stored.get("curriculum")
-        if not isinstance(modules, list):
-            raise HTTPException(500, detail="Stored curriculum is invalid.")
-
-        module = None
-        for item in modules:
-            if not isinstance(item, dict):
-                continue
-            try:
-                if int(item.get("moduleId")) == payload.moduleId:
-                    module = item
-                    break
-            except Exception:
-                continue
-
-        if not module:
+        current, etag = await firebase_get_with_etag_async(marker_path)
+    except FirebaseETagUnsupported:
+        if _lease_is_live(await firebase_get_async(marker_path)):
+            return False
+        await firebase_put_async(marker_path, marker)
+        return True
+    if _lease_is_live(current):
+        return False
+    written, _, _ = await firebase_put_if_match_async(marker_path, marker, etag)
+    return written
+
+
+async def _ensure_module_exists(module_path: str) -> None:
+    # A write under a deleted project would recreate part of it, so every
+    # claim and the final write check the module first.
+    if not await firebase_get_async(f"{module_path}/titulo"):
+        raise HTTPException(404, detail="Module not found in curriculum.")
+
+
+async def _wait_for_generation(module_path: str) -> Any:
+    # Polls until the owning worker stores the exercises or its lease lapses.
+    while True:
+        await asyncio.sleep(GENERATION_POLL_SECONDS)
+        module = await firebase_get_async(module_path)
+        if not isinstance(module, dict) or not module.get("titulo"):
             raise HTTPException(404, detail="Module not found in curriculum.")
+        ejercicios = module.get("ejercicios")
+        if isinstance(ejercicios, list) and ejercicios:
+            return ejercicios
+        if not _lease_is_live(module.get("ejercicios_status")):
+            return None
+
+
+async def _generate_module_exercises(project_path: str, position: str, module_title: str) -> List[Any]:
+    module_path = f"{project_path}/curriculum/{position}"
+    while True:
+        await _ensure_module_exists(module_path)
+        if await _claim_generation(module_path):
+            break
+        ejercicios = await _wait_for_generation(module_path)
+        if ejercicios:
+            return ejercicios
+
+    try:
+        # Another worker may have finished between our read and our claim.
+        existing = await firebase_get_async(f"{module_path}/ejercicios")
+        if isinstance(existing, list) and existing:
+            await firebase_patch_async(module_path, {"ejercicios_status": None})
+            return existing
+
+        notes = await run_in_threadpool(_rag_notes_for_module, module_title)
+        try:
+            agent_out = await _call_exercises_agent(module_title, notes)
+        except StructuredOutputError as e:
+            raise HTTPException(502, detail=str(e)) from e
+        ejercicios = [exercise.model_dump(mode="json") for exercise in agent_out.ejercicios]
+        await _ensure_module_exists(module_path)
+    except BaseException:
+        # Writing null never creates a node, even if the module is gone.
+        await firebase_patch_async(module_path, {"ejercicios_status": None})
+        raise
+
+    # Only this module's exercises go over the wire; the rest of the
+    # curriculum (and concurrent edits to it) is left alone. The same write
+    # releases the in-progress marker.
+    await firebase_patch_async(module_path, {"ejercicios": ejercicios, "ejercicios_status": None})
+    return ejercicios
+
+
+def _exercise_flight_key(user_id: str, project_id: str, module_id: Any) -> Tuple[str, str, str]:
+    return (user_id, project_id, str(module_id))
+
+
+async def _pregenerate_module_exercises(user_id: str, project_id: str, position: str, module: Dict[str, Any]) -> Any:
+    # Shares the flight with /get_questions, so a user who opens the module
+    # mid-generation waits for this run instead of starting another.
+    module_title = module.get("titulo")
+    if not module_title:
+        return None
+    project_path = f"curriculums/{user_id}/{project_id}"
+    return await exercise_flights.do(
+        _exercise_flight_key(user_id, project_id, module.get("moduleId", position)),
+        lambda: _generate_module_exercises(project_path, position, module_title),
+    )
+
+
+exercise_pregenerator = ExercisePregenerator(_pregenerate_module_exercises)
+
+
+async def _schedule_pregeneration(user_id: str, project_id: str) -> None:
+    modules = await firebase_get_async(f"curriculums/{user_id}/{project_id}/curriculum", cached=True)
+    if isinstance(modules, (list, dict)):
+        exercise_pregenerator.schedule(user_id, project_id, firebase_children(modules))
+
+
+@app.post('/get_questions')
+async def get_questions(payload: GetQuestionsRequest):
+    try:
+        project_path = f"curriculums/{payload.userId}/{payload.curriculumId}"
+        position, module = await _find_module(
+            project_path,
+            payload.moduleId,
+            "Curriculum not found.",
+            "Module not found in curriculum.",
+        )
 
         existing_ejercicios = module.get("ejercicios")
         if isinstance(existing_ejercicios, list) and existing_ejercicios:
@@ -295,16 +624,13 @@ def get_questions(payload: GetQuestionsRequest):
         if not module_title:
             raise HTTPException(500, detail="Module title is missing.")
 
-        notes = _rag_notes_for_module(module_title)
-        agent_out = _call_exercises_agent(module_title, notes)
-        ejercicios = agent_out.get("ejercicios")
-        if not isinstance(ejercicios, list):
-            raise HTTPException(502, detail="Agent response missing 'ejercicios'.")
-
-        module["ejercicios"] = ejercicios
-
-        stored["curriculum"] = modules
-        firebase_put(f"curriculums/{payload.userId}/{payload.curriculumId}", stored)
+        # Double clicks and parallel tabs share one generation instead of
+        # paying for (and racing) a second one.
+        flight_key = _exercise_flight_key(payload.userId, payload.curriculumId, payload.moduleId)
+        ejercicios = await exercise_flights.do(
+            flight_key,
+            lambda: _generate_module_exercises(project_path, position, module_title),
+        )
 
         return {
             "ejercicios": ejercicios,
@@ -321,32 +647,59 @@ class ProjectSummary(BaseModel):
     nombre: str
     created_at: Any  # Usamos Any temporalmente por cómo Firebase maneja los timestamps
 
+def _firebase_key_order(key: str):
+    # Firebase orders numeric keys numerically, before any other key.
+    return (0, int(key), "") if key.isdigit() else (1, 0, key)
+
+
+async def _backfill_project_index(user_id: str, project_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    # Projects stored before the index existed: read just their summary
+    # fields (never the modules) and record them for next time.
+    async def read_summary(project_id: str) -> Dict[str, Any]:
+        base = f"curriculums/{user_id}/{project_id}"
+        project_key, nombre, created_at = await asyncio.gather(
+            firebase_get_async(f"{base}/id"),
+            firebase_get_async(f"{base}/nombre"),
+            firebase_get_async(f"{base}/created_at"),
+        )
+        data = {"id": project_key, "nombre": nombre, "created_at": created_at}
+        return _project_summary(project_id, {k: v for k, v in data.items() if v is not None})
+
+    summaries = await asyncio.gather(*(read_summary(project_id) for project_id in project_ids))
+    backfilled = dict(zip(project_ids, summaries))
+    if backfilled:
+        await firebase_update_async({
+            f"project_index/{user_id}/{project_id}": summary
+            for project_id, summary in backfilled.items()
+        })
+    return backfilled
+
+
 @app.get('/client_projects/{user_id}', response_model=List[ProjectSummary])
-def get_client_projects(user_id: str):
+async def get_client_projects(user_id: str):
     try:
-        # Recuperamos todos los proyectos del usuario desde Firebase
-        user_projects_data = firebase_get(f"curriculums/{user_id}")
-        
+        # Leemos el índice ligero de proyectos y, en paralelo, solo las claves
+        # de los proyectos (shallow), nunca los módulos ni los ejercicios
+        index_data, project_keys = await asyncio.gather(
+            firebase_get_async(f"project_index/{user_id}"),
+            firebase_get_async(f"curriculums/{user_id}", shallow=True),
+        )
+        summaries = firebase_children(index_data)
+        project_ids = list(firebase_children(project_keys).keys())
+
         # Si el usuario no existe o no tiene proyectos, devolvemos una lista vacía
-        if not user_projects_data:
+        if not project_ids:
             return []
 
-        projects_list = []
-        
-        # Iteramos sobre los valores del diccionario devuelto por Firebase
-        for project_data in user_projects_data.values():
-            if not isinstance(project_data, dict):
-                continue
-                
-            # Extraemos únicamente los campos necesarios
-            project_summary = {
-                "id": project_data.get("id", ""),
-                "nombre": project_data.get("nombre", "Proyecto sin nombre"),
-                "created_at": project_data.get("created_at")
-            }
-            projects_list.append(project_summary)
-            
-        return projects_list
+        missing = [project_id for project_id in project_ids if project_id not in summaries]
+        if missing:
+            summaries.update(await _backfill_project_index(user_id, missing))
+
+        return [
+            _project_summary(project_id, summaries[project_id])
+            for project_id in sorted(project_ids, key=_firebase_key_order)
+            if isinstance(summaries.get(project_id), dict)
+        ]
 
     except Exception as e:
         # Capturamos y relanzamos errores HTTP (como el de FirebaseError si hereda o se lanza internamente)
@@ -356,13 +709,13 @@ def get_client_projects(user_id: str):
 
 
 @app.get('/project_details/{user_id}/{project_id}', response_model=Dict[str, Any])
-def get_project_details(user_id: str, project_id: str):
+async def get_project_details(user_id: str, project_id: str):
     try:
         # 1. Construimos la ruta exacta del nodo en Firebase
         path = f"curriculums/{user_id}/{project_id}"
         
         # 2. Hacemos la llamada a la base de datos
-        project_data = firebase_get(path)
+        project_data = await firebase_get_async(path, cached=True)
         
         # 3. Validamos la existencia del recurso
         if not project_data:
@@ -384,39 +737,22 @@ class CompleteModuleRequest(BaseModel):
     moduleId: str = Field(..., min_length=1)
 
 @app.post('/complete_module')
-def complete_module(payload: CompleteModuleRequest):
+async def complete_module(payload: CompleteModuleRequest, background_tasks: BackgroundTasks):
     try:
-        # 1. Recuperamos el proyecto completo desde Firebase
+        # 1. Localizamos el módulo sin descargar el proyecto completo
         path = f"curriculums/{payload.userId}/{payload.projectId}"
-        stored_project = firebase_get(path)
-        
-        if not stored_project:
-            raise HTTPException(status_code=404, detail="Project not found.")
+        position, _ = await _find_module(
+            path,
+            payload.moduleId,
+            "Project not found.",
+            "Module not found in the project.",
+        )
 
-        # 2. Extraemos el array del curriculum
-        curriculum = stored_project.get("curriculum")
-        if not isinstance(curriculum, list):
-            raise HTTPException(status_code=500, detail="Stored curriculum is invalid.")
-
-        # 3. Buscamos el módulo por su ID y actualizamos su estado
-        module_found = False
-        for item in curriculum:
-            if not isinstance(item, dict):
-                continue
-                
-            # Comparamos como strings para garantizar la coincidencia
-            if str(item.get("moduleId")) == payload.moduleId:
-                item["was_completed"] = True
-                module_found = True
-                break  # Salimos del bucle una vez encontrado para optimizar
-
-        # Si recorremos todo el array y no encontramos el módulo, lanzamos error
-        if not module_found:
-            raise HTTPException(status_code=404, detail="Module not found in the project.")
-
-        # 4. Sobrescribimos el proyecto en Firebase con el módulo actualizado
-        stored_project["curriculum"] = curriculum
-        firebase_put(path, stored_project)
+        # 2. Actualizamos solo el flag del módulo en Firebase
+        await firebase_patch_async(f"{path}/curriculum/{position}", {"was_completed": True})
+
+        # 3. Preparamos los ejercicios de los siguientes módulos tras responder
+        background_tasks.add_task(_schedule_pregeneration, payload.userId, payload.projectId)
 
         return {
             "message": "Module marked as completed successfully.", 
@@ -430,25 +766,156 @@ def complete_module(payload: CompleteModuleRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post('/rebuild_index')
-def rebuild_index():
+@app.delete('/projects/{user_id}/{project_id}')
+async def delete_project(user_id: str, project_id: str):
     try:
-        app.llama_index = initialize_index(True)
-        return {'message': 'The index has been successfully rebuilt'}
+        path = f"curriculums/{user_id}/{project_id}"
+        project_key = await firebase_get_async(f"{path}/id")
+        if project_key is None:
+            raise HTTPException(status_code=404, detail="Project not found.")
+
+        # Stop pending and running generations first so none of them writes
+        # exercises back into the deleted project.
+        await exercise_pregenerator.cancel_project(user_id, project_id)
+        flights = exercise_flights.cancel(lambda key: key[:2] == (user_id, project_id))
+        if flights:
+            await asyncio.wait(flights)
+
+        await firebase_update_async({
+            path: None,
+            f"project_index/{user_id}/{project_id}": None,
+        })
+        return {"message": "Project deleted successfully.", "id": project_id}
+
     except Exception as e:
-        return HTTPException(500, detail=str(e))
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post('/rebuild_index', status_code=202)
+async def rebuild_index():
+    # The rebuild runs in the background; queries keep using the current index.
+    job = index_rebuilder.submit()
+    return {'message': 'Index rebuild started', **job}
+
+
+@app.get('/rebuild_index/{job_id}')
+async def rebuild_index_status(job_id: str):
+    job = index_rebuilder.get(job_id)
+    if not job:
+        raise HTTPException(404, detail="Rebuild job not found.")
+    return job
+
+def _answer_query(user_query: str) -> str:
+    from src.llama_index_template import answer_query
+
+    return answer_query(rag_index.get(), user_query)
+
+
+def _retrieve_context(user_query: str, **kwargs: Any) -> List[Dict[str, Any]]:
+    from src.llama_index_template import retrieve_context
+
+    return retrieve_context(rag_index.get(), user_query, **kwargs)
+
 
 @app.get('/query')
-def query(user_query: str):
+async def query(user_query: str):
     try:
-        retrieval_result = query_index(app.llama_index, user_query)
+        result = await run_in_threadpool(_answer_query, user_query)
 
         return {
-            "result": retrieval_result.response
+            "result": result
         }
 
     except Exception as e:
         return HTTPException(500, detail=str(e))
 
+@app.get('/retrieve')
+async def retrieve(
+    user_query: str,
+    top_k: int = Query(RETRIEVAL_TOP_K, ge=1),
+    mmr: bool = False,
+    max_tokens: int = Query(RETRIEVAL_MAX_TOKENS, ge=1),
+    mode: str = RETRIEVAL_MODE,
+):
+    try:
+        chunks = await run_in_threadpool(
+            _retrieve_context,
+            user_query,
+            similarity_top_k=top_k,
+            mmr=mmr,
+            max_tokens=max_tokens,
+            mode=mode,
+        )
+        return {"chunks": chunks}
+
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+    except Exception as e:
+        raise HTTPException(500, detail=str(e))
+
+
+@app.get('/query/stream')
+async def query_stream(user_query: str):
+    # Generator is iterated on the threadpool; LlamaIndex streams synchronously.
+    def events():
+        from src.llama_index_template import stream_answer
+
+        result = []
+        try:
+            for delta in stream_answer(rag_index.get(), user_query):
+                result.append(delta)
+                yield sse_event({"delta": delta}, "token")
+        except Exception as e:
+            yield sse_event({"detail": str(e)}, "error")
+            return
+        yield sse_event({"result": "".join(result)}, "done")
+
+    return sse_response(events())
+
+def _component_samples():
+    # Hit rates and queue depths owned by other modules, read at scrape time.
+    caches = {"firebase": cache_stats(), "llm": get_structured_cache().stats()}
+    if rag_index.ready:
+        # The embedding and response caches belong to the index; reporting
+        # them earlier would import LlamaIndex just for a scrape.
+        from src.llama_index_template import embedding_cache_stats
+        from src.response_cache import get_response_cache
+
+        caches["embedding"] = embedding_cache_stats()
+        caches["response"] = get_response_cache().stats()
+    hit_fields = {"memory_hits", "disk_hits", "exact_hits", "semantic_hits", "hits", "revalidated"}
+    for cache, stats in caches.items():
+        for field in hit_fields | {"misses"}:
+            if field in stats:
+                yield "cache_lookups_total", "counter", {"cache": cache, "result": field}, stats[field]
+        yield "cache_hit_ratio", "gauge", {"cache": cache}, stats["hit_rate"]
+    for field, value in exercise_pregenerator.stats().items():
+        kind = "gauge" if field in ("queued", "running") else "counter"
+        name = f"pregeneration_{field}" if kind == "gauge" else f"pregeneration_{field}_total"
+        yield name, kind, {}, value
+    tutor = tutor_context.stats()
+    yield "tutor_sessions", "gauge", {}, tutor["sessions"]
+    yield "tutor_summaries_total", "counter", {}, tutor["summaries"]
+
+
+registry.register_collector(_component_samples)
+
+
+@app.get('/ready')
+async def ready():
+    # 200 once the index is loaded and retrieval will not stall; 503 while it
+    # is loading (or failed to load, see "error").
+    status = rag_index.status()
+    return JSONResponse(status, status_code=200 if rag_index.ready else 503)
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format; counters are per process.
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == '__main__':
     uvicorn.run(app, host="127.0.0.1", port=8000)
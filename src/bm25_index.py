@@ -0,0 +1,150 @@
+import json
+import os
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.ann_index import ids_fingerprint
+from src.vector_search import top_k_rows
+
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Postings in CSR form: term t's documents are rows[offsets[t]:offsets[t+1]],
+# with matching term frequencies in tfs.
+BM25_OFFSETS_FNAME = "bm25_offsets.npy"
+BM25_ROWS_FNAME = "bm25_rows.npy"
+BM25_TFS_FNAME = "bm25_tfs.npy"
+BM25_DOC_LENGTHS_FNAME = "bm25_doc_lengths.npy"
+BM25_META_FNAME = "bm25_meta.json"
+
+# Keeps identifiers such as useEffect, node.js, c++, c#, ORDER_BY intact.
+_TOKEN_RE = re.compile(r"[a-z0-9_#+]+(?:[.\-][a-z0-9_#+]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    # Case- and accent-insensitive, so "Introducción" matches "introduccion".
+    folded = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _TOKEN_RE.findall(folded)
+
+
+class BM25Index:
+    def __init__(
+        self,
+        ids: Sequence[str],
+        terms: Sequence[str],
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+        doc_lengths: np.ndarray,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> None:
+        self.ids = list(ids)
+        self.terms = list(terms)
+        self.term_ids: Dict[str, int] = {term: i for i, term in enumerate(self.terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+        # Per-document BM25 length norm, computed once.
+        self._norms = (k1 * (1.0 - b + b * doc_lengths / max(self.avg_doc_length, 1e-9))).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids: Sequence[str], texts: Sequence[str], k1: float = BM25_K1, b: float = BM25_B) -> "BM25Index":
+        vocabulary: Dict[str, int] = {}
+        postings: List[List[Tuple[int, int]]] = []
+        doc_lengths = np.zeros(len(ids), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths[row] = sum(counts.values())
+            for term, tf in counts.items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((row, tf))
+
+        offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(p) for p in postings])
+        rows = np.fromiter((row for p in postings for row, _ in p), dtype=np.int32, count=int(offsets[-1]))
+        tfs = np.fromiter((tf for p in postings for _, tf in p), dtype=np.float32, count=int(offsets[-1]))
+        return cls(ids, list(vocabulary), offsets, rows, tfs, doc_lengths, k1, b)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        n_docs = len(self.ids)
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows, tfs = self.rows[start:end], self.tfs[start:end]
+            df = end - start
+            idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+            # Each document appears once per term, so plain fancy-index += is safe.
+            scores[rows] += idf * tfs * (self.k1 + 1.0) / (tfs + self._norms[rows])
+        return scores
+
+    def search(self, query: str, k: int) -> Tuple[List[float], List[str]]:
+        if not self.ids or k <= 0:
+            return [], []
+        scores = self.scores(query)
+        top = top_k_rows(scores, min(k, len(self.ids)))
+        # Documents sharing no term with the query are not matches.
+        top = top[scores[top] > 0]
+        return scores[top].tolist(), [self.ids[i] for i in top]
+
+    def save(self, persist_dir: str) -> None:
+        os.makedirs(persist_dir, exist_ok=True)
+        np.save(os.path.join(persist_dir, BM25_OFFSETS_FNAME), self.offsets)
+        np.save(os.path.join(persist_dir, BM25_ROWS_FNAME), self.rows)
+        np.save(os.path.join(persist_dir, BM25_TFS_FNAME), self.tfs)
+        np.save(os.path.join(persist_dir, BM25_DOC_LENGTHS_FNAME), self.doc_lengths)
+        with open(os.path.join(persist_dir, BM25_META_FNAME), "w", encoding="utf-8") as f:
+            json.dump(
+                {"k1": self.k1, "b": self.b, "ids": self.ids, "terms": self.terms,
+                 "fingerprint": ids_fingerprint(self.ids)},
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+
+    @classmethod
+    def load(cls, persist_dir: str, ids: Optional[Sequence[str]] = None) -> Optional["BM25Index"]:
+        meta_path = os.path.join(persist_dir, BM25_META_FNAME)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # Postings built for other nodes would return ids the docstore lacks.
+        if ids is not None and meta.get("fingerprint") != ids_fingerprint(ids):
+            return None
+        return cls(
+            meta["ids"],
+            meta["terms"],
+            np.load(os.path.join(persist_dir, BM25_OFFSETS_FNAME)),
+            np.load(os.path.join(persist_dir, BM25_ROWS_FNAME), mmap_mode="r"),
+            np.load(os.path.join(persist_dir, BM25_TFS_FNAME), mmap_mode="r"),
+            np.load(os.path.join(persist_dir, BM25_DOC_LENGTHS_FNAME)),
+            meta["k1"],
+            meta["b"],
+        )
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    # Only ranks matter, so BM25 and cosine scores need no calibration.
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking):
+            fused[node_id] = fused.get(node_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
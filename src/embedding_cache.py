@@ -0,0 +1,216 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from src.openai_client import openai_slot, openai_slot_async
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./storage/embedding_cache.sqlite")
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "4096"))
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    # SQLite holds every vector as a float32 blob; an in-memory LRU sits in
+    # front so hot keys (repeated module titles) skip the disk entirely.
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS) -> None:
+        self.path = path
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[Tuple[str, str], List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._inherited: List[sqlite3.Connection] = []
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets several uvicorn workers read while one writes.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, key TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, key))"
+        )
+        conn.commit()
+        return conn
+
+    def reopen(self) -> None:
+        # For a forked child: SQLite connections must not cross a fork. The
+        # parent's is kept unclosed, since closing it here could release
+        # locks the parent still relies on.
+        self._inherited.append(self._conn)
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _remember(self, cache_key: Tuple[str, str], vector: List[float]) -> None:
+        self._memory[cache_key] = vector
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        keys = [text_key(text) for text in texts]
+        found: List[Optional[List[float]]] = [None] * len(texts)
+        with self._lock:
+            missing: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get((model, key))
+                if vector is not None:
+                    self._memory.move_to_end((model, key))
+                    found[i] = vector
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                placeholders = ",".join("?" * len(missing))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({placeholders})",
+                    [model, *missing.keys()],
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                    self._remember((model, key), vector)
+                    for i in missing.pop(key):
+                        found[i] = vector
+                        self.disk_hits += 1
+                self.misses += sum(len(positions) for positions in missing.values())
+        return found
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                self._remember((model, key), list(vector))
+                rows.append((model, key, np.asarray(vector, dtype=np.float32).tobytes()))
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (model, key, vector) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+
+def _reopen_after_fork() -> None:
+    if _cache is not None:
+        _cache.reopen()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reopen_after_fork)
+
+
+class CachedEmbedding(BaseEmbedding):
+    # Wraps another embedding model; only texts missing from the cache reach
+    # it, each call holding an OpenAI concurrency slot.
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: Optional[EmbeddingCache] = None, **kwargs: Any) -> None:
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._cache = cache or get_embedding_cache()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def _split(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], Dict[str, List[int]]]:
+        # Missing positions grouped by cache key, so duplicate chunks are embedded once.
+        found = self._cache.get_many(self.model_name, texts)
+        missing: Dict[str, List[int]] = {}
+        for i, vector in enumerate(found):
+            if vector is None:
+                missing.setdefault(text_key(texts[i]), []).append(i)
+        return found, missing
+
+    def _merge(self, texts: List[str], found, missing: Dict[str, List[int]], computed: List[List[float]]) -> List[List[float]]:
+        first_positions = [positions[0] for positions in missing.values()]
+        self._cache.put_many(self.model_name, [texts[i] for i in first_positions], computed)
+        for positions, vector in zip(missing.values(), computed):
+            for i in positions:
+                found[i] = vector
+        return found
+
+    def _missing_texts(self, texts: List[str], missing: Dict[str, List[int]]) -> List[str]:
+        return [texts[positions[0]] for positions in missing.values()]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        found, missing = self._split([query])
+        if not missing:
+            return found[0]
+        with openai_slot():
+            vector = self._inner._get_query_embedding(query)
+        return self._merge([query], found, missing, [vector])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        found, missing = self._split([query])
+        if not missing:
+            return found[0]
+        async with openai_slot_async():
+            vector = await self._inner._aget_query_embedding(query)
+        return self._merge([query], found, missing, [vector])[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        found, missing = self._split(texts)
+        if not missing:
+            return found
+        with openai_slot():
+            computed = self._inner._get_text_embeddings(self._missing_texts(texts, missing))
+        return self._merge(texts, found, missing, computed)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        found, missing = self._split(texts)
+        if not missing:
+            return found
+        async with openai_slot_async():
+            computed = await self._inner._aget_text_embeddings(self._missing_texts(texts, missing))
+        return self._merge(texts, found, missing, computed)
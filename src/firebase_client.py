@@ -1,61 +1,498 @@
 import os
 import json
-from typing import Any, Dict, Optional
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+from src.metrics import inc, span
+
 load_dotenv(override=True)
 
 FIREBASE_DB_URL = os.getenv("FIREBASE_DB_URL", "").rstrip("/")
 FIREBASE_DB_AUTH = os.getenv("FIREBASE_DB_AUTH", "")
 
+FIREBASE_TIMEOUT = float(os.getenv("FIREBASE_TIMEOUT", "15"))
+FIREBASE_POOL_SIZE = int(os.getenv("FIREBASE_POOL_SIZE", "100"))
+FIREBASE_HTTP2 = os.getenv("FIREBASE_HTTP2", "1") not in ("0", "false", "False")
+FIREBASE_MAX_RETRIES = int(os.getenv("FIREBASE_MAX_RETRIES", "3"))
+FIREBASE_BACKOFF_BASE = float(os.getenv("FIREBASE_BACKOFF_BASE", "0.2"))
+FIREBASE_BACKOFF_MAX = float(os.getenv("FIREBASE_BACKOFF_MAX", "3"))
+# Read-through cache for documents fetched with cached=True.
+FIREBASE_CACHE_MAX_BYTES = int(os.getenv("FIREBASE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+FIREBASE_CACHE_TTL = float(os.getenv("FIREBASE_CACHE_TTL", "5"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# POST creates a new child on every call, so it is only retried when the
+# request provably never reached the server.
+IDEMPOTENT_METHODS = {"GET", "PUT", "PATCH", "DELETE"}
+
+
+# Conditional requests: ask for the node's ETag, then write only if it is unchanged.
+ETAG_REQUEST_HEADER = "X-Firebase-ETag"
+IF_MATCH_HEADER = "if-match"
+IF_NONE_MATCH_HEADER = "If-None-Match"
+PRECONDITION_FAILED = 412
+NOT_MODIFIED = 304
+
 
 class FirebaseError(RuntimeError):
     pass
 
 
-def _build_url(path: str) -> str:
+class FirebaseETagUnsupported(FirebaseError):
+    pass
+
+
+def _build_url(path: str, params: Optional[Dict[str, str]] = None) -> str:
     if not FIREBASE_DB_URL:
         raise FirebaseError("FIREBASE_DB_URL is not set.")
     clean_path = path.strip("/")
     url = f"{FIREBASE_DB_URL}/{clean_path}.json"
+    if params:
+        url = f"{url}?{urlencode(params)}"
     if FIREBASE_DB_AUTH:
         joiner = "&" if "?" in url else "?"
         url = f"{url}{joiner}auth={FIREBASE_DB_AUTH}"
     return url
 
 
-def firebase_get(path: str) -> Any:
-    url = _build_url(path)
-    resp = requests.get(url, timeout=15)
-    if not resp.ok:
-        raise FirebaseError(f"GET {url} failed: {resp.status_code} {resp.text}")
-    if not resp.text:
+def _read_params(shallow: bool) -> Optional[Dict[str, str]]:
+    # shallow=true returns only the child keys (values become `true`).
+    return {"shallow": "true"} if shallow else None
+
+
+def firebase_children(value: Any) -> Dict[str, Any]:
+    # Firebase returns objects whose keys are mostly sequential integers as
+    # JSON arrays (with nulls for gaps); normalise both shapes to a dict.
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, list):
+        return {str(i): item for i, item in enumerate(value) if item is not None}
+    return {}
+
+
+def _clean_path(path: str) -> str:
+    return path.strip("/")
+
+
+class DocumentCache:
+    # LRU bounded by the size of the cached JSON. Entries younger than the TTL
+    # are served directly; older ones are revalidated against their ETag.
+    # Raw response text is kept (not the parsed value), so callers always get
+    # their own copy and the byte bound is exact.
+    def __init__(self, max_bytes: int = FIREBASE_CACHE_MAX_BYTES, ttl: float = FIREBASE_CACHE_TTL) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def lookup(self, path: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            self._entries.move_to_end(path)
+            return {**entry, "fresh": time.monotonic() - entry["fetched_at"] < self.ttl}
+
+    def record_hit(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+    def record_revalidated(self, path: str) -> None:
+        with self._lock:
+            self.revalidated += 1
+            if path in self._entries:
+                self._entries[path]["fetched_at"] = time.monotonic()
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def store(self, path: str, text: str, etag: str, generation: int) -> None:
+        size = len(text)
+        with self._lock:
+            # A write landed while this read was in flight; its result may be stale.
+            if generation != self._generation or size > self.max_bytes:
+                return
+            self._drop(path)
+            self._entries[path] = {"text": text, "etag": etag, "size": size, "fetched_at": time.monotonic()}
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["size"]
+                self.evictions += 1
+
+    def _drop(self, path: str) -> None:
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+
+    def invalidate(self, path: str) -> None:
+        # A write to `path` changes the path itself, everything below it and
+        # every ancestor document that embeds it.
+        path = _clean_path(path)
+        with self._lock:
+            self._generation += 1
+            for cached_path in list(self._entries):
+                if (
+                    not path
+                    or cached_path == path
+                    or cached_path.startswith(f"{path}/")
+                    or path.startswith(f"{cached_path}/")
+                    or not cached_path
+                ):
+                    self._drop(cached_path)
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.revalidated + self.misses
+            return {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.revalidated) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+document_cache = DocumentCache()
+
+
+def cache_stats() -> Dict[str, Any]:
+    return document_cache.stats()
+
+
+def _invalidate_for_write(method: str, path: str, payload: Any) -> None:
+    if method == "GET":
+        return
+    if method == "PATCH" and isinstance(payload, dict) and payload:
+        # PATCH only touches the listed children (full paths for multi-path updates).
+        base = _clean_path(path)
+        for key in payload:
+            document_cache.invalidate(f"{base}/{_clean_path(key)}" if base else key)
+    else:
+        document_cache.invalidate(path)
+
+
+def _revalidation_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    headers = {ETAG_REQUEST_HEADER: "true"}
+    if entry is not None:
+        headers[IF_NONE_MATCH_HEADER] = entry["etag"]
+    return headers
+
+
+def _cached_result(path: str, entry: Optional[Dict[str, Any]], generation: int, url: str, resp: Any) -> Any:
+    etag = resp.headers.get("ETag")
+    # Unchanged: either a 304, or a full body whose ETag matches ours (Firebase
+    # may ignore If-None-Match); both skip re-parsing a new document.
+    if entry is not None and (resp.status_code == NOT_MODIFIED or (etag and etag == entry["etag"])):
+        document_cache.record_revalidated(path)
+        return json.loads(entry["text"]) if entry["text"] else None
+    document_cache.record_miss()
+    value = _decode("GET", url, resp.status_code, resp.text)
+    if etag:
+        document_cache.store(path, resp.text, etag, generation)
+    return value
+
+
+def _backoff_delay(attempt: int) -> float:
+    # Full jitter: spreads retries from many workers instead of synchronising them.
+    return random.uniform(0, min(FIREBASE_BACKOFF_MAX, FIREBASE_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _should_retry_status(method: str, status_code: int) -> bool:
+    if status_code == 429:
+        return True
+    return method in IDEMPOTENT_METHODS and status_code in RETRY_STATUSES
+
+
+def _record_transfer(method: str, sent: Optional[str], received: bytes) -> None:
+    # Body sizes only; sent is ASCII JSON, so its length is its byte count.
+    inc("firebase_requests_total", method=method)
+    inc("firebase_payload_bytes_total", len(sent or ""), direction="sent")
+    inc("firebase_payload_bytes_total", len(received), direction="received")
+
+
+def _encode(payload: Any) -> str:
+    return json.dumps(payload, ensure_ascii=True)
+
+
+def _decode(method: str, url: str, status_code: int, text: str) -> Any:
+    if status_code >= 400:
+        raise FirebaseError(f"{method} {url} failed: {status_code} {text}")
+    if not text:
         return None
-    return resp.json()
+    return json.loads(text)
+
+
+# --- Sync client: one keep-alive session shared by every call. ---
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=FIREBASE_POOL_SIZE, pool_maxsize=FIREBASE_POOL_SIZE))
+    session.mount("http://", HTTPAdapter(pool_connections=FIREBASE_POOL_SIZE, pool_maxsize=FIREBASE_POOL_SIZE))
+    return session
+
+
+_session = _new_session()
+
+
+def _request_headers(payload: Any, extra: Optional[Dict[str, str]]) -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"} if payload is not None else {}
+    headers.update(extra or {})
+    return headers
+
+
+def _etag(method: str, url: str, headers: Any) -> str:
+    etag = headers.get("ETag")
+    if not etag:
+        raise FirebaseETagUnsupported(f"{method} {url} returned no ETag.")
+    return etag
+
+
+def _conditional_result(method: str, url: str, resp: Any) -> Tuple[bool, Any, Optional[str]]:
+    # On a 412 Firebase answers with the current value and ETag, so callers can
+    # retry their compare-and-set without another read.
+    if resp.status_code == PRECONDITION_FAILED:
+        return False, json.loads(resp.text) if resp.text else None, resp.headers.get("ETag")
+    return True, _decode(method, url, resp.status_code, resp.text), resp.headers.get("ETag")
+
+
+def _send(
+    method: str,
+    path: str,
+    payload: Any = None,
+    params: Optional[Dict[str, str]] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Tuple[str, requests.Response]:
+    url = _build_url(path, params)
+    _invalidate_for_write(method, path, payload)
+    data = _encode(payload) if payload is not None else None
+    headers = _request_headers(payload, headers)
+    try:
+        with span(f"firebase_{method.lower()}"):
+            for attempt in range(FIREBASE_MAX_RETRIES + 1):
+                try:
+                    resp = _session.request(method, url, data=data, headers=headers, timeout=FIREBASE_TIMEOUT)
+                except requests.exceptions.ConnectTimeout as e:
+                    if attempt == FIREBASE_MAX_RETRIES:
+                        raise FirebaseError(f"{method} {url} failed: {e}") from e
+                except requests.RequestException as e:
+                    if method not in IDEMPOTENT_METHODS or attempt == FIREBASE_MAX_RETRIES:
+                        raise FirebaseError(f"{method} {url} failed: {e}") from e
+                else:
+                    if attempt == FIREBASE_MAX_RETRIES or not _should_retry_status(method, resp.status_code):
+                        _record_transfer(method, data, resp.content)
+                        return url, resp
+                time.sleep(_backoff_delay(attempt))
+    finally:
+        # Again once the write is done (or may have landed): a cached read
+        # sent while it was pending can have stored the old value.
+        _invalidate_for_write(method, path, payload)
+
+
+def _request(method: str, path: str, payload: Any = None, params: Optional[Dict[str, str]] = None) -> Any:
+    url, resp = _send(method, path, payload, params)
+    return _decode(method, url, resp.status_code, resp.text)
+
+
+def firebase_get(path: str, shallow: bool = False, cached: bool = False) -> Any:
+    if not cached or shallow:
+        return _request("GET", path, params=_read_params(shallow))
+    path = _clean_path(path)
+    entry = document_cache.lookup(path)
+    if entry is not None and entry["fresh"]:
+        document_cache.record_hit()
+        return json.loads(entry["text"]) if entry["text"] else None
+    generation = document_cache.generation
+    url, resp = _send("GET", path, headers=_revalidation_headers(entry))
+    return _cached_result(path, entry, generation, url, resp)
 
 
 def firebase_post(path: str, payload: Dict[str, Any]) -> Optional[str]:
-    url = _build_url(path)
-    resp = requests.post(
-        url,
-        data=json.dumps(payload, ensure_ascii=True),
-        headers={"Content-Type": "application/json"},
-        timeout=15,
-    )
-    if not resp.ok:
-        raise FirebaseError(f"POST {url} failed: {resp.status_code} {resp.text}")
-    data = resp.json()
+    data = _request("POST", path, payload)
     return data.get("name")
 
 
 def firebase_put(path: str, payload: Dict[str, Any]) -> None:
-    url = _build_url(path)
-    resp = requests.put(
-        url,
-        data=json.dumps(payload, ensure_ascii=True),
-        headers={"Content-Type": "application/json"},
-        timeout=15,
-    )
-    if not resp.ok:
-        raise FirebaseError(f"PUT {url} failed: {resp.status_code} {resp.text}")
+    _request("PUT", path, payload)
+
+
+def firebase_patch(path: str, updates: Dict[str, Any]) -> None:
+    # Only the listed children of `path` are written; siblings are untouched.
+    _request("PATCH", path, updates)
+
+
+def firebase_update(updates: Dict[str, Any]) -> None:
+    # Multi-path update: keys are full paths, applied atomically in one request.
+    firebase_patch("", updates)
+
+
+# --- Async client: pooled httpx connections, HTTP/2 when h2 is installed. ---
+
+_async_client: Optional[httpx.AsyncClient] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def configure_async_client(transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+    # Lets tests route the client to an in-process fake database.
+    global _async_client, _async_transport
+    _async_transport = transport
+    _async_client = None
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    # httpx connections are bound to the loop that opened them.
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            http2=FIREBASE_HTTP2 and _http2_available(),
+            timeout=FIREBASE_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=FIREBASE_POOL_SIZE,
+                max_keepalive_connections=FIREBASE_POOL_SIZE,
+            ),
+            transport=_async_transport,
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+async def close_async_client() -> None:
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+    _async_client = None
+    _async_client_loop = None
+
+
+def _reset_after_fork() -> None:
+    # A forked worker must not share the parent's sockets: two processes
+    # writing to one keep-alive connection interleave their requests. The old
+    # clients are dropped, not closed, so the parent's connections stay open.
+    global _session, _async_client, _async_client_loop
+    _session = _new_session()
+    _async_client = None
+    _async_client_loop = None
+    document_cache._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+async def _send_async(
+    method: str,
+    path: str,
+    payload: Any = None,
+    params: Optional[Dict[str, str]] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Tuple[str, httpx.Response]:
+    url = _build_url(path, params)
+    _invalidate_for_write(method, path, payload)
+    client = _get_async_client()
+    content = _encode(payload) if payload is not None else None
+    headers = _request_headers(payload, headers)
+    try:
+        with span(f"firebase_{method.lower()}"):
+            for attempt in range(FIREBASE_MAX_RETRIES + 1):
+                try:
+                    resp = await client.request(method, url, content=content, headers=headers)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                    if attempt == FIREBASE_MAX_RETRIES:
+                        raise FirebaseError(f"{method} {url} failed: {e}") from e
+                except httpx.TransportError as e:
+                    if method not in IDEMPOTENT_METHODS or attempt == FIREBASE_MAX_RETRIES:
+                        raise FirebaseError(f"{method} {url} failed: {e}") from e
+                else:
+                    if attempt == FIREBASE_MAX_RETRIES or not _should_retry_status(method, resp.status_code):
+                        _record_transfer(method, content, resp.content)
+                        return url, resp
+                await asyncio.sleep(_backoff_delay(attempt))
+    finally:
+        _invalidate_for_write(method, path, payload)
+
+
+async def _request_async(method: str, path: str, payload: Any = None, params: Optional[Dict[str, str]] = None) -> Any:
+    url, resp = await _send_async(method, path, payload, params)
+    return _decode(method, url, resp.status_code, resp.text)
+
+
+async def firebase_get_async(path: str, shallow: bool = False, cached: bool = False) -> Any:
+    if not cached or shallow:
+        return await _request_async("GET", path, params=_read_params(shallow))
+    path = _clean_path(path)
+    entry = document_cache.lookup(path)
+    if entry is not None and entry["fresh"]:
+        document_cache.record_hit()
+        return json.loads(entry["text"]) if entry["text"] else None
+    generation = document_cache.generation
+    url, resp = await _send_async("GET", path, headers=_revalidation_headers(entry))
+    return _cached_result(path, entry, generation, url, resp)
+
+
+async def firebase_post_async(path: str, payload: Dict[str, Any]) -> Optional[str]:
+    data = await _request_async("POST", path, payload)
+    return data.get("name")
+
+
+async def firebase_put_async(path: str, payload: Dict[str, Any]) -> None:
+    await _request_async("PUT", path, payload)
+
+
+async def firebase_patch_async(path: str, updates: Dict[str, Any]) -> None:
+    await _request_async("PATCH", path, updates)
+
+
+async def firebase_update_async(updates: Dict[str, Any]) -> None:
+    await firebase_patch_async("", updates)
+
+
+async def firebase_get_with_etag_async(path: str) -> Tuple[Any, str]:
+    url, resp = await _send_async("GET", path, headers={ETAG_REQUEST_HEADER: "true"})
+    return _decode("GET", url, resp.status_code, resp.text), _etag("GET", url, resp.headers)
+
+
+async def firebase_put_if_match_async(path: str, payload: Any, etag: str) -> Tuple[bool, Any, Optional[str]]:
+    # Returns (written, value, etag); when not written, value/etag are the current ones.
+    url, resp = await _send_async("PUT", path, payload, headers={IF_MATCH_HEADER: etag})
+    return _conditional_result("PUT", url, resp)
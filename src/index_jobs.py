@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Rebuilds run one at a time on a dedicated thread; the request that starts
+# one only gets a job id back and polls for the result.
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+MAX_FINISHED_JOBS = 50
+REBUILD_JOBS_DIR = os.getenv("REBUILD_JOBS_DIR", "./storage/rebuild_jobs")
+
+
+class IndexRebuilder:
+    def __init__(
+        self,
+        build_fn: Callable[[], Tuple[Any, str]],
+        on_success: Callable[[Any, str], None],
+        jobs_dir: Optional[str] = None,
+    ) -> None:
+        self._build_fn = build_fn
+        self._on_success = on_success
+        # With several worker processes the status poll may land on a worker
+        # that did not run the job, so each job is also written to jobs_dir.
+        self._jobs_dir = jobs_dir
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index-rebuild")
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _active_job(self) -> Optional[Dict[str, Any]]:
+        for job in self._jobs.values():
+            if job["status"] in (JOB_QUEUED, JOB_RUNNING):
+                return job
+        return None
+
+    def submit(self) -> Dict[str, Any]:
+        with self._lock:
+            # A second request while one is pending would rebuild the same data.
+            active = self._active_job()
+            if active is not None:
+                return dict(active)
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "status": JOB_QUEUED,
+                "version": None,
+                "error": None,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self._jobs[job["job_id"]] = job
+            self._save(job)
+            self._trim()
+        self._executor.submit(self._run, job["job_id"])
+        return dict(job)
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields)
+            self._save(self._jobs[job_id])
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self._jobs_dir, f"{job_id}.json")
+
+    def _save(self, job: Dict[str, Any]) -> None:
+        if self._jobs_dir is None:
+            return
+        os.makedirs(self._jobs_dir, exist_ok=True)
+        path = self._job_path(job["job_id"])
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # job_id comes from the URL; only plain hex ids map to a file.
+        if self._jobs_dir is None or not job_id.isalnum():
+            return None
+        try:
+            with open(self._job_path(job_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _run(self, job_id: str) -> None:
+        self._update(job_id, status=JOB_RUNNING, started_at=time.time())
+        try:
+            index, version = self._build_fn()
+            # Swap only after the new version is fully persisted and current.
+            self._on_success(index, version)
+            self._update(job_id, status=JOB_SUCCEEDED, version=version, finished_at=time.time())
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+
+    def _trim(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job["status"] in (JOB_SUCCEEDED, JOB_FAILED)]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+            if self._jobs_dir is not None:
+                try:
+                    os.remove(self._job_path(job_id))
+                except OSError:
+                    pass
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                return dict(job)
+        return self._load(job_id)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+# Per-file record of what is in the index: content hash, stat info, and the
+# ref doc ids the reader produced for it (a PDF yields one document per page).
+MANIFEST_FNAME = "manifest.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_key(path: str, data_dir: str) -> str:
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(data_dir)).replace(os.sep, "/")
+
+
+def load_manifest(persist_dir: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    path = os.path.join(persist_dir, MANIFEST_FNAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("files", {})
+
+
+def save_manifest(persist_dir: str, files: Dict[str, Dict[str, Any]]) -> None:
+    os.makedirs(persist_dir, exist_ok=True)
+    path = os.path.join(persist_dir, MANIFEST_FNAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"files": files}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def file_entry(path: str, doc_ids: List[str], sha256: Optional[str] = None) -> Dict[str, Any]:
+    stat = os.stat(path)
+    return {
+        "sha256": sha256 or file_sha256(path),
+        "mtime": stat.st_mtime,
+        "size": stat.st_size,
+        "doc_ids": doc_ids,
+    }
+
+
+def diff_files(
+    manifest: Dict[str, Dict[str, Any]],
+    input_files: Sequence[str],
+    data_dir: str,
+) -> Dict[str, Any]:
+    # Returns added/changed paths to (re)embed, removed keys to drop, and the
+    # unchanged entries refreshed with their current stat info.
+    added, changed, unchanged = [], [], {}
+    hashes: Dict[str, str] = {}
+    seen = set()
+    for path in input_files:
+        key = manifest_key(path, data_dir)
+        seen.add(key)
+        entry = manifest.get(key)
+        if entry is None:
+            added.append(path)
+            continue
+        stat = os.stat(path)
+        if stat.st_mtime == entry.get("mtime") and stat.st_size == entry.get("size"):
+            unchanged[key] = entry
+            continue
+        # Stat changed (touch, checkout): only the hash decides whether to re-embed.
+        sha256 = file_sha256(path)
+        if sha256 == entry.get("sha256"):
+            unchanged[key] = {**entry, "mtime": stat.st_mtime, "size": stat.st_size}
+        else:
+            changed.append(path)
+            hashes[path] = sha256
+    removed = [key for key in manifest if key not in seen]
+    return {
+        "added": added,
+        "changed": changed,
+        "removed": removed,
+        "unchanged": unchanged,
+        "hashes": hashes,
+    }
@@ -0,0 +1,105 @@
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process serving only.
+    fcntl = None
+
+# Each rebuild writes a complete store under <persist_dir>/versions/<version>.
+# CURRENT holds the live version name and is swapped with an atomic rename, so
+# readers see either the old store or the new one, never a half-written mix.
+VERSIONS_DIRNAME = "versions"
+CURRENT_FNAME = "CURRENT"
+KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+REBUILD_LOCK_FNAME = "rebuild.lock"
+
+# Shared across versions; never copied into a staging directory.
+SHARED_FILE_PREFIXES = ("embedding_cache", "response_cache", "llm_cache", "rebuild", CURRENT_FNAME)
+
+
+def new_version_name() -> str:
+    # Sortable by creation time, unique across concurrent processes.
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+
+def version_dir(persist_dir: str, version: str) -> str:
+    return os.path.join(persist_dir, VERSIONS_DIRNAME, version)
+
+
+def read_current_version(persist_dir: str) -> Optional[str]:
+    path = os.path.join(persist_dir, CURRENT_FNAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def resolve_persist_dir(persist_dir: str) -> str:
+    # Stores persisted before versioning live directly in persist_dir.
+    version = read_current_version(persist_dir)
+    if version is None:
+        return persist_dir
+    return version_dir(persist_dir, version)
+
+
+def has_index(store_dir: str) -> bool:
+    return os.path.exists(os.path.join(store_dir, "docstore.json"))
+
+
+def switch_current_version(persist_dir: str, version: str) -> None:
+    path = os.path.join(persist_dir, CURRENT_FNAME)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def rebuild_lock(persist_dir: str) -> Iterator[None]:
+    # Serialises rebuilds across worker processes. A rebuild that waited
+    # starts from the version the previous one made current.
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(persist_dir, exist_ok=True)
+    with open(os.path.join(persist_dir, REBUILD_LOCK_FNAME), "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def copy_store_files(src_dir: str, dst_dir: str) -> None:
+    os.makedirs(dst_dir, exist_ok=True)
+    for name in os.listdir(src_dir):
+        src_path = os.path.join(src_dir, name)
+        if not os.path.isfile(src_path) or name.startswith(SHARED_FILE_PREFIXES) or name.endswith(".tmp"):
+            continue
+        shutil.copy2(src_path, os.path.join(dst_dir, name))
+
+
+def list_versions(persist_dir: str) -> List[str]:
+    root = os.path.join(persist_dir, VERSIONS_DIRNAME)
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)))
+
+
+def prune_versions(persist_dir: str, keep: int = KEEP_VERSIONS) -> List[str]:
+    # Older versions may still be mapped by other workers; on POSIX unlinking
+    # keeps their pages alive until they reload, so this is safe. Returns the
+    # versions removed.
+    current = read_current_version(persist_dir)
+    versions = [name for name in list_versions(persist_dir) if name != current]
+    removed = versions[:max(0, len(versions) - (keep - 1))]
+    for name in removed:
+        shutil.rmtree(version_dir(persist_dir, name), ignore_errors=True)
+    return removed
@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Set, Tuple
+
+from llama_index.core import Settings, SimpleDirectoryReader
+from llama_index.core.schema import BaseNode, MetadataMode
+
+# Files are parsed and chunked on a process pool and their nodes embedded in
+# batches on a small thread pool; each batch is inserted as soon as its
+# vectors arrive. Only a bounded window of files and batches is in flight, so
+# raw documents never accumulate in memory.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "100"))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+# Parsed files allowed to wait for embedding, per parse worker.
+INGEST_PREFETCH = 2
+
+ParsedFile = Tuple[str, List[str], List[BaseNode]]
+
+
+def parse_file(path: str) -> ParsedFile:
+    # Runs in a worker process: read one file and split it with the same node
+    # parser VectorStoreIndex.from_documents would use.
+    documents = SimpleDirectoryReader(input_files=[path]).load_data()
+    nodes = Settings.node_parser.get_nodes_from_documents(documents)
+    return path, [document.doc_id for document in documents], nodes
+
+
+def _pool_context() -> Any:
+    # The server process has live threads (HTTP pools, SQLite); forking it
+    # directly could copy a held lock into the children.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def iter_parsed_files(paths: Sequence[str], workers: int = INGEST_WORKERS) -> Iterator[ParsedFile]:
+    # Yields files as they finish parsing (not in input order), keeping at
+    # most workers * INGEST_PREFETCH of them queued.
+    if workers <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield parse_file(path)
+        return
+
+    pending_paths = iter(paths)
+    window = workers * INGEST_PREFETCH
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths)), mp_context=_pool_context()) as pool:
+        running: Set[Future] = set()
+        for path in pending_paths:
+            running.add(pool.submit(parse_file, path))
+            if len(running) >= window:
+                break
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                next_path = next(pending_paths, None)
+                if next_path is not None:
+                    running.add(pool.submit(parse_file, next_path))
+
+
+def _iter_batches(parsed: Iterable[ParsedFile], batch_size: int) -> Iterator[Tuple[List[BaseNode], List[Tuple[str, List[str]]]]]:
+    # Groups nodes across files into embedding batches; each batch also
+    # carries the files whose last node it contains.
+    batch: List[BaseNode] = []
+    finished: List[Tuple[str, List[str]]] = []
+    for path, doc_ids, nodes in parsed:
+        for node in nodes:
+            batch.append(node)
+            if len(batch) >= batch_size:
+                yield batch, finished
+                batch, finished = [], []
+        finished.append((path, doc_ids))
+    if batch or finished:
+        yield batch, finished
+
+
+def _embed_batch(embed_model: Any, nodes: List[BaseNode]) -> List[BaseNode]:
+    if not nodes:
+        return nodes
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    for node, embedding in zip(nodes, embed_model.get_text_embedding_batch(texts)):
+        node.embedding = embedding
+    return nodes
+
+
+def ingest_files(
+    index: Any,
+    paths: Sequence[str],
+    workers: int = INGEST_WORKERS,
+    batch_size: int = INGEST_EMBED_BATCH,
+    embed_concurrency: int = INGEST_EMBED_CONCURRENCY,
+) -> Dict[str, List[str]]:
+    # Adds every file's nodes to `index`; returns {path: doc_ids} for the
+    # manifest. Insertion happens on the calling thread only.
+    doc_ids_by_path: Dict[str, List[str]] = {}
+    if not paths:
+        return doc_ids_by_path
+
+    embed_model = index._embed_model
+    with ThreadPoolExecutor(max_workers=max(1, embed_concurrency), thread_name_prefix="ingest-embed") as embedder:
+        in_flight: List[Tuple[Future, List[Tuple[str, List[str]]]]] = []
+
+        def drain(limit: int) -> None:
+            # Insert in submission order so files are recorded only after all
+            # of their nodes are in the store.
+            while len(in_flight) > limit:
+                future, finished = in_flight.pop(0)
+                nodes = future.result()
+                if nodes:
+                    index.insert_nodes(nodes)
+                doc_ids_by_path.update(finished)
+
+        for nodes, finished in _iter_batches(iter_parsed_files(paths, workers), batch_size):
+            in_flight.append((embedder.submit(_embed_batch, embed_model, nodes), finished))
+            drain(embed_concurrency)
+        drain(0)
+    return doc_ids_by_path
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.metrics import span
+
+# Load the index on a background thread right after startup instead of on
+# first use. Either way the server starts accepting requests first.
+INDEX_WARMUP = os.getenv("INDEX_WARMUP", "1") == "1"
+# How often a worker checks whether another process made a newer version
+# current; 0 turns the check off (the prefork master does it instead).
+INDEX_RELOAD_POLL_SECONDS = float(os.getenv("INDEX_RELOAD_POLL_SECONDS", "5"))
+
+
+class LazyIndex:
+    # Holds the live index and its version, loading them the first time
+    # something asks. Routes that never retrieve do not wait for (or import)
+    # LlamaIndex. `load` returns (index, version).
+    def __init__(self, load: Callable[[], Tuple[Any, Optional[str]]]) -> None:
+        self._load = load
+        self._index: Any = None
+        self.version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._warm_thread: Optional[threading.Thread] = None
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._index is not None
+
+    def get(self) -> Any:
+        # Blocks until the index is loaded; call it off the event loop.
+        index = self._index
+        if index is not None:
+            return index
+        with self._lock:
+            if self._index is None:
+                start = time.perf_counter()
+                try:
+                    with span("index_load"):
+                        self._index, self.version = self._load()
+                except Exception as e:
+                    # The next caller tries again (e.g. once ./data exists).
+                    self.error = str(e)
+                    raise
+                self.error = None
+                self.load_seconds = time.perf_counter() - start
+            return self._index
+
+    def swap(self, index: Any, version: Optional[str]) -> None:
+        # Waits for an in-progress load, so a slow first load cannot
+        # overwrite a rebuild that finished before it.
+        with self._lock:
+            self._index, self.version = index, version
+
+    def warm(self) -> None:
+        if self._warm_thread is not None or self.ready:
+            return
+        self._warm_thread = threading.Thread(target=self._warm, name="index-warmup", daemon=True)
+        self._warm_thread.start()
+
+    def _warm(self) -> None:
+        try:
+            self.get()
+        except Exception:
+            traceback.print_exc()
+
+    def status(self) -> Dict[str, Any]:
+        if self.ready:
+            state = "ready"
+        elif self.error is not None:
+            state = "failed"
+        else:
+            state = "loading" if self._lock.locked() else "not_loaded"
+        return {"status": state, "version": self.version, "error": self.error, "load_seconds": self.load_seconds}
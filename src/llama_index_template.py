@@ -1,9 +1,55 @@
 from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, StorageContext, load_index_from_storage
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events.llm import LLMChatEndEvent, LLMCompletionEndEvent
 import os
+import shutil
+import threading
+import weakref
+import numpy as np
 from llama_index.llms.openai.base import OpenAI
 from llama_index.embeddings.openai import OpenAIEmbedding, OpenAIEmbeddingModelType
 from dotenv import load_dotenv
 from pathlib import Path
+from src.mmap_vector_store import MmapVectorStore
+from src.ann_index import ann_enabled
+from src.embedding_cache import CachedEmbedding, get_embedding_cache
+from src.response_cache import get_response_cache
+from src.metrics import record_usage, span, traced
+from src.tokens import count_text_tokens, truncate_to_tokens
+from src.retrieval_settings import (
+    HYBRID_FETCH_K,
+    RETRIEVAL_MAX_TOKENS,
+    RETRIEVAL_MMR_FETCH_K,
+    RETRIEVAL_MMR_LAMBDA,
+    RETRIEVAL_MODE,
+    RETRIEVAL_MODES,
+    RETRIEVAL_TOP_K,
+)
+from src.bm25_index import BM25Index, reciprocal_rank_fusion
+from src.vector_search import mmr_select, normalize_rows
+from src.openai_client import (
+    OPENAI_BASE_URL,
+    OPENAI_CHAT_MODEL,
+    OPENAI_MAX_RETRIES,
+    OPENAI_TIMEOUT,
+    get_openai_client,
+    openai_slot,
+    shared_http_client,
+)
+from src.ingestion import ingest_files
+from src.index_manifest import diff_files, file_entry, load_manifest, manifest_key, save_manifest
+from src.index_versions import (
+    copy_store_files,
+    has_index,
+    new_version_name,
+    prune_versions,
+    read_current_version,
+    rebuild_lock,
+    resolve_persist_dir,
+    switch_current_version,
+    version_dir,
+)
 
 
 
@@ -12,18 +58,332 @@ DATA_DIR = "./data"
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Response-cache version for stores persisted before versioning.
+UNVERSIONED = "unversioned"
+
+
+# Embedding models by id, so a forked worker can move them to its own pool.
+_openai_embeddings = weakref.WeakValueDictionary()
+
+def _embed_model():
+    # Builds and queries share one on-disk cache, so text is only embedded once.
+    model = OpenAIEmbedding(
+        model=OpenAIEmbeddingModelType.TEXT_EMBED_3_SMALL,
+        api_key=OPENAI_API_KEY,
+        api_base=OPENAI_BASE_URL,
+        max_retries=OPENAI_MAX_RETRIES,
+        timeout=OPENAI_TIMEOUT,
+        http_client=shared_http_client(),
+    )
+    _openai_embeddings[id(model)] = model
+    return CachedEmbedding(model)
+
+def embedding_cache_stats():
+    return get_embedding_cache().stats()
+
+_bm25_indexes = weakref.WeakKeyDictionary()
+
+def _index_nodes(index):
+    node_ids = list(index.index_struct.nodes_dict.values())
+    return node_ids, index.docstore.get_nodes(node_ids)
+
+def _build_bm25(index):
+    node_ids, nodes = _index_nodes(index)
+    return BM25Index.build(node_ids, [node.get_content() for node in nodes])
+
+def _lexical_index(index):
+    # Stores persisted before BM25 existed get their postings built in memory.
+    bm25 = _bm25_indexes.get(index)
+    if bm25 is None:
+        bm25 = _bm25_indexes[index] = _build_bm25(index)
+    return bm25
+
+def _load_index(persist_dir):
+    # Embeddings are memory-mapped, so workers share them through the page cache.
+    storage_context = StorageContext.from_defaults(
+        persist_dir=persist_dir, vector_store=MmapVectorStore.from_persist_dir(persist_dir)
+    )
+    index = load_index_from_storage(storage_context, embed_model=_embed_model())
+    bm25 = BM25Index.load(persist_dir, _index_nodes(index)[0])
+    if bm25 is not None:
+        _bm25_indexes[index] = bm25
+    return index
+
+def _finalize_index(index, persist_dir, manifest):
+    vector_store = index.storage_context.vector_store
+    if ann_enabled(len(vector_store.ids)):
+        vector_store.build_ann()
+    # Tokenising is cheap next to embedding, so BM25 is always rebuilt whole.
+    bm25 = _bm25_indexes[index] = _build_bm25(index)
+    bm25.save(persist_dir)
+    index.storage_context.persist(persist_dir=persist_dir)
+    save_manifest(persist_dir, manifest)
+
+def _build_index(persist_dir, input_files):
+    storage_context = StorageContext.from_defaults(vector_store=MmapVectorStore())
+    index = VectorStoreIndex(nodes=[], storage_context=storage_context, embed_model=_embed_model())
+    manifest = {
+        manifest_key(path, DATA_DIR): file_entry(path, doc_ids)
+        for path, doc_ids in ingest_files(index, input_files).items()
+    }
+    _finalize_index(index, persist_dir, manifest)
+    return index
+
+def _has_changes(diff):
+    return bool(diff["added"] or diff["changed"] or diff["removed"])
+
+def _update_index(persist_dir, manifest, diff):
+    index = _load_index(persist_dir)
+    # Drop every node of changed or removed files, then embed only the new content.
+    stale_keys = diff["removed"] + [manifest_key(path, DATA_DIR) for path in diff["changed"]]
+    for key in stale_keys:
+        for doc_id in manifest[key].get("doc_ids", []):
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+    new_manifest = dict(diff["unchanged"])
+    fresh_files = diff["added"] + diff["changed"]
+    for path, doc_ids in ingest_files(index, fresh_files).items():
+        new_manifest[manifest_key(path, DATA_DIR)] = file_entry(path, doc_ids, sha256=diff["hashes"].get(path))
+
+    _finalize_index(index, persist_dir, new_manifest)
+    return index
+
+def build_index_version():
+    # Builds into a fresh version directory and only then flips CURRENT, so a
+    # crash mid-build leaves the live store untouched. When ./data matches the
+    # current version nothing is written and (None, current version) comes
+    # back, so caches and workers on that version stay as they are.
+    with rebuild_lock(PERSIST_DIR):
+        current_version = read_current_version(PERSIST_DIR)
+        current_dir = resolve_persist_dir(PERSIST_DIR)
+        input_files = [os.path.abspath(str(path)) for path in SimpleDirectoryReader(DATA_DIR).input_files]
+        manifest = load_manifest(current_dir) if has_index(current_dir) else None
+        diff = diff_files(manifest, input_files, DATA_DIR) if manifest is not None else None
+        if current_version is not None and diff is not None and not _has_changes(diff):
+            if diff["unchanged"] != manifest:
+                # Touched but identical files: record their new stat info so
+                # the next rebuild does not hash them again.
+                save_manifest(current_dir, diff["unchanged"])
+            return None, current_version
+
+        version = new_version_name()
+        staging_dir = version_dir(PERSIST_DIR, version)
+        try:
+            if diff is None:
+                # No record of what the current store contains, so start from scratch.
+                index = _build_index(staging_dir, input_files)
+            else:
+                copy_store_files(current_dir, staging_dir)
+                index = _update_index(staging_dir, manifest, diff)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        switch_current_version(PERSIST_DIR, version)
+        pruned = prune_versions(PERSIST_DIR)
+    get_response_cache().forget_versions(pruned)
+    return index, version
+
+def current_index_version():
+    return read_current_version(PERSIST_DIR)
+
+def activate_index_version(version):
+    # Cached answers are only valid for the index that produced them.
+    get_response_cache().set_version(version or UNVERSIONED)
+
+def load_current_index():
+    # (index, version) for the version CURRENT names right now; used by
+    # workers catching up with a rebuild made by another process.
+    version = current_index_version()
+    persist_dir = version_dir(PERSIST_DIR, version) if version else PERSIST_DIR
+    return _load_index(persist_dir), version
+
 def initialize_index(force_rebuild=False):
-    if not os.path.exists(PERSIST_DIR) or force_rebuild:
-        documents = SimpleDirectoryReader(DATA_DIR).load_data()
-        embed_model = OpenAIEmbedding(model=OpenAIEmbeddingModelType.TEXT_EMBED_3_SMALL, api_key=OPENAI_API_KEY)
-        index = VectorStoreIndex.from_documents(documents, show_progress=True, embed_model=embed_model)
-        index.storage_context.persist(persist_dir=PERSIST_DIR)
-    else:
-        storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR)
-        index = load_index_from_storage(storage_context)
+    persist_dir = resolve_persist_dir(PERSIST_DIR)
+    if has_index(persist_dir) and not force_rebuild:
+        return _load_index(persist_dir)
+    index, version = build_index_version()
+    if index is None:
+        return _load_index(version_dir(PERSIST_DIR, version))
     return index
 
+_llm = None
+_query_engines = weakref.WeakKeyDictionary()
+_query_engines_lock = threading.Lock()
+
+class _TokenUsage(BaseEventHandler):
+    # Records the usage of the query engine's chat calls, streamed or not;
+    # `raw` is the completion, or the last chunk of a stream.
+    @classmethod
+    def class_name(cls):
+        return "TokenUsage"
+
+    def handle(self, event, **kwargs):
+        if isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)) and event.response is not None:
+            record_usage(OPENAI_CHAT_MODEL, getattr(event.response.raw, "usage", None))
+
+get_dispatcher().add_event_handler(_TokenUsage())
+
+def _shared_llm():
+    # One LLM wrapper around the shared, pooled OpenAI client. Streams ask
+    # for usage too (llama_index drops stream_options on other calls).
+    global _llm
+    if _llm is None:
+        _llm = OpenAI(
+            model=OPENAI_CHAT_MODEL,
+            api_key=OPENAI_API_KEY,
+            openai_client=get_openai_client(),
+            additional_kwargs={"stream_options": {"include_usage": True}},
+        )
+    return _llm
+
+def _reset_after_fork():
+    # Runs after openai_client's own reset: indexes loaded before the fork
+    # keep their embedding models, which are pointed at the child's pool, and
+    # the LLM and query engines are rebuilt on first use.
+    global _llm, _query_engines, _query_engines_lock
+    for model in list(_openai_embeddings.values()):
+        model._http_client = shared_http_client()
+        model._client = None
+        model._aclient = None
+    _llm = None
+    _query_engines = weakref.WeakKeyDictionary()
+    _query_engines_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _query_engine(index, streaming=False):
+    # Cached per index object; a rebuilt index gets its own engines and the
+    # old ones go away with it.
+    with _query_engines_lock:
+        engines = _query_engines.setdefault(index, {})
+        engine = engines.get(streaming)
+        if engine is None:
+            engine = index.as_query_engine(llm=_shared_llm(), streaming=streaming)
+            engines[streaming] = engine
+        return engine
+
 def query_index(index, user_query):
-    model = OpenAI(api_key=OPENAI_API_KEY, model="gpt-4o-mini")
-    query_engine = index.as_query_engine(llm=model)
-    return query_engine.query(user_query)
+    with span("query_index"), openai_slot():
+        return _query_engine(index).query(user_query)
+
+def stream_query_index(index, user_query):
+    # Yields answer tokens as the LLM produces them; retrieval happens before
+    # the first one.
+    with openai_slot():
+        yield from _query_engine(index, streaming=True).query(user_query).response_gen
+
+@traced("response_cache")
+def _cached_answer(index, cache, namespace, user_query, version):
+    # Returns (answer or None, embedding to store the fresh answer under).
+    hit = cache.get_exact(namespace, user_query, version)
+    if hit is not None:
+        return hit, None
+    embedding = index._embed_model.get_query_embedding(user_query)
+    return cache.get_similar(namespace, embedding, version), embedding
+
+def answer_query(index, user_query, namespace="query"):
+    # query_index behind the response cache.
+    cache = get_response_cache()
+    version = cache.version
+    hit, embedding = _cached_answer(index, cache, namespace, user_query, version)
+    if hit is not None:
+        return hit
+    answer = query_index(index, user_query).response
+    cache.put(namespace, user_query, embedding, answer, version)
+    return answer
+
+def stream_answer(index, user_query, namespace="query"):
+    # A cached answer comes back as a single chunk.
+    cache = get_response_cache()
+    version = cache.version
+    hit, embedding = _cached_answer(index, cache, namespace, user_query, version)
+    if hit is not None:
+        yield hit
+        return
+    parts = []
+    for delta in stream_query_index(index, user_query):
+        parts.append(delta)
+        yield delta
+    cache.put(namespace, user_query, embedding, "".join(parts), version)
+
+def _search_one(index, embedding, k):
+    vector_store = index.vector_store
+    if isinstance(vector_store, MmapVectorStore):
+        scores, node_ids = vector_store.search_batch([embedding], k)
+        return scores[0], node_ids[0]
+    from llama_index.core.vector_stores.types import VectorStoreQuery
+    result = vector_store.query(VectorStoreQuery(query_embedding=embedding, similarity_top_k=k))
+    return result.similarities or [], result.ids or []
+
+def _candidate_vectors(index, node_ids):
+    vector_store = index.vector_store
+    if isinstance(vector_store, MmapVectorStore):
+        return vector_store.engine.vectors(node_ids)
+    return normalize_rows(np.asarray([vector_store.get(node_id) for node_id in node_ids], dtype=np.float32))
+
+def _ranked_candidates(index, query, mode, fetch_k):
+    # (scores, node_ids, query embedding or None) for the given mode.
+    if mode == "lexical":
+        scores, node_ids = _lexical_index(index).search(query, fetch_k)
+        return scores, node_ids, None
+    embedding = index._embed_model.get_query_embedding(query)
+    if mode == "vector":
+        scores, node_ids = _search_one(index, embedding, fetch_k)
+        return scores, node_ids, embedding
+    hybrid_k = max(fetch_k, HYBRID_FETCH_K)
+    _, vector_ids = _search_one(index, embedding, hybrid_k)
+    _, lexical_ids = _lexical_index(index).search(query, hybrid_k)
+    fused = reciprocal_rank_fusion([vector_ids, lexical_ids])[:fetch_k]
+    return [score for _, score in fused], [node_id for node_id, _ in fused], embedding
+
+@traced("retrieve")
+def retrieve_context(
+    index,
+    query,
+    similarity_top_k=RETRIEVAL_TOP_K,
+    mmr=False,
+    mmr_lambda=RETRIEVAL_MMR_LAMBDA,
+    max_tokens=RETRIEVAL_MAX_TOKENS,
+    mode=RETRIEVAL_MODE,
+):
+    # Retrieval without response synthesis: the top chunks for `query` as
+    # {"node_id", "text", "score", "file_name"} dicts, best first. Scores are
+    # cosine similarities, BM25 scores or RRF scores depending on `mode`.
+    # With mmr, near-duplicate chunks give way to ones that cover something
+    # else (ignored in lexical mode, which never embeds the query). Chunks
+    # stop once max_tokens of text is reached.
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}; expected one of {RETRIEVAL_MODES}.")
+    if similarity_top_k < 1:
+        raise ValueError(f"similarity_top_k must be at least 1, got {similarity_top_k}.")
+    if max_tokens is not None and max_tokens < 1:
+        raise ValueError(f"max_tokens must be at least 1, got {max_tokens}.")
+    use_mmr = mmr and mode != "lexical"
+    fetch_k = max(similarity_top_k, RETRIEVAL_MMR_FETCH_K) if use_mmr else similarity_top_k
+    scores, node_ids, embedding = _ranked_candidates(index, query, mode, fetch_k)
+    if use_mmr and len(node_ids) > similarity_top_k:
+        query_vector = normalize_rows(np.asarray([embedding], dtype=np.float32))[0]
+        picks = mmr_select(query_vector, _candidate_vectors(index, node_ids), similarity_top_k, mmr_lambda)
+        scores, node_ids = [scores[i] for i in picks], [node_ids[i] for i in picks]
+    scores, node_ids = scores[:similarity_top_k], node_ids[:similarity_top_k]
+
+    chunks = []
+    used = 0
+    for node, score in zip(index.docstore.get_nodes(node_ids), scores):
+        text = node.get_content()
+        tokens = count_text_tokens(text)
+        if max_tokens is not None and used + tokens > max_tokens:
+            if chunks:
+                break
+            # A single oversized chunk still yields its beginning.
+            text = truncate_to_tokens(text, max_tokens)
+            tokens = max_tokens
+        chunks.append({
+            "node_id": node.node_id,
+            "text": text,
+            "score": float(score),
+            "file_name": node.metadata.get("file_name"),
+        })
+        used += tokens
+    return chunks
@@ -0,0 +1,237 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Process-local counters and histograms rendered in the Prometheus text
+# format. With METRICS_ENABLED=0 spans only check a flag and a context
+# variable, so instrumented code pays next to nothing.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Adds a Server-Timing header listing the stages each request went through.
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+METRICS_PREFIX = "rag_"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+# (name, type, labels, value) samples produced at scrape time.
+Sample = Tuple[str, str, Dict[str, Any], float]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._collectors: List[Callable[[], Iterable[Sample]]] = []
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(self._buckets.setdefault(name, buckets))
+            histogram.observe(value)
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]) -> None:
+        # For values owned elsewhere (cache stats); called on every scrape.
+        self._collectors.append(collector)
+
+    def _render_histograms(self, lines: List[str]) -> None:
+        for name, series in sorted(self._histograms.items()):
+            full = METRICS_PREFIX + name
+            lines.append(f"# TYPE {full} histogram")
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = labels + (("le", _format_value(bound)),)
+                    lines.append(f"{full}_bucket{_format_labels(le)} {cumulative}")
+                lines.append(f"{full}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.total}")
+                lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                lines.append(f"{full}_count{_format_labels(labels)} {histogram.total}")
+
+    def render(self) -> str:
+        samples: Dict[Tuple[str, str], Dict[Labels, float]] = {}
+        with self._lock:
+            for name, series in self._counters.items():
+                samples[(name, "counter")] = dict(series)
+            lines: List[str] = []
+            self._render_histograms(lines)
+        for collector in self._collectors:
+            for name, kind, labels, value in collector():
+                samples.setdefault((name, kind), {})[_labels(labels)] = value
+        for (name, kind), series in sorted(samples.items()):
+            full = METRICS_PREFIX + name
+            lines.append(f"# TYPE {full} {kind}")
+            for labels, value in sorted(series.items()):
+                lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Per-request list of (stage, seconds), only set when Server-Timing is on.
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def inc(name: str, value: float = 1, **labels: Any) -> None:
+    if METRICS_ENABLED:
+        registry.inc(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    if METRICS_ENABLED:
+        registry.observe(name, value, **labels)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    # Times a block as rag_stage_duration_seconds{stage=...}. Works in sync
+    # and async code; the context variable follows run_in_threadpool calls.
+    timings = _request_timings.get()
+    if not METRICS_ENABLED and timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        if METRICS_ENABLED:
+            registry.observe("stage_duration_seconds", elapsed, stage=stage, outcome=outcome)
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def traced(stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    def decorate(fn: Callable[..., Any]) -> Callable[..., Any]:
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_usage(model: str, usage: Any) -> None:
+    # Token counts from an OpenAI response's `usage`, when the server sent one.
+    if not METRICS_ENABLED or usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = getattr(usage, kind, None)
+        if count:
+            registry.inc("openai_tokens_total", count, model=model, kind=kind[: -len("_tokens")])
+
+
+def server_timing_header(timings: List[Tuple[str, float]]) -> str:
+    # Repeated stages (several Firebase reads) are summed into one entry.
+    totals: Dict[str, List[float]] = {}
+    for stage, seconds in timings:
+        entry = totals.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    return ", ".join(
+        f'{stage};dur={seconds * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+        for stage, (seconds, count) in totals.items()
+    )
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware rather than BaseHTTPMiddleware, so streaming
+    # responses pass through untouched and the handler shares our context.
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not (METRICS_ENABLED or SERVER_TIMING):
+            await self.app(scope, receive, send)
+            return
+        timings: Optional[List[Tuple[str, float]]] = [] if SERVER_TIMING else None
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if timings is not None:
+                    # Streams send their headers first, so they only list the
+                    # stages that ran before the first chunk.
+                    timings.append(("total", time.perf_counter() - start))
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing_header(timings).encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            if METRICS_ENABLED:
+                # The route template, not the raw path, keeps label cardinality bounded.
+                route = getattr(scope.get("route"), "path", "unmatched")
+                registry.observe(
+                    "http_request_duration_seconds",
+                    time.perf_counter() - start,
+                    route=route,
+                    method=scope["method"],
+                    status=status[0],
+                )
@@ -0,0 +1,257 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+from src.ann_index import ANN_NLIST, ANN_NPROBE, IVFIndex, remove_ann_files
+from src.vector_search import VectorSearchEngine
+
+# Embedding matrix (float32, row-major) and the id table that maps rows to nodes.
+VECTORS_FNAME = "vectors.npy"
+IDS_FNAME = "vector_ids.json"
+LEGACY_JSON_FNAME = "default__vector_store.json"
+
+
+def _write_atomic(path: str, write_fn) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write_fn(f)
+    os.replace(tmp_path, path)
+
+
+def _encode_id_table(ids: List[str], ref_doc_ids: List[str]) -> Dict[str, Any]:
+    # Ref doc ids repeat once per chunk, so store them once and reference by position.
+    ref_table: List[str] = []
+    ref_positions: Dict[str, int] = {}
+    ref_index = []
+    for ref_doc_id in ref_doc_ids:
+        if ref_doc_id not in ref_positions:
+            ref_positions[ref_doc_id] = len(ref_table)
+            ref_table.append(ref_doc_id)
+        ref_index.append(ref_positions[ref_doc_id])
+    return {"ids": ids, "ref_doc_ids": ref_table, "ref_doc_index": ref_index}
+
+
+def _decode_id_table(data: Dict[str, Any]) -> tuple[List[str], List[str]]:
+    ref_table = data.get("ref_doc_ids", [])
+    ref_doc_ids = [ref_table[i] for i in data.get("ref_doc_index", [])]
+    return list(data.get("ids", [])), ref_doc_ids
+
+
+def save_vectors(persist_dir: str, matrix: np.ndarray, ids: List[str], ref_doc_ids: List[str]) -> None:
+    os.makedirs(persist_dir, exist_ok=True)
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    # Rename over the old files so readers that already mapped them keep a valid view.
+    _write_atomic(os.path.join(persist_dir, VECTORS_FNAME), lambda f: np.save(f, matrix))
+    id_table = json.dumps(_encode_id_table(ids, ref_doc_ids)).encode("utf-8")
+    _write_atomic(os.path.join(persist_dir, IDS_FNAME), lambda f: f.write(id_table))
+
+
+def load_vectors(persist_dir: str) -> tuple[np.ndarray, List[str], List[str]]:
+    matrix = np.load(os.path.join(persist_dir, VECTORS_FNAME), mmap_mode="r")
+    with open(os.path.join(persist_dir, IDS_FNAME), "r", encoding="utf-8") as f:
+        ids, ref_doc_ids = _decode_id_table(json.load(f))
+    if matrix.shape[0] != len(ids):
+        raise ValueError(
+            f"Vector store in {persist_dir} is inconsistent: "
+            f"{matrix.shape[0]} rows but {len(ids)} ids."
+        )
+    return matrix, ids, ref_doc_ids
+
+
+def migrate_json_store(persist_dir: str) -> bool:
+    # One-time import of a SimpleVectorStore JSON file, so existing storage
+    # directories switch to the binary format without re-embedding.
+    json_path = os.path.join(persist_dir, LEGACY_JSON_FNAME)
+    if os.path.exists(os.path.join(persist_dir, VECTORS_FNAME)) or not os.path.exists(json_path):
+        return False
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    embedding_dict = data.get("embedding_dict", {})
+    text_id_to_ref_doc_id = data.get("text_id_to_ref_doc_id", {})
+
+    ids = list(embedding_dict.keys())
+    ref_doc_ids = [text_id_to_ref_doc_id.get(node_id, "None") for node_id in ids]
+    if ids:
+        matrix = np.asarray([embedding_dict[node_id] for node_id in ids], dtype=np.float32)
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    save_vectors(persist_dir, matrix, ids, ref_doc_ids)
+    return True
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    # Node text lives in the docstore, like SimpleVectorStore.
+    stores_text: bool = False
+
+    _matrix: np.ndarray = PrivateAttr()
+    _ids: List[str] = PrivateAttr()
+    _ref_doc_ids: List[str] = PrivateAttr()
+    _engine: Optional[VectorSearchEngine] = PrivateAttr(default=None)
+    _ann: Optional[IVFIndex] = PrivateAttr(default=None)
+    # Writable backing array for appends; _matrix is a view of its first rows.
+    _buffer: Optional[np.ndarray] = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        matrix: Optional[np.ndarray] = None,
+        ids: Optional[List[str]] = None,
+        ref_doc_ids: Optional[List[str]] = None,
+        ann: Optional[IVFIndex] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self._matrix = matrix if matrix is not None else np.zeros((0, 0), dtype=np.float32)
+        self._ids = ids or []
+        self._ref_doc_ids = ref_doc_ids or []
+        self._engine = None
+        self._ann = ann
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "MmapVectorStore":
+        migrate_json_store(persist_dir)
+        if not os.path.exists(os.path.join(persist_dir, VECTORS_FNAME)):
+            return cls()
+        matrix, ids, ref_doc_ids = load_vectors(persist_dir)
+        return cls(matrix=matrix, ids=ids, ref_doc_ids=ref_doc_ids, ann=IVFIndex.load(persist_dir, ids))
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MmapVectorStore"
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix
+
+    @property
+    def ids(self) -> List[str]:
+        return self._ids
+
+    @property
+    def engine(self) -> VectorSearchEngine:
+        # Built lazily and dropped on every mutation, so the normalised matrix
+        # always matches the rows in the store.
+        if self._engine is None:
+            self._engine = VectorSearchEngine(self._matrix, self._ids)
+        return self._engine
+
+    @property
+    def ann(self) -> Optional[IVFIndex]:
+        return self._ann
+
+    def build_ann(self, nlist: int = ANN_NLIST) -> IVFIndex:
+        self._ann = IVFIndex.build(self.engine, nlist=nlist)
+        return self._ann
+
+    def get(self, text_id: str) -> List[float]:
+        return self._matrix[self._ids.index(text_id)].tolist()
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        new_rows = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        n_rows = len(self._ids)
+        needed = n_rows + len(new_rows)
+        if self._buffer is None or self._buffer.shape[0] < needed or self._buffer.shape[1] != new_rows.shape[1]:
+            # Grow geometrically so batched inserts stay linear overall. The
+            # copy also means appends never write through a read-only mapping.
+            capacity = max(needed, 2 * (self._buffer.shape[0] if self._buffer is not None else 0), 64)
+            buffer = np.empty((capacity, new_rows.shape[1]), dtype=np.float32)
+            if n_rows:
+                buffer[:n_rows] = self._matrix
+            self._buffer = buffer
+        self._buffer[n_rows:needed] = new_rows
+        self._matrix = self._buffer[:needed]
+        for node in nodes:
+            self._ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id or "None")
+        self._engine = None
+        self._ann = None
+        return [node.node_id for node in nodes]
+
+    def _keep_rows(self, keep: np.ndarray) -> None:
+        self._matrix = np.array(self._matrix[keep])
+        self._buffer = None
+        self._ids = [node_id for node_id, k in zip(self._ids, keep) if k]
+        self._ref_doc_ids = [ref for ref, k in zip(self._ref_doc_ids, keep) if k]
+        self._engine = None
+        self._ann = None
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        keep = np.asarray([ref != ref_doc_id for ref in self._ref_doc_ids], dtype=bool)
+        if not keep.all():
+            self._keep_rows(keep)
+
+    def delete_nodes(
+        self,
+        node_ids: Optional[List[str]] = None,
+        filters: Optional[Any] = None,
+        **delete_kwargs: Any,
+    ) -> None:
+        if filters is not None:
+            raise ValueError("MmapVectorStore does not store metadata, so it cannot filter.")
+        if node_ids is None:
+            self.clear()
+            return
+        to_delete = set(node_ids)
+        keep = np.asarray([node_id not in to_delete for node_id in self._ids], dtype=bool)
+        if not keep.all():
+            self._keep_rows(keep)
+
+    def clear(self) -> None:
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._buffer = None
+        self._ids = []
+        self._ref_doc_ids = []
+        self._engine = None
+        self._ann = None
+
+    def search_batch(
+        self, queries: Sequence[Sequence[float]], k: int, nprobe: int = ANN_NPROBE
+    ) -> tuple[List[List[float]], List[List[str]]]:
+        if self._ann is not None:
+            return self._ann.search_batch(self.engine, queries, k, nprobe=nprobe)
+        return self.engine.search_batch(queries, k)
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("MmapVectorStore does not store metadata, so it cannot filter.")
+        if not self._ids or query.query_embedding is None:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        rows = None
+        if query.node_ids is not None:
+            allowed = set(query.node_ids)
+            rows = np.asarray([i for i, node_id in enumerate(self._ids) if node_id in allowed], dtype=np.int64)
+
+        if rows is None:
+            batch_scores, batch_ids = self.search_batch(
+                [query.query_embedding], query.similarity_top_k, nprobe=kwargs.get("nprobe", ANN_NPROBE)
+            )
+            return VectorStoreQueryResult(similarities=batch_scores[0], ids=batch_ids[0])
+
+        similarities, ids = self.engine.search(query.query_embedding, query.similarity_top_k, rows=rows)
+        return VectorStoreQueryResult(similarities=similarities, ids=ids)
+
+    def persist(self, persist_path: str, fs: Optional[Any] = None) -> None:
+        # StorageContext hands us ".../default__vector_store.json"; keep the
+        # directory and write the binary files next to the other stores.
+        persist_dir = os.path.dirname(persist_path) or "."
+        save_vectors(persist_dir, self._matrix, self._ids, self._ref_doc_ids)
+        if self._ann is not None:
+            self._ann.save(persist_dir)
+        else:
+            remove_ann_files(persist_dir)
@@ -0,0 +1,247 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Any, AsyncIterator, Deque, Iterator, Optional, Tuple, Union
+
+import httpx
+from dotenv import load_dotenv
+
+from src.metrics import record_usage
+
+if TYPE_CHECKING:
+    # The SDK takes most of a second to import; it is loaded on first use.
+    from openai import AsyncOpenAI, OpenAI
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini")
+
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "100"))
+# Caps calls in flight from this process, so a burst of requests queues here
+# instead of tripping the account's rate limit.
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+# The SDK retries connection errors, 408, 409, 429 and 5xx with jittered
+# exponential backoff, honouring Retry-After.
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=OPENAI_POOL_SIZE, max_keepalive_connections=OPENAI_POOL_SIZE)
+
+
+class _Slots:
+    # One concurrency budget shared by threads (the llama_index query engine) and
+    # coroutines on any event loop. Waiters are served first come, first
+    # served; a released slot is handed straight to the next one.
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self._used = 0
+        self._lock = threading.Lock()
+        self._waiters: Deque[Union[threading.Event, Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = deque()
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._used < self.limit and not self._waiters:
+                self._used += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    async def acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._used < self.limit and not self._waiters:
+                self._used += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    raise
+            # Handed a slot just as we were cancelled: pass it on. (If the
+            # future itself was cancelled, _grant does that.)
+            if not waiter[1].cancelled():
+                self.release()
+            raise
+
+    def _grant(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+                except RuntimeError:
+                    continue  # Its loop is closed.
+            self._used -= 1
+
+    def __enter__(self) -> None:
+        self.acquire()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+    async def __aenter__(self) -> None:
+        await self.acquire_async()
+
+    async def __aexit__(self, *exc: Any) -> None:
+        self.release()
+
+
+_lock = threading.Lock()
+_http_client: Optional[httpx.Client] = None
+_client: Optional["OpenAI"] = None
+_slots = _Slots(OPENAI_MAX_CONCURRENCY)
+# Set while the current context holds a slot through openai_slot().
+_slot_held: ContextVar[bool] = ContextVar("openai_slot_held", default=False)
+
+_async_client: Optional["AsyncOpenAI"] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def shared_http_client() -> httpx.Client:
+    # Also handed to the llama_index embedding model, so every sync call to
+    # the API reuses the same keep-alive pool.
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(timeout=_timeout(), limits=_limits())
+        return _http_client
+
+
+def get_openai_client() -> "OpenAI":
+    from openai import OpenAI
+
+    global _client
+    http_client = shared_http_client()
+    with _lock:
+        if _client is None:
+            _client = OpenAI(
+                api_key=OPENAI_API_KEY,
+                base_url=OPENAI_BASE_URL,
+                timeout=_timeout(),
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=http_client,
+            )
+        return _client
+
+
+def get_async_openai_client() -> "AsyncOpenAI":
+    from openai import AsyncOpenAI
+
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    # httpx connections are bound to the loop that opened them.
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            base_url=OPENAI_BASE_URL,
+            timeout=_timeout(),
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.AsyncClient(timeout=_timeout(), limits=_limits()),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+
+async def close_async_openai_client() -> None:
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.close()
+    _async_client = None
+    _async_client_loop = None
+
+
+def _reset_after_fork() -> None:
+    # Forked workers open their own connections instead of sharing the
+    # parent's pool. The old clients are dropped, not closed, so the parent's
+    # connections stay open.
+    global _lock, _http_client, _client, _slots, _async_client, _async_client_loop
+    _lock = threading.Lock()
+    _http_client = None
+    _client = None
+    _slots = _Slots(OPENAI_MAX_CONCURRENCY)
+    _async_client = None
+    _async_client_loop = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextmanager
+def openai_slot() -> Iterator[None]:
+    # For calls made through llama_index, which talks to the client directly.
+    # Nested use in the same context does not take a second slot: the query
+    # engine embeds the query under the slot query_index already holds.
+    if _slot_held.get():
+        yield
+        return
+    with _slots:
+        _slot_held.set(True)
+        try:
+            yield
+        finally:
+            _slot_held.set(False)
+
+
+@asynccontextmanager
+async def openai_slot_async() -> AsyncIterator[None]:
+    async with _slots:
+        yield
+
+
+async def chat_completion_async(**kwargs: Any) -> Any:
+    # kwargs go straight to chat.completions.create; pass `timeout=` to
+    # override the default for a single call.
+    kwargs.setdefault("model", OPENAI_CHAT_MODEL)
+    client = get_async_openai_client()
+    async with _slots:
+        response = await client.chat.completions.create(**kwargs)
+    record_usage(kwargs["model"], getattr(response, "usage", None))
+    return response
+
+
+async def chat_completion_stream_async(**kwargs: Any) -> AsyncIterator[str]:
+    # Yields content deltas as they arrive. The concurrency slot is held until
+    # the stream ends or the consumer stops iterating. Usage comes in a last
+    # chunk without choices.
+    kwargs.setdefault("model", OPENAI_CHAT_MODEL)
+    kwargs.setdefault("stream_options", {"include_usage": True})
+    client = get_async_openai_client()
+    async with _slots:
+        stream = await client.chat.completions.create(stream=True, **kwargs)
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    record_usage(kwargs["model"], chunk.usage)
+        finally:
+            await stream.close()
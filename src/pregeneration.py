@@ -0,0 +1,156 @@
+import asyncio
+import contextvars
+import itertools
+import os
+import traceback
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# Exercises for the next few modules of a project are generated in the
+# background, so /get_questions usually finds them already stored.
+PREGEN_WORKERS = int(os.getenv("PREGEN_WORKERS", "2"))
+PREGEN_AHEAD = int(os.getenv("PREGEN_AHEAD", "2"))
+PREGEN_MAX_QUEUED = int(os.getenv("PREGEN_MAX_QUEUED", "256"))
+
+ProjectKey = Tuple[str, str]
+GenerateFn = Callable[[str, str, str, Dict[str, Any]], Awaitable[Any]]
+
+
+@dataclass
+class _Job:
+    user_id: str
+    project_id: str
+    position: str
+    module: Dict[str, Any]
+    epoch: int
+
+
+def _difficulty(module: Dict[str, Any]) -> float:
+    try:
+        return float(module.get("nivel_dificultad"))
+    except (TypeError, ValueError):
+        return float("inf")
+
+
+def upcoming_modules(modules: Dict[str, Any], limit: int = PREGEN_AHEAD) -> List[Tuple[str, Dict[str, Any]]]:
+    # The easiest modules the learner has not finished and that have no
+    # exercises yet; ties keep curriculum order.
+    pending = [
+        (position, module)
+        for position, module in modules.items()
+        if isinstance(module, dict) and not module.get("was_completed") and not module.get("ejercicios")
+    ]
+    pending.sort(key=lambda item: (_difficulty(item[1]), int(item[0]) if item[0].isdigit() else 0))
+    return pending[:max(0, limit)]
+
+
+class ExercisePregenerator:
+    # A fixed number of workers drain a priority queue ordered by difficulty.
+    # `generate(user_id, project_id, position, module)` does the actual work
+    # and is injected so this class knows nothing about Firebase or OpenAI.
+    def __init__(
+        self,
+        generate: GenerateFn,
+        workers: int = PREGEN_WORKERS,
+        ahead: int = PREGEN_AHEAD,
+        max_queued: int = PREGEN_MAX_QUEUED,
+    ) -> None:
+        self._generate = generate
+        self._worker_count = max(1, workers)
+        self.ahead = ahead
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._max_queued = max_queued
+        self._workers: List[asyncio.Task] = []
+        self._seq = itertools.count()
+        self._pending: Set[Tuple[str, str, str]] = set()
+        self._running: Dict[ProjectKey, Set[asyncio.Task]] = {}
+        # Bumped on cancellation; queued jobs from an older epoch are dropped.
+        self._epochs: Dict[ProjectKey, int] = {}
+        self.generated = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _ensure_started(self) -> None:
+        if self._workers:
+            return
+        self._queue = asyncio.PriorityQueue(maxsize=self._max_queued)
+        # Workers outlive the request that starts them, so they get a fresh
+        # context instead of inheriting its per-request state.
+        self._workers = [
+            contextvars.Context().run(asyncio.ensure_future, self._worker()) for _ in range(self._worker_count)
+        ]
+
+    def schedule(self, user_id: str, project_id: str, modules: Dict[str, Any]) -> int:
+        self._ensure_started()
+        project = (user_id, project_id)
+        epoch = self._epochs.get(project, 0)
+        queued = 0
+        for position, module in upcoming_modules(modules, self.ahead):
+            key = (user_id, project_id, position)
+            if key in self._pending:
+                continue
+            job = _Job(user_id, project_id, position, module, epoch)
+            try:
+                self._queue.put_nowait((_difficulty(module), next(self._seq), job))
+            except asyncio.QueueFull:
+                self.dropped += 1
+                break
+            self._pending.add(key)
+            queued += 1
+        return queued
+
+    async def cancel_project(self, user_id: str, project_id: str) -> None:
+        project = (user_id, project_id)
+        self._epochs[project] = self._epochs.get(project, 0) + 1
+        running = list(self._running.get(project, ()))
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.wait(running)
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job = await self._queue.get()
+            project = (job.user_id, job.project_id)
+            try:
+                if job.epoch != self._epochs.get(project, 0):
+                    continue
+                task = asyncio.ensure_future(self._generate(job.user_id, job.project_id, job.position, job.module))
+                self._running.setdefault(project, set()).add(task)
+                try:
+                    # wait() never raises the task's own error or cancellation.
+                    await asyncio.wait({task})
+                finally:
+                    running = self._running.get(project)
+                    running.discard(task)
+                    if not running:
+                        self._running.pop(project, None)
+                if task.cancelled():
+                    continue
+                if task.exception() is not None:
+                    self.failed += 1
+                    traceback.print_exception(task.exception())
+                else:
+                    self.generated += 1
+            finally:
+                self._pending.discard((job.user_id, job.project_id, job.position))
+                self._queue.task_done()
+
+    async def stop(self) -> None:
+        tasks = self._workers + [task for running in self._running.values() for task in running]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._running.clear()
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": sum(len(running) for running in self._running.values()),
+            "generated": self.generated,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
@@ -115,4 +115,23 @@ El usuario enviará un JSON con esta estructura:
   "result": "Contenido teórico...",
   "modulos_previos": ["Módulo A", "Módulo B"]
 }
-"""
\ No newline at end of file
+"""
+TUTOR_SUMMARY_SYSTEM_PROMPT = """
+Eres el asistente de memoria de un tutor de programación.
+Recibes el resumen previo de una conversación tutor-alumno (puede estar vacío) y los mensajes nuevos que hay que incorporar.
+Devuelve un único resumen actualizado, en español y en prosa breve, que conserve:
+- qué ejercicio o concepto se está trabajando,
+- las dudas y errores del alumno,
+- las pistas que el tutor ya ha dado y lo que el alumno ya ha resuelto.
+No inventes información ni des la solución del ejercicio. Devuelve solo el resumen, sin texto adicional.
+"""
+STRUCTURED_REASK_PROMPT = """
+Tu respuesta anterior no cumple el formato pedido:
+{error}
+Devuelve de nuevo la respuesta completa corregida, únicamente como JSON válido y sin texto adicional.
+"""
+STRUCTURED_FIX_ITEMS_PROMPT = """
+Algunos elementos de tu respuesta anterior no cumplen el formato pedido. Recibes un JSON con la clave "items" (los elementos inválidos) y la clave "errores" (los problemas de cada uno, en el mismo orden).
+Corrige solo esos elementos, sin cambiar su contenido más de lo necesario.
+Devuelve únicamente un objeto JSON {"items": [...]} con los elementos corregidos, en el mismo orden y en la misma cantidad.
+"""
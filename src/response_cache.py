@@ -0,0 +1,227 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.embedding_cache import normalize_text, text_key
+from src.vector_search import normalize_rows
+
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "./storage/response_cache.sqlite")
+RESPONSE_CACHE_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "2048"))
+# Cosine similarity above which a cached answer is reused for a different query.
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+# Hits reorder the LRU in memory at once. last_used on disk only decides
+# what is reloaded after a restart, so hits are written in batches of this
+# many (or with the next put) instead of one commit per hit.
+TOUCH_FLUSH_EVERY = 256
+
+CacheKey = Tuple[str, str]
+
+
+def query_key(query: str) -> str:
+    # Case and spacing do not change what a question asks.
+    return text_key(query.casefold())
+
+
+class ResponseCache:
+    # Answers generated from one index version. Level one is an exact match on
+    # the normalised query; level two reuses the answer of the most similar
+    # cached query in the same namespace. Every entry is kept in memory
+    # (embeddings included) and mirrored to SQLite so it survives restarts.
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        max_items: int = RESPONSE_CACHE_MAX_ITEMS,
+        similarity: float = RESPONSE_CACHE_SIMILARITY,
+    ) -> None:
+        self.path = path
+        self.max_items = max_items
+        self.similarity = similarity
+        self.version: Optional[str] = None
+        self._entries: "OrderedDict[CacheKey, Dict[str, Any]]" = OrderedDict()
+        # Per-namespace (keys, unit-norm matrix), rebuilt after any change.
+        self._matrices: Dict[str, Tuple[List[CacheKey], np.ndarray]] = {}
+        # Hits not yet written to disk: key -> time of the last one.
+        self._touched: Dict[CacheKey, float] = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._inherited: List[sqlite3.Connection] = []
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Hits update last_used; losing the last few of those in a crash is fine.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "version TEXT NOT NULL, namespace TEXT NOT NULL, key TEXT NOT NULL, "
+            "query TEXT NOT NULL, embedding BLOB, response TEXT NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (version, namespace, key))"
+        )
+        conn.commit()
+        return conn
+
+    def reopen(self) -> None:
+        # Same as EmbeddingCache.reopen: a forked child gets its own connection.
+        self._inherited.append(self._conn)
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def set_version(self, version: str) -> None:
+        # Answers from another index version may cite content that no longer
+        # exists, so only this version's entries are loaded. The others stay
+        # on disk: workers that have not reloaded yet still use them.
+        with self._lock:
+            if version == self.version:
+                return
+            self._flush_touches()
+            self._conn.commit()
+            self.version = version
+            rows = self._conn.execute(
+                "SELECT namespace, key, query, embedding, response FROM responses "
+                "WHERE version = ? ORDER BY last_used DESC LIMIT ?",
+                (version, self.max_items),
+            ).fetchall()
+            self._entries.clear()
+            self._matrices.clear()
+            for namespace, key, query, blob, response in reversed(rows):
+                embedding = np.frombuffer(blob, dtype=np.float32) if blob is not None else None
+                self._entries[(namespace, key)] = {"query": query, "embedding": embedding, "response": response}
+
+    def forget_versions(self, versions: Sequence[str]) -> None:
+        # For versions whose store was pruned; no worker can load them again.
+        if not versions:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM responses WHERE version = ?", [(version,) for version in versions])
+            self._conn.commit()
+
+    def _is_current(self, version: Optional[str]) -> bool:
+        return version is not None and version == self.version
+
+    def _touch(self, cache_key: CacheKey) -> None:
+        self._entries.move_to_end(cache_key)
+        self._touched[cache_key] = time.time()
+        if len(self._touched) >= TOUCH_FLUSH_EVERY:
+            self._flush_touches()
+            self._conn.commit()
+
+    def _flush_touches(self) -> None:
+        # Leaves the commit to the caller.
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE responses SET last_used = ? WHERE version = ? AND namespace = ? AND key = ?",
+                [(last_used, self.version, *cache_key) for cache_key, last_used in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _matrix(self, namespace: str) -> Tuple[List[CacheKey], np.ndarray]:
+        cached = self._matrices.get(namespace)
+        if cached is None:
+            keys = [k for k, entry in self._entries.items() if k[0] == namespace and entry["embedding"] is not None]
+            if keys:
+                matrix = normalize_rows(np.vstack([self._entries[k]["embedding"] for k in keys]))
+            else:
+                matrix = np.empty((0, 0), dtype=np.float32)
+            cached = self._matrices[namespace] = (keys, matrix)
+        return cached
+
+    def get_exact(self, namespace: str, query: str, version: str) -> Optional[str]:
+        with self._lock:
+            if not self._is_current(version):
+                return None
+            cache_key = (namespace, query_key(query))
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            self._touch(cache_key)
+            self.exact_hits += 1
+            return entry["response"]
+
+    def get_similar(self, namespace: str, embedding: Sequence[float], version: str) -> Optional[str]:
+        with self._lock:
+            if not self._is_current(version):
+                self.misses += 1
+                return None
+            keys, matrix = self._matrix(namespace)
+            if not keys:
+                self.misses += 1
+                return None
+            query = normalize_rows(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                self.misses += 1
+                return None
+            self._touch(keys[best])
+            self.semantic_hits += 1
+            return self._entries[keys[best]]["response"]
+
+    def put(self, namespace: str, query: str, embedding: Optional[Sequence[float]], response: str, version: str) -> None:
+        with self._lock:
+            # The index was swapped while this answer was generated.
+            if not self._is_current(version):
+                return
+            cache_key = (namespace, query_key(query))
+            vector = np.asarray(embedding, dtype=np.float32) if embedding is not None else None
+            self._entries[cache_key] = {"query": normalize_text(query), "embedding": vector, "response": response}
+            self._entries.move_to_end(cache_key)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (version, namespace, key, query, embedding, response, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (version, *cache_key, normalize_text(query), vector.tobytes() if vector is not None else None,
+                 response, time.time()),
+            )
+            evicted = []
+            while len(self._entries) > self.max_items:
+                evicted.append(self._entries.popitem(last=False)[0])
+            if evicted:
+                self._conn.executemany(
+                    "DELETE FROM responses WHERE version = ? AND namespace = ? AND key = ?",
+                    [(version, *k) for k in evicted],
+                )
+            self._flush_touches()
+            self._conn.commit()
+            self._matrices.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "version": self.version,
+            "items": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+        }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+
+def _reopen_after_fork() -> None:
+    if _cache is not None:
+        _cache.reopen()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reopen_after_fork)
@@ -0,0 +1,19 @@
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Kept apart from llama_index_template so callers can read the defaults
+# without importing LlamaIndex.
+
+# Retrieval-only defaults: how many chunks, how diverse, and how much text.
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.5"))
+RETRIEVAL_MMR_FETCH_K = int(os.getenv("RETRIEVAL_MMR_FETCH_K", "20"))
+RETRIEVAL_MAX_TOKENS = int(os.getenv("RETRIEVAL_MAX_TOKENS", "1500"))
+# "vector", "lexical" (BM25 only, no embedding call) or "hybrid" (both, fused).
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+# Candidates taken from each ranking before reciprocal rank fusion.
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
@@ -0,0 +1,205 @@
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+from typing import Any, Dict
+
+# Preforking server for running several workers on one index:
+#   python -m src.serve --workers 4 --port 8000
+# The master imports the app and loads the index once, then forks workers
+# that share those pages copy-on-write. The vectors and BM25 postings are
+# memory-mapped, so they are shared through the page cache as well. When a
+# rebuild makes a new version current, the master loads it and replaces the
+# workers one at a time. Index memory therefore stays flat as workers are
+# added, instead of every worker parsing its own copy.
+SERVE_HOST = os.getenv("SERVE_HOST", "127.0.0.1")
+SERVE_PORT = int(os.getenv("SERVE_PORT", "8000"))
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS", str(os.cpu_count() or 1)))
+# How often the master checks CURRENT; a SIGHUP makes it check at once.
+SERVE_POLL_SECONDS = float(os.getenv("SERVE_POLL_SECONDS", "2"))
+# Time a replaced worker gets to finish its requests before SIGKILL.
+SERVE_GRACEFUL_TIMEOUT = float(os.getenv("SERVE_GRACEFUL_TIMEOUT", "30"))
+MASTER_PID_ENV = "RAG_SERVE_MASTER_PID"
+
+
+def notify_master() -> None:
+    # Called by a worker after its own rebuild, so the master does not wait
+    # for its next poll. A no-op outside src.serve.
+    pid = os.getenv(MASTER_PID_ENV)
+    if not pid or not pid.isdigit() or int(pid) != os.getppid() or not hasattr(signal, "SIGHUP"):
+        return
+    try:
+        os.kill(int(pid), signal.SIGHUP)
+    except OSError:
+        pass
+
+
+def _log(message: str) -> None:
+    print(f"[serve {os.getpid()}] {message}", file=sys.stderr, flush=True)
+
+
+def _listen(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _freeze_heap() -> None:
+    # Moves everything allocated so far out of the collector's reach, so
+    # garbage collection in the workers does not write to (and un-share)
+    # the index pages they inherited.
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
+
+class Master:
+    def __init__(self, app_module: Any, sock: socket.socket, workers: int, log_level: str) -> None:
+        self.app_module = app_module
+        self.sock = sock
+        self.worker_count = workers
+        self.log_level = log_level
+        self.workers: Dict[int, float] = {}
+        # Replaced workers still draining, with the time they were told to stop.
+        self.retiring: Dict[int, float] = {}
+        self._check_now = False
+        self._stopping = False
+
+    def _serve(self) -> None:
+        import uvicorn
+
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        config = uvicorn.Config(self.app_module.app, log_level=self.log_level, lifespan="on")
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._serve()
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+
+    def retire(self, pid: int) -> None:
+        self.workers.pop(pid, None)
+        self.retiring[pid] = time.monotonic()
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.retiring.pop(pid, None) is not None:
+                continue
+            started = self.workers.pop(pid, None)
+            if started is not None and not self._stopping:
+                _log(f"worker {pid} exited unexpectedly; starting a new one")
+                if time.monotonic() - started < 1:
+                    # Crashing at startup; do not spin.
+                    time.sleep(1)
+                self.spawn()
+
+    def kill_stragglers(self) -> None:
+        now = time.monotonic()
+        for pid, since in list(self.retiring.items()):
+            if now - since > SERVE_GRACEFUL_TIMEOUT:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def check_version(self) -> None:
+        if not self.app_module._reload_index_if_stale():
+            return
+        _log(f"index version {self.app_module.rag_index.version} is current; replacing workers")
+        _freeze_heap()
+        # One at a time: the new worker takes connections from the shared
+        # socket while the old one finishes what it has.
+        for pid in list(self.workers):
+            self.spawn()
+            self.retire(pid)
+
+    def _on_sighup(self, signum: int, frame: Any) -> None:
+        self._check_now = True
+
+    def _on_stop(self, signum: int, frame: Any) -> None:
+        self._stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGHUP, self._on_sighup)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        for _ in range(self.worker_count):
+            self.spawn()
+        _log(f"{self.worker_count} workers on index version {self.app_module.rag_index.version}")
+
+        next_check = time.monotonic() + SERVE_POLL_SECONDS
+        while not self._stopping:
+            time.sleep(0.2)
+            self.reap()
+            if self._check_now or time.monotonic() >= next_check:
+                self._check_now = False
+                next_check = time.monotonic() + SERVE_POLL_SECONDS
+                try:
+                    self.check_version()
+                except Exception:
+                    traceback.print_exc()
+            self.kill_stragglers()
+        self.shutdown()
+
+    def shutdown(self) -> None:
+        for pid in list(self.workers):
+            self.retire(pid)
+        deadline = time.monotonic() + SERVE_GRACEFUL_TIMEOUT
+        while self.retiring and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for pid in self.retiring:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve src.app from prefork workers sharing one loaded index.")
+    parser.add_argument("--host", default=SERVE_HOST)
+    parser.add_argument("--port", type=int, default=SERVE_PORT)
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    if not hasattr(os, "fork"):
+        raise SystemExit("src.serve needs os.fork; use uvicorn directly on this platform.")
+
+    # Workers neither poll CURRENT themselves nor notify anyone but us.
+    os.environ["INDEX_RELOAD_POLL_SECONDS"] = "0"
+    os.environ[MASTER_PID_ENV] = str(os.getpid())
+    from src import app as app_module
+
+    app_module.rag_index.get()
+    _freeze_heap()
+    Master(app_module, _listen(args.host, args.port), args.workers, args.log_level).run()
+
+
+if __name__ == "__main__":
+    main()
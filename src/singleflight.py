@@ -0,0 +1,26 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution of `fn`. The work
+    # runs in its own task, so a caller that disconnects does not cancel it
+    # for the others.
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    def cancel(self, match: Callable[[Hashable], bool]) -> List[asyncio.Task]:
+        # Cancels the shared work itself, for every waiter; returns the tasks
+        # so the caller can wait for them to unwind.
+        tasks = [task for key, task in self._inflight.items() if match(key)]
+        for task in tasks:
+            task.cancel()
+        return tasks
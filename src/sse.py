@@ -0,0 +1,23 @@
+import json
+from typing import Any, AsyncIterable, Iterable, Optional, Union
+
+from fastapi.responses import StreamingResponse
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stops nginx-style proxies from buffering the stream.
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    # JSON-encoded so tokens containing newlines stay inside one event.
+    lines = [f"event: {event}"] if event else []
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_response(events: Union[Iterable[str], AsyncIterable[str]]) -> StreamingResponse:
+    # Sync iterables are consumed on the threadpool, so blocking generators
+    # (LlamaIndex streams) do not hold up the event loop.
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
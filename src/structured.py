@@ -0,0 +1,391 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set, Tuple, Type, TypeVar, Union
+
+from pydantic import BaseModel, ValidationError
+
+from src.metrics import inc
+from src.openai_client import OPENAI_CHAT_MODEL, chat_completion_async
+from src.prompts import STRUCTURED_FIX_ITEMS_PROMPT, STRUCTURED_REASK_PROMPT
+
+# JSON-mode chat completions validated against a Pydantic model. Replies are
+# repaired locally when possible. Otherwise the model is asked again, once,
+# and only for the list items that failed. Valid results are cached by
+# (prompt, model, temperature).
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./storage/llm_cache.sqlite")
+LLM_CACHE_MEMORY_ITEMS = int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# Extra completions allowed to fix one invalid reply.
+LLM_REPAIR_ATTEMPTS = int(os.getenv("LLM_REPAIR_ATTEMPTS", "1"))
+# Hedging: when a call runs past the recent LLM_HEDGE_QUANTILE latency for
+# its schema, an identical second call is sent and the first valid reply
+# wins. Off by default since a hedge can double the cost of slow calls.
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = 200
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class StructuredOutputError(ValueError):
+    pass
+
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def parse_json_object(text: str) -> Any:
+    # Strict first, then the usual slips: code fences, prose around the
+    # object and trailing commas. Raises ValueError.
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    candidate = _FENCE.sub("", text.strip())
+    start, end = candidate.find("{"), candidate.rfind("}")
+    if start != -1 and end > start:
+        candidate = candidate[start:end + 1]
+    return json.loads(_TRAILING_COMMA.sub(r"\1", candidate))
+
+
+def prompt_key(messages: Sequence[Dict[str, str]], schema_name: str) -> str:
+    payload = json.dumps([schema_name, list(messages)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StructuredCache:
+    # Same layout as the embedding cache: SQLite for every entry, an LRU in
+    # front for the hot ones. Entries older than the TTL are ignored.
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        memory_items: int = LLM_CACHE_MEMORY_ITEMS,
+        ttl: float = LLM_CACHE_TTL,
+    ) -> None:
+        self.path = path
+        self.memory_items = memory_items
+        self.ttl = ttl
+        self._memory: "OrderedDict[Tuple[str, str, float], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._inherited: List[sqlite3.Connection] = []
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT NOT NULL, model TEXT NOT NULL, temperature REAL NOT NULL, "
+            "value TEXT NOT NULL, created_at REAL NOT NULL, "
+            "PRIMARY KEY (key, model, temperature))"
+        )
+        conn.commit()
+        return conn
+
+    def reopen(self) -> None:
+        # Same as EmbeddingCache.reopen: a forked child gets its own connection.
+        self._inherited.append(self._conn)
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _remember(self, cache_key: Tuple[str, str, float], created_at: float, value: Any) -> None:
+        self._memory[cache_key] = (created_at, value)
+        self._memory.move_to_end(cache_key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, model: str, temperature: float) -> Optional[Any]:
+        cache_key = (key, model, temperature)
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            entry = self._memory.get(cache_key)
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT created_at, value FROM completions WHERE key = ? AND model = ? AND temperature = ?",
+                    cache_key,
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], json.loads(row[1]))
+                    self._remember(cache_key, *entry)
+            if entry is None or entry[0] < cutoff:
+                self.misses += 1
+                return None
+            self._memory.move_to_end(cache_key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, model: str, temperature: float, value: Any) -> None:
+        created_at = time.time()
+        with self._lock:
+            self._remember((key, model, temperature), created_at, value)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, model, temperature, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, temperature, json.dumps(value, ensure_ascii=False), created_at),
+            )
+            self._conn.execute("DELETE FROM completions WHERE created_at < ?", (created_at - self.ttl,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_items": len(self._memory),
+        }
+
+
+_cache: Optional[StructuredCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_structured_cache() -> StructuredCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = StructuredCache()
+        return _cache
+
+
+def _reopen_after_fork() -> None:
+    if _cache is not None:
+        _cache.reopen()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reopen_after_fork)
+
+
+# Recent call latencies per schema, for the hedge deadline.
+_latencies: Dict[str, Deque[float]] = {}
+# Models that rejected response_format; they get plain completions.
+_no_json_mode: Set[str] = set()
+
+
+def _hedge_delay(schema_name: str) -> Optional[float]:
+    window = _latencies.get(schema_name)
+    if not window or len(window) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(window)
+    return ordered[min(len(ordered) - 1, int(LLM_HEDGE_QUANTILE * len(ordered)))]
+
+
+def _rejects_json_mode(error: Any) -> bool:
+    # A 400 about response_format itself, not about the prompt (context
+    # length, content policy, malformed messages).
+    if getattr(error, "param", None) == "response_format":
+        return True
+    message = str(error).lower()
+    return "response_format" in message or "json_object" in message
+
+
+async def _complete(messages: List[Dict[str, str]], model: str, temperature: float) -> str:
+    from openai import BadRequestError
+
+    kwargs: Dict[str, Any] = {"model": model, "messages": messages, "temperature": temperature}
+    if model not in _no_json_mode:
+        try:
+            response = await chat_completion_async(response_format={"type": "json_object"}, **kwargs)
+            return response.choices[0].message.content or ""
+        except BadRequestError as e:
+            if not _rejects_json_mode(e):
+                raise
+            # The model has no JSON mode, which will not change.
+            _no_json_mode.add(model)
+    response = await chat_completion_async(**kwargs)
+    return response.choices[0].message.content or ""
+
+
+def _check(content: str, schema: Type[Model]) -> Tuple[Optional[Model], Any, Union[str, ValidationError, None]]:
+    # (result, parsed data, error); result is None unless the reply is valid.
+    try:
+        data = parse_json_object(content)
+    except ValueError as e:
+        return None, None, f"not valid JSON: {e}"
+    try:
+        return schema.model_validate(data), data, None
+    except ValidationError as e:
+        return None, data, e
+
+
+async def _attempt(
+    messages: List[Dict[str, str]], schema: Type[Model], model: str, temperature: float,
+) -> Tuple[str, Optional[Model]]:
+    window = _latencies.setdefault(schema.__name__, deque(maxlen=LATENCY_WINDOW))
+    start = time.perf_counter()
+    try:
+        content = await _complete(messages, model, temperature)
+    except asyncio.CancelledError:
+        # Cut short by a winning hedge; it ran at least this long. Without it
+        # the window would drift to fast calls and the deadline would shrink.
+        window.append(time.perf_counter() - start)
+        raise
+    window.append(time.perf_counter() - start)
+    return content, _check(content, schema)[0]
+
+
+async def _first_valid(
+    messages: List[Dict[str, str]], schema: Type[Model], model: str, temperature: float, hedge: bool,
+) -> Tuple[str, Optional[Model]]:
+    # Returns the first valid reply, or else the first reply, for repair.
+    delay = _hedge_delay(schema.__name__) if hedge else None
+    first = asyncio.ensure_future(_attempt(messages, schema, model, temperature))
+    if delay is None:
+        return await first
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    inc("llm_hedged_calls_total", schema=schema.__name__)
+    pending = {first, asyncio.ensure_future(_attempt(messages, schema, model, temperature))}
+    fallback: Optional[Tuple[str, Optional[Model]]] = None
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                content, result = task.result()
+                if result is not None:
+                    return content, result
+                fallback = fallback or (content, result)
+    finally:
+        for task in pending:
+            task.cancel()
+    if fallback is not None:
+        return fallback
+    raise error
+
+
+def _item_errors(error: Any, list_field: Optional[str]) -> Optional[Dict[int, List[str]]]:
+    # Error messages by item index, when every error lies inside an item of
+    # list_field; None when anything else is wrong too.
+    if list_field is None or not isinstance(error, ValidationError):
+        return None
+    items: Dict[int, List[str]] = {}
+    for detail in error.errors():
+        loc = detail["loc"]
+        if len(loc) < 2 or loc[0] != list_field or not isinstance(loc[1], int):
+            return None
+        field = ".".join(str(part) for part in loc[2:]) or "item"
+        items.setdefault(loc[1], []).append(f"{field}: {detail['msg']}")
+    return items
+
+
+async def _fix_items(
+    messages: List[Dict[str, str]],
+    data: Dict[str, Any],
+    list_field: str,
+    bad_items: Dict[int, List[str]],
+    model: str,
+    temperature: float,
+) -> Dict[str, Any]:
+    # Sends back only the broken items (with the original system prompt for
+    # the schema), so the reply is a few items rather than the whole list.
+    positions = sorted(bad_items)
+    items = data[list_field]
+    request = {"items": [items[i] for i in positions], "errores": [bad_items[i] for i in positions]}
+    fix_messages = [message for message in messages[:1] if message["role"] == "system"] + [
+        {"role": "user", "content": STRUCTURED_FIX_ITEMS_PROMPT + json.dumps(request, ensure_ascii=False)},
+    ]
+    try:
+        fixed = parse_json_object(await _complete(fix_messages, model, temperature)).get("items")
+    except (ValueError, AttributeError):
+        return data
+    if not isinstance(fixed, list) or len(fixed) != len(positions):
+        return data
+    items = list(items)
+    for position, item in zip(positions, fixed):
+        items[position] = item
+    return {**data, list_field: items}
+
+
+def _reask_messages(messages: List[Dict[str, str]], content: str, error: Any) -> List[Dict[str, str]]:
+    return [
+        *messages,
+        {"role": "assistant", "content": content},
+        {"role": "user", "content": STRUCTURED_REASK_PROMPT.format(error=error)},
+    ]
+
+
+async def _repair(
+    messages: List[Dict[str, str]],
+    schema: Type[Model],
+    model: str,
+    temperature: float,
+    content: str,
+    list_field: Optional[str],
+    drop_invalid_items: bool,
+) -> Model:
+    name = schema.__name__
+    calls_left = LLM_REPAIR_ATTEMPTS
+    while True:
+        result, data, error = _check(content, schema)
+        if result is not None:
+            return result
+        bad_items = _item_errors(error, list_field)
+        if bad_items and calls_left > 0:
+            calls_left -= 1
+            inc("llm_repairs_total", schema=name, kind="items")
+            content = json.dumps(await _fix_items(messages, data, list_field, bad_items, model, temperature))
+            continue
+        if bad_items and drop_invalid_items:
+            kept = [item for i, item in enumerate(data[list_field]) if i not in bad_items]
+            result = _check(json.dumps({**data, list_field: kept}), schema)[0]
+            if result is not None:
+                inc("llm_repairs_total", schema=name, kind="dropped")
+                return result
+        if calls_left == 0:
+            raise StructuredOutputError(f"{name} reply failed validation: {error}")
+        calls_left -= 1
+        inc("llm_repairs_total", schema=name, kind="reask")
+        content = await _complete(_reask_messages(messages, content, error), model, temperature)
+
+
+async def generate_structured(
+    messages: List[Dict[str, str]],
+    schema: Type[Model],
+    temperature: float = 0.2,
+    model: Optional[str] = None,
+    list_field: Optional[str] = None,
+    drop_invalid_items: bool = False,
+    hedge: bool = LLM_HEDGE,
+    cache: bool = LLM_CACHE_ENABLED,
+) -> Model:
+    # list_field names the schema's list whose items can be fixed one by one;
+    # with drop_invalid_items, items that stay invalid are left out rather
+    # than failing the call. Raises StructuredOutputError.
+    model = model or OPENAI_CHAT_MODEL
+    key = prompt_key(messages, schema.__name__)
+    store = get_structured_cache() if cache else None
+    if store is not None:
+        hit = await asyncio.to_thread(store.get, key, model, temperature)
+        if hit is not None:
+            try:
+                return schema.model_validate(hit)
+            except ValidationError:
+                pass  # Cached under an older schema.
+
+    content, result = await _first_valid(messages, schema, model, temperature, hedge)
+    if result is None:
+        result = await _repair(messages, schema, model, temperature, content, list_field, drop_invalid_items)
+    if store is not None:
+        await asyncio.to_thread(store.put, key, model, temperature, result.model_dump(mode="json"))
+    return result
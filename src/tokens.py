@@ -0,0 +1,39 @@
+from typing import Callable, Optional
+
+from src.openai_client import OPENAI_CHAT_MODEL
+
+_encoder: Optional[Callable[[str], int]] = None
+
+
+def _load_encoder() -> Callable[[str], int]:
+    # tiktoken fetches its BPE tables on first use; without them (offline,
+    # not installed) fall back to the usual ~4 characters per token.
+    try:
+        import tiktoken
+
+        try:
+            encoding = tiktoken.encoding_for_model(OPENAI_CHAT_MODEL)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return lambda text: len(text) // 4 + 1
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def count_text_tokens(text: str) -> int:
+    global _encoder
+    if _encoder is None:
+        _encoder = _load_encoder()
+    return _encoder(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    # Cuts on a word boundary; only used for the odd chunk that alone
+    # exceeds a budget, so a linear shrink is fine.
+    if count_text_tokens(text) <= max_tokens:
+        return text
+    words = text.split(" ")
+    keep = max(1, len(words) * max_tokens // max(1, count_text_tokens(text)))
+    while keep > 1 and count_text_tokens(" ".join(words[:keep])) > max_tokens:
+        keep = keep * 9 // 10
+    return " ".join(words[:keep])
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from src.openai_client import chat_completion_async
+from src.prompts import TUTOR_SUMMARY_SYSTEM_PROMPT
+from src.tokens import count_text_tokens, truncate_to_tokens
+
+# The prompt sent to the model is the system prompt, a rolling summary of the
+# older turns, and the latest turns verbatim. Older turns are folded into the
+# summary a batch at a time, so the summary is not regenerated on every turn.
+TUTOR_HISTORY_TOKEN_BUDGET = int(os.getenv("TUTOR_HISTORY_TOKEN_BUDGET", "2000"))
+TUTOR_KEEP_MESSAGES = int(os.getenv("TUTOR_KEEP_MESSAGES", "6"))
+TUTOR_FOLD_BATCH = int(os.getenv("TUTOR_FOLD_BATCH", "4"))
+TUTOR_SUMMARY_MAX_TOKENS = int(os.getenv("TUTOR_SUMMARY_MAX_TOKENS", "250"))
+TUTOR_MAX_SESSIONS = int(os.getenv("TUTOR_MAX_SESSIONS", "10000"))
+TUTOR_SESSION_TTL = float(os.getenv("TUTOR_SESSION_TTL", str(6 * 3600)))
+
+# Per-message framing the chat format adds on top of the content.
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_message_tokens(messages: Sequence[Dict[str, str]]) -> int:
+    return sum(count_text_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def derive_session_id(exercise_context: str, messages: Sequence[Dict[str, str]]) -> str:
+    # For clients that send no session id: the exercise and the opening
+    # message identify a conversation, since every turn resends the history.
+    first = messages[0]["content"] if messages else ""
+    return hashlib.sha256(json.dumps([exercise_context, first]).encode("utf-8")).hexdigest()
+
+
+class _Session:
+    def __init__(self) -> None:
+        self.summary = ""
+        # How many leading messages of the history the summary covers, and a
+        # digest of them to notice when the client sends a different history.
+        self.covered = 0
+        self.covered_digest = ""
+        self.lock = asyncio.Lock()
+        self.touched_at = time.time()
+
+
+def _digest(messages: Sequence[Dict[str, str]]) -> str:
+    return hashlib.sha256(json.dumps(list(messages), ensure_ascii=True).encode("utf-8")).hexdigest()
+
+
+def _render(messages: Sequence[Dict[str, str]]) -> str:
+    return "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+
+
+async def summarize_turns(summary: str, messages: Sequence[Dict[str, str]]) -> str:
+    response = await chat_completion_async(
+        messages=[
+            {"role": "system", "content": TUTOR_SUMMARY_SYSTEM_PROMPT},
+            {
+                "role": "user",
+                "content": f"Resumen previo:\n{summary or '(vacío)'}\n\nMensajes nuevos:\n{_render(messages)}",
+            },
+        ],
+        temperature=0.2,
+        max_tokens=TUTOR_SUMMARY_MAX_TOKENS,
+    )
+    return (response.choices[0].message.content or "").strip()
+
+
+class TutorContext:
+    def __init__(
+        self,
+        summarize: Callable[[str, Sequence[Dict[str, str]]], Any] = summarize_turns,
+        budget: int = TUTOR_HISTORY_TOKEN_BUDGET,
+        keep: int = TUTOR_KEEP_MESSAGES,
+        fold_batch: int = TUTOR_FOLD_BATCH,
+    ) -> None:
+        self._summarize = summarize
+        self.budget = budget
+        self.keep = max(1, keep)
+        self.fold_batch = max(1, fold_batch)
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self.summaries = 0
+
+    def _session(self, session_id: str) -> _Session:
+        now = time.time()
+        session = self._sessions.get(session_id)
+        if session is None or now - session.touched_at > TUTOR_SESSION_TTL:
+            session = self._sessions[session_id] = _Session()
+        session.touched_at = now
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > TUTOR_MAX_SESSIONS:
+            self._sessions.popitem(last=False)
+        return session
+
+    def _summary_message(self, summary: str) -> List[Dict[str, str]]:
+        if not summary:
+            return []
+        return [{"role": "system", "content": f"Resumen de la conversación anterior:\n{summary}"}]
+
+    def _fold_point(self, system: List[Dict[str, str]], history: List[Dict[str, str]], covered: int) -> int:
+        # Index up to which the history should be summarised; `covered` if
+        # nothing needs folding yet.
+        pending = len(history) - covered
+        fold_to = covered
+        if pending > self.keep + self.fold_batch:
+            fold_to = len(history) - self.keep
+        # Over budget: keep folding the oldest verbatim turn, down to the last one.
+        reserved = count_message_tokens(system) + TUTOR_SUMMARY_MAX_TOKENS + MESSAGE_OVERHEAD_TOKENS
+        while fold_to < len(history) - 1 and reserved + count_message_tokens(history[fold_to:]) > self.budget:
+            fold_to += 1
+        return fold_to
+
+    async def build(
+        self,
+        system_prompt: str,
+        history: List[Dict[str, str]],
+        session_id: Optional[str] = None,
+        exercise_context: str = "",
+    ) -> List[Dict[str, str]]:
+        system = [{"role": "system", "content": system_prompt}]
+        if count_message_tokens(system + history) <= self.budget and len(history) <= self.keep + self.fold_batch:
+            return system + history
+
+        session = self._session(session_id or derive_session_id(exercise_context, history))
+        async with session.lock:
+            # The client resent a different (edited or restarted) history.
+            if session.covered > len(history) or _digest(history[:session.covered]) != session.covered_digest:
+                session.summary, session.covered, session.covered_digest = "", 0, _digest([])
+
+            fold_to = self._fold_point(system, history, session.covered)
+            if fold_to > session.covered:
+                session.summary = await self._summarize(session.summary, history[session.covered:fold_to])
+                session.covered = fold_to
+                session.covered_digest = _digest(history[:fold_to])
+                self.summaries += 1
+            return self._fit(system + self._summary_message(session.summary), history[session.covered:])
+
+    def _fit(self, head: List[Dict[str, str]], recent: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        # Folding stops at the last message; if that one alone is over the
+        # budget, it is cut to what the system prompt and summary leave.
+        if not recent or count_message_tokens(head + recent) <= self.budget:
+            return head + recent
+        last = recent[-1]
+        left = self.budget - count_message_tokens(head + recent[:-1]) - MESSAGE_OVERHEAD_TOKENS
+        return head + recent[:-1] + [{**last, "content": truncate_to_tokens(last["content"], max(0, left))}]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sessions": len(self._sessions), "summaries": self.summaries}
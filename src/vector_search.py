@@ -0,0 +1,110 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# OpenAI embeddings come back unit-normalised; within this tolerance we can use
+# the (possibly memory-mapped) matrix as-is instead of keeping a private copy.
+NORM_TOLERANCE = 1e-3
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    # argpartition is O(n); only the k winners get fully sorted.
+    if k >= scores.shape[-1]:
+        return np.argsort(-scores, axis=-1)
+    part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    part_scores = np.take_along_axis(scores, part, axis=-1)
+    order = np.argsort(-part_scores, axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+
+def mmr_select(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = 0.5) -> List[int]:
+    # Maximal marginal relevance over unit-norm candidate rows: each pick
+    # trades similarity to the query against similarity to what is already
+    # picked. Returns candidate positions in pick order.
+    n = candidates.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    relevance = candidates @ query
+    pairwise = candidates @ candidates.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = pairwise[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, n):
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        pick = int(np.argmax(scores))
+        selected.append(pick)
+        available[pick] = False
+        redundancy = np.maximum(redundancy, pairwise[pick])
+    return selected
+
+
+class VectorSearchEngine:
+    def __init__(self, matrix: np.ndarray, ids: Sequence[str]) -> None:
+        if matrix.shape[0] != len(ids):
+            raise ValueError(f"Got {matrix.shape[0]} vectors for {len(ids)} ids.")
+        self.ids = list(ids)
+        self.matrix = self._prepare(matrix)
+        self._rows_by_id: Optional[Dict[str, int]] = None
+
+    @staticmethod
+    def _prepare(matrix: np.ndarray) -> np.ndarray:
+        if matrix.size == 0:
+            return np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1)
+        if matrix.dtype == np.float32 and np.all(np.abs(norms - 1.0) <= NORM_TOLERANCE):
+            return matrix
+        return normalize_rows(np.asarray(matrix, dtype=np.float32))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def vectors(self, ids: Sequence[str]) -> np.ndarray:
+        # Unit-norm rows for the given ids, in the given order.
+        if self._rows_by_id is None:
+            self._rows_by_id = {node_id: row for row, node_id in enumerate(self.ids)}
+        return self.matrix[[self._rows_by_id[node_id] for node_id in ids]]
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int,
+        rows: Optional[np.ndarray] = None,
+    ) -> Tuple[List[float], List[str]]:
+        scores, ids = self.search_batch([query], k, rows=rows)
+        return scores[0], ids[0]
+
+    def search_batch(
+        self,
+        queries: Sequence[Sequence[float]],
+        k: int,
+        rows: Optional[np.ndarray] = None,
+    ) -> Tuple[List[List[float]], List[List[str]]]:
+        n_queries = len(queries)
+        if n_queries == 0:
+            return [], []
+        if len(self.ids) == 0 or k <= 0:
+            return [[] for _ in range(n_queries)], [[] for _ in range(n_queries)]
+
+        q = normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        matrix = self.matrix if rows is None else self.matrix[rows]
+        if matrix.shape[0] == 0:
+            return [[] for _ in range(n_queries)], [[] for _ in range(n_queries)]
+
+        # One (n_queries x dim) @ (dim x n_vectors) product for the whole batch.
+        scores = q @ matrix.T
+        top = top_k_rows(scores, min(k, matrix.shape[0]))
+        top_scores = np.take_along_axis(scores, top, axis=-1)
+        if rows is not None:
+            top = rows[top]
+        return (
+            top_scores.tolist(),
+            [[self.ids[i] for i in row] for row in top],
+        )
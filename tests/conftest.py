@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+from bench.run import _free_port
+
+# The tests talk to the fakes in bench/ instead of OpenAI and Firebase. The
+# src modules read their settings at import time, so everything is pointed
+# at the fakes and at a scratch directory before any of them is imported.
+SCRATCH_DIR = tempfile.mkdtemp(prefix="rag-tests-")
+OPENAI_PORT = _free_port()
+FIREBASE_PORT = _free_port()
+
+os.environ.update({
+    "OPENAI_API_KEY": "test",
+    "OPENAI_BASE_URL": f"http://127.0.0.1:{OPENAI_PORT}/v1",
+    "FIREBASE_DB_URL": f"http://127.0.0.1:{FIREBASE_PORT}",
+    "FIREBASE_DB_AUTH": "",
+    "FIREBASE_BACKOFF_BASE": "0.001",
+    "FAKE_OPENAI_EMBED_LATENCY_MS": "0",
+    "FAKE_OPENAI_CHAT_LATENCY_MS": "0",
+    "FAKE_OPENAI_TOKEN_LATENCY_MS": "0",
+    "FAKE_OPENAI_EMBED_DIM": "64",
+    "EMBEDDING_CACHE_PATH": os.path.join(SCRATCH_DIR, "embedding_cache.sqlite"),
+    "RESPONSE_CACHE_PATH": os.path.join(SCRATCH_DIR, "response_cache.sqlite"),
+    "LLM_CACHE_PATH": os.path.join(SCRATCH_DIR, "llm_cache.sqlite"),
+    "REBUILD_JOBS_DIR": os.path.join(SCRATCH_DIR, "rebuild_jobs"),
+    "INGEST_WORKERS": "1",
+    "INDEX_WARMUP": "0",
+    "INDEX_RELOAD_POLL_SECONDS": "0",
+})
+
+
+class _ThreadedServer:
+    # uvicorn on a daemon thread, so tests can also inspect the fake's state.
+    def __init__(self, app, port: int) -> None:
+        import uvicorn
+
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> "_ThreadedServer":
+        self.thread.start()
+        deadline = time.monotonic() + 30
+        while not self.server.started:
+            if not self.thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("Fake server did not start.")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+@pytest.fixture(scope="session")
+def fake_openai():
+    from bench import fake_openai
+
+    with _ThreadedServer(fake_openai.app, OPENAI_PORT):
+        yield fake_openai.app
+
+
+@pytest.fixture(scope="session")
+def _fake_firebase_server():
+    from bench import fake_firebase
+
+    with _ThreadedServer(fake_firebase.app, FIREBASE_PORT):
+        yield fake_firebase.app
+
+
+@pytest.fixture
+def fake_firebase(_fake_firebase_server):
+    # An empty database and an empty document cache for every test.
+    from src.firebase_client import document_cache
+
+    _fake_firebase_server.state.root = None
+    document_cache.clear()
+    yield _fake_firebase_server
+    _fake_firebase_server.state.root = None
+    document_cache.clear()
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+from src import firebase_client
+from src.firebase_client import DocumentCache
+
+
+def _filled(*paths):
+    cache = DocumentCache(max_bytes=1024, ttl=60)
+    for path in paths:
+        cache.store(path, '{"v": 1}', f"etag-{path}", cache.generation)
+    return cache
+
+
+def test_write_invalidates_path_descendants_and_ancestors():
+    cache = _filled("users/u1", "users/u1/projects/p1", "users/u1/projects/p1/curriculum", "users/u2", "")
+
+    cache.invalidate("users/u1/projects/p1")
+
+    assert cache.lookup("users/u1/projects/p1") is None
+    assert cache.lookup("users/u1/projects/p1/curriculum") is None
+    assert cache.lookup("users/u1") is None
+    assert cache.lookup("") is None
+    assert cache.lookup("users/u2") is not None
+
+
+def test_siblings_with_a_common_prefix_survive():
+    cache = _filled("users/u1", "users/u10")
+
+    cache.invalidate("users/u1")
+
+    assert cache.lookup("users/u10") is not None
+
+
+def test_read_started_before_a_write_is_not_stored():
+    cache = DocumentCache(max_bytes=1024, ttl=60)
+    generation = cache.generation
+
+    cache.invalidate("users/u1")
+    cache.store("users/u1", '{"v": "old"}', "etag", generation)
+
+    assert cache.lookup("users/u1") is None
+
+
+def test_byte_bound_evicts_least_recently_used():
+    cache = DocumentCache(max_bytes=20, ttl=60)
+    cache.store("a", "x" * 10, "ea", cache.generation)
+    cache.store("b", "x" * 10, "eb", cache.generation)
+    cache.lookup("a")
+    cache.store("c", "x" * 10, "ec", cache.generation)
+
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None and cache.lookup("c") is not None
+    assert cache.stats()["bytes"] == 20
+
+
+def test_cached_reads_see_writes_through_the_client(fake_firebase):
+    firebase_client.firebase_put("users/u1", {"name": "Ana", "projects": {"p1": {"title": "SQL"}}})
+    assert firebase_client.firebase_get("users/u1", cached=True)["name"] == "Ana"
+    hits = firebase_client.cache_stats()["hits"]
+    assert firebase_client.firebase_get("users/u1", cached=True)["name"] == "Ana"
+    assert firebase_client.cache_stats()["hits"] == hits + 1
+
+    firebase_client.firebase_patch("users/u1/projects/p1", {"title": "React"})
+
+    assert firebase_client.firebase_get("users/u1", cached=True)["projects"]["p1"]["title"] == "React"
+
+
+@pytest.mark.anyio
+async def test_multi_path_update_invalidates_each_listed_path(fake_firebase):
+    await firebase_client.firebase_put_async("users", {"u1": {"name": "Ana"}, "u2": {"name": "Luis"}})
+    await firebase_client.firebase_get_async("users/u1", cached=True)
+    await firebase_client.firebase_get_async("users/u2", cached=True)
+
+    await firebase_client.firebase_update_async({"users/u1/name": "Eva"})
+
+    assert (await firebase_client.firebase_get_async("users/u1", cached=True))["name"] == "Eva"
+    assert firebase_client.document_cache.lookup("users/u2") is not None
+
+
+class _HeldWrites(httpx.AsyncBaseTransport):
+    # Holds writes while `release` is clear, as a slow network would.
+    def __init__(self, inner: httpx.AsyncBaseTransport) -> None:
+        self.inner = inner
+        self.write_sent = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.method != "GET":
+            self.write_sent.set()
+            await self.release.wait()
+        return await self.inner.handle_async_request(request)
+
+
+@pytest.mark.anyio
+async def test_read_during_a_pending_write_is_not_served_afterwards(fake_firebase):
+    held = _HeldWrites(httpx.ASGITransport(app=fake_firebase))
+    firebase_client.configure_async_client(held)
+    try:
+        await firebase_client.firebase_put_async("users/u1", {"name": "Ana"})
+        held.release.clear()
+        held.write_sent.clear()
+
+        async def read_while_pending():
+            await held.write_sent.wait()
+            # The server still has the old value, and this read caches it.
+            value = await firebase_client.firebase_get_async("users/u1", cached=True)
+            held.release.set()
+            return value
+
+        stale, _ = await asyncio.wait_for(
+            asyncio.gather(read_while_pending(), firebase_client.firebase_patch_async("users/u1", {"name": "Eva"})),
+            timeout=10,
+        )
+
+        assert stale == {"name": "Ana"}
+        assert await firebase_client.firebase_get_async("users/u1", cached=True) == {"name": "Eva"}
+    finally:
+        firebase_client.configure_async_client(None)
+
+
+def test_sync_read_during_a_pending_write_is_not_served_afterwards(fake_firebase, monkeypatch):
+    firebase_client.firebase_put("users/u1", {"name": "Ana"})
+    send = firebase_client._session.request
+
+    def request(method, url, **kwargs):
+        if method != "GET":
+            # Another thread reads (and caches) the old value before the write lands.
+            reader = threading.Thread(target=firebase_client.firebase_get, args=("users/u1",), kwargs={"cached": True})
+            reader.start()
+            reader.join()
+            assert firebase_client.document_cache.lookup("users/u1") is not None
+        return send(method, url, **kwargs)
+
+    monkeypatch.setattr(firebase_client._session, "request", request)
+    firebase_client.firebase_patch("users/u1", {"name": "Eva"})
+
+    assert firebase_client.firebase_get("users/u1", cached=True) == {"name": "Eva"}
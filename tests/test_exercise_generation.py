@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from src import app as app_module
+from src.app import ExercisesAgentOutput
+from src.firebase_client import firebase_get_async, firebase_put_async
+
+pytestmark = pytest.mark.anyio
+
+PROJECT = "curriculums/u1/p1"
+MODULE = f"{PROJECT}/curriculum/0"
+EXERCISE = {"titulo": "JOIN", "tipo": "codigo", "enunciado": "Une dos tablas.", "respuesta_correcta": "JOIN"}
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    # No retrieval or model calls; the hooks run mid-generation.
+    calls = []
+    hooks = []
+
+    async def call_exercises_agent(topic, notes):
+        calls.append(topic)
+        for hook in hooks:
+            await hook()
+        return ExercisesAgentOutput(ejercicios=[EXERCISE])
+
+    monkeypatch.setattr(app_module, "_rag_notes_for_module", lambda title: "")
+    monkeypatch.setattr(app_module, "_call_exercises_agent", call_exercises_agent)
+    monkeypatch.setattr(app_module, "GENERATION_POLL_SECONDS", 0.01)
+    return calls, hooks
+
+
+def _delete_project():
+    return firebase_put_async(PROJECT, None)
+
+
+async def _generate():
+    return await app_module._generate_module_exercises(PROJECT, "0", "SQL")
+
+
+async def test_exercises_are_stored_on_the_module(fake_firebase, agent):
+    await firebase_put_async(MODULE, {"moduleId": 0, "titulo": "SQL"})
+
+    ejercicios = await _generate()
+
+    module = await firebase_get_async(MODULE)
+    assert module["ejercicios"] == ejercicios and ejercicios[0]["titulo"] == "JOIN"
+    assert "ejercicios_status" not in module
+
+
+async def test_missing_module_is_not_claimed(fake_firebase, agent):
+    calls, _ = agent
+
+    with pytest.raises(HTTPException) as error:
+        await _generate()
+
+    assert error.value.status_code == 404
+    assert calls == [] and await firebase_get_async("curriculums") is None
+
+
+async def test_module_deleted_while_waiting_for_another_worker(fake_firebase, agent):
+    calls, _ = agent
+    marker = {"state": "generating", "owner": "other:1", "started_at": int(time.time() * 1000)}
+    await firebase_put_async(MODULE, {"moduleId": 0, "titulo": "SQL", "ejercicios_status": marker})
+
+    async def delete_soon():
+        await asyncio.sleep(0.05)
+        await _delete_project()
+
+    with pytest.raises(HTTPException) as error:
+        await asyncio.wait_for(asyncio.gather(_generate(), delete_soon()), timeout=10)
+
+    assert error.value.status_code == 404
+    assert calls == [] and await firebase_get_async("curriculums") is None
+
+
+async def test_module_deleted_during_generation_is_not_recreated(fake_firebase, agent):
+    calls, hooks = agent
+    await firebase_put_async(MODULE, {"moduleId": 0, "titulo": "SQL"})
+    hooks.append(_delete_project)
+
+    with pytest.raises(HTTPException) as error:
+        await _generate()
+
+    assert error.value.status_code == 404
+    assert calls == ["SQL"] and await firebase_get_async("curriculums") is None
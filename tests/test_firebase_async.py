@@ -0,0 +1,109 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src import firebase_client
+from src.firebase_client import FirebaseError
+
+pytestmark = pytest.mark.anyio
+
+
+class FlakyTransport(httpx.AsyncBaseTransport):
+    # Fails the first requests as scripted ("connect", "read" or a status
+    # code), then hands the rest to the fake database in-process. delays
+    # records the attempt number of every backoff.
+    def __init__(self, inner: httpx.AsyncBaseTransport) -> None:
+        self.inner = inner
+        self.failures = []
+        self.methods = []
+        self.delays = []
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.methods.append(request.method)
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure == "connect":
+                raise httpx.ConnectError("connection refused", request=request)
+            if failure == "read":
+                raise httpx.ReadError("connection reset", request=request)
+            return httpx.Response(failure, text="unavailable")
+        return await self.inner.handle_async_request(request)
+
+
+@pytest.fixture
+def transport(fake_firebase, monkeypatch):
+    flaky = FlakyTransport(httpx.ASGITransport(app=fake_firebase))
+    monkeypatch.setattr(firebase_client, "_backoff_delay", lambda attempt: flaky.delays.append(attempt) or 0)
+    firebase_client.configure_async_client(flaky)
+    yield flaky
+    firebase_client.configure_async_client(None)
+
+
+async def test_reads_are_retried_with_backoff(transport):
+    await firebase_client.firebase_put_async("users/u1", {"name": "Ana"})
+    transport.methods.clear()
+    transport.failures.extend([503, "connect", "read"])
+
+    assert await firebase_client.firebase_get_async("users/u1") == {"name": "Ana"}
+    assert transport.methods == ["GET"] * 4
+    assert transport.delays == [0, 1, 2]
+
+
+async def test_retries_stop_after_max_retries(transport):
+    transport.failures.extend([500] * (firebase_client.FIREBASE_MAX_RETRIES + 1))
+
+    with pytest.raises(FirebaseError):
+        await firebase_client.firebase_get_async("users/u1")
+    assert len(transport.methods) == firebase_client.FIREBASE_MAX_RETRIES + 1
+
+
+async def test_post_is_only_retried_when_it_never_reached_the_server(transport, fake_firebase):
+    transport.failures.append("connect")
+    assert await firebase_client.firebase_post_async("clients", {"name": "Ana"})
+    assert len(fake_firebase.state.root["clients"]) == 1
+
+    for failure in (503, "read"):
+        transport.methods.clear()
+        transport.failures.append(failure)
+        with pytest.raises(FirebaseError):
+            await firebase_client.firebase_post_async("clients", {"name": "Luis"})
+        assert transport.methods == ["POST"]
+    assert len(fake_firebase.state.root["clients"]) == 1
+
+
+async def test_rate_limited_post_is_retried(transport, fake_firebase):
+    transport.failures.append(429)
+
+    assert await firebase_client.firebase_post_async("clients", {"name": "Ana"})
+    assert transport.methods == ["POST", "POST"]
+
+
+async def test_calls_on_one_loop_share_a_pooled_client(transport):
+    await firebase_client.firebase_put_async("users", {"u1": {"n": 1}, "u2": {"n": 2}})
+    client = firebase_client._get_async_client()
+
+    values = await asyncio.gather(*(firebase_client.firebase_get_async(f"users/u{i}") for i in (1, 2)))
+
+    assert values == [{"n": 1}, {"n": 2}]
+    assert firebase_client._get_async_client() is client
+
+
+def test_a_new_event_loop_gets_its_own_client(transport):
+    async def current_client():
+        await firebase_client.firebase_get_async("users")
+        return firebase_client._get_async_client()
+
+    assert asyncio.run(current_client()) is not asyncio.run(current_client())
+
+
+async def test_conditional_put_reports_the_current_value_on_conflict(transport):
+    await firebase_client.firebase_put_async("counter", {"n": 1})
+    _, etag = await firebase_client.firebase_get_with_etag_async("counter")
+
+    written, _, new_etag = await firebase_client.firebase_put_if_match_async("counter", {"n": 2}, etag)
+    assert written
+    written, current, current_etag = await firebase_client.firebase_put_if_match_async("counter", {"n": 3}, etag)
+
+    assert not written
+    assert current == {"n": 2} and current_etag == new_etag
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from src import firebase_client, llama_index_template, openai_client
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+
+
+def _in_child(check):
+    # Runs check() in a forked child and returns what it reported.
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            result = check()
+        except BaseException as exc:
+            result = {"error": repr(exc)}
+        with os.fdopen(write_fd, "w") as f:
+            json.dump(result, f)
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        result = json.load(f)
+    os.waitpid(pid, 0)
+    return result
+
+
+def test_forked_child_opens_its_own_http_clients(fake_openai, fake_firebase):
+    firebase_client.firebase_put("users/u1", {"name": "Ana"})
+    session = firebase_client._session
+    http_client = openai_client.shared_http_client()
+    client = openai_client.get_openai_client()
+    embed_model = llama_index_template._embed_model()
+    embed_model.get_query_embedding("grid")
+
+    def check():
+        pool = openai_client.shared_http_client()
+        return {
+            "new_session": firebase_client._session is not session,
+            "new_http_client": pool is not http_client,
+            "new_client": openai_client.get_openai_client() is not client,
+            "embeddings_moved": all(
+                model._http_client is pool for model in llama_index_template._openai_embeddings.values()
+            ),
+            "name": firebase_client.firebase_get("users/u1")["name"],
+            "embedding": len(embed_model.get_query_embedding("flexbox")),
+        }
+
+    child = _in_child(check)
+
+    assert child == {
+        "new_session": True,
+        "new_http_client": True,
+        "new_client": True,
+        "embeddings_moved": True,
+        "name": "Ana",
+        "embedding": 64,
+    }
+    # The parent's clients are untouched and still work.
+    assert firebase_client._session is session
+    assert firebase_client.firebase_get("users/u1") == {"name": "Ana"}
+    assert len(embed_model.get_query_embedding("flexbox")) == 64
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from src import llama_index_template
+from src.index_versions import list_versions, read_current_version
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, fake_openai):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "react.txt").write_text("useState guarda el estado de un componente.", encoding="utf-8")
+    (data_dir / "sql.txt").write_text("SELECT con JOIN combina filas de dos tablas.", encoding="utf-8")
+    monkeypatch.setattr(llama_index_template, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(llama_index_template, "PERSIST_DIR", str(tmp_path / "storage"))
+    return tmp_path
+
+
+def test_rebuild_without_changes_keeps_the_current_version(workdir, fake_openai):
+    index, version = llama_index_template.build_index_version()
+    assert index is not None
+
+    os.utime(workdir / "data" / "sql.txt")
+    embeddings = fake_openai.state.requests["embeddings"]
+    assert llama_index_template.build_index_version() == (None, version)
+
+    persist_dir = str(workdir / "storage")
+    assert read_current_version(persist_dir) == version
+    assert list_versions(persist_dir) == [version]
+    assert fake_openai.state.requests["embeddings"] == embeddings
+
+
+def test_rebuild_with_changes_makes_a_new_version(workdir, fake_openai):
+    _, first = llama_index_template.build_index_version()
+
+    (workdir / "data" / "sql.txt").write_text("GROUP BY agrupa filas con el mismo valor.", encoding="utf-8")
+    index, second = llama_index_template.build_index_version()
+
+    assert second != first
+    assert read_current_version(str(workdir / "storage")) == second
+    texts = sorted(node.get_content() for node in index.docstore.docs.values())
+    assert texts == ["GROUP BY agrupa filas con el mismo valor.", "useState guarda el estado de un componente."]
@@ -0,0 +1,66 @@
+import os
+
+from src import index_versions
+from src.index_versions import (
+    copy_store_files,
+    list_versions,
+    prune_versions,
+    read_current_version,
+    resolve_persist_dir,
+    switch_current_version,
+    version_dir,
+)
+
+
+def _make_version(persist_dir, name):
+    path = version_dir(str(persist_dir), name)
+    os.makedirs(path)
+    with open(os.path.join(path, "docstore.json"), "w", encoding="utf-8") as f:
+        f.write("{}")
+    return path
+
+
+def test_unversioned_store_resolves_to_persist_dir(tmp_path):
+    assert read_current_version(str(tmp_path)) is None
+    assert resolve_persist_dir(str(tmp_path)) == str(tmp_path)
+
+
+def test_switch_points_current_at_the_new_version(tmp_path):
+    _make_version(tmp_path, "v1")
+    _make_version(tmp_path, "v2")
+
+    switch_current_version(str(tmp_path), "v1")
+    switch_current_version(str(tmp_path), "v2")
+
+    assert read_current_version(str(tmp_path)) == "v2"
+    assert resolve_persist_dir(str(tmp_path)) == version_dir(str(tmp_path), "v2")
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_prune_keeps_current_and_the_newest_others(tmp_path):
+    for name in ("v1", "v2", "v3", "v4", "v5"):
+        _make_version(tmp_path, name)
+    switch_current_version(str(tmp_path), "v2")
+
+    assert prune_versions(str(tmp_path), keep=3) == ["v1", "v3"]
+    assert list_versions(str(tmp_path)) == ["v2", "v4", "v5"]
+
+
+def test_copy_skips_shared_and_temporary_files(tmp_path):
+    src_dir, dst_dir = tmp_path / "src", tmp_path / "dst"
+    src_dir.mkdir()
+    for name in ("docstore.json", "vectors.npy", "embedding_cache.sqlite", "llm_cache.sqlite-wal",
+                 "CURRENT", "rebuild.lock", "vector_ids.json.tmp"):
+        (src_dir / name).write_text("x")
+    (src_dir / "versions").mkdir()
+
+    copy_store_files(str(src_dir), str(dst_dir))
+
+    assert sorted(os.listdir(dst_dir)) == ["docstore.json", "vectors.npy"]
+
+
+def test_rebuild_lock_is_released_on_exit(tmp_path):
+    with index_versions.rebuild_lock(str(tmp_path)):
+        pass
+    with index_versions.rebuild_lock(str(tmp_path)):
+        assert os.path.exists(tmp_path / index_versions.REBUILD_LOCK_FNAME)
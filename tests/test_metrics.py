@@ -0,0 +1,45 @@
+import pytest
+
+
+def test_tutor_context_stats_are_exported():
+    from src.app import tutor_context
+    from src.metrics import registry
+
+    tutor_context.summaries += 2
+    text = registry.render()
+
+    assert "# TYPE rag_tutor_sessions gauge" in text
+    assert f"rag_tutor_summaries_total {tutor_context.stats()['summaries']}" in text
+
+
+def _completion_tokens():
+    from src.metrics import registry
+
+    series = registry._counters.get("openai_tokens_total", {})
+    return sum(count for labels, count in series.items() if ("kind", "completion") in labels)
+
+
+@pytest.mark.anyio
+async def test_streamed_chat_tokens_are_counted(fake_openai):
+    from src.openai_client import chat_completion_stream_async
+
+    before = _completion_tokens()
+    reply = "".join([delta async for delta in chat_completion_stream_async(messages=[{"role": "user", "content": "hola"}])])
+
+    assert _completion_tokens() - before == len(reply.split())
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_query_engine_tokens_are_counted(fake_openai, tmp_path, streaming):
+    from src.llama_index_template import _build_index, query_index, stream_query_index
+
+    (tmp_path / "sql.txt").write_text("SELECT con JOIN combina filas de dos tablas.", encoding="utf-8")
+    index = _build_index(str(tmp_path / "store"), [str(tmp_path / "sql.txt")])
+
+    before = _completion_tokens()
+    if streaming:
+        answer = "".join(stream_query_index(index, "¿Qué hace un JOIN?"))
+    else:
+        answer = str(query_index(index, "¿Qué hace un JOIN?"))
+
+    assert _completion_tokens() - before == len(answer.split())
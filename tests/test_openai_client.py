@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src import openai_client
+from src.openai_client import _Slots
+
+pytestmark = pytest.mark.anyio
+
+
+class _Peak:
+    def __init__(self) -> None:
+        self.current = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> None:
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *exc) -> None:
+        with self.lock:
+            self.current -= 1
+
+
+async def test_threads_and_coroutines_share_one_limit():
+    slots = _Slots(3)
+    peak = _Peak()
+
+    def sync_call():
+        with slots, peak:
+            time.sleep(0.02)
+
+    async def async_call():
+        async with slots:
+            with peak:
+                await asyncio.sleep(0.02)
+
+    threads = [threading.Thread(target=sync_call) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    await asyncio.gather(*(async_call() for _ in range(6)))
+    for thread in threads:
+        thread.join()
+
+    assert peak.peak == 3
+    assert slots._used == 0
+
+
+async def test_cancelled_waiter_does_not_keep_a_slot():
+    slots = _Slots(1)
+    await slots.acquire_async()
+    waiter = asyncio.ensure_future(slots.acquire_async())
+    await asyncio.sleep(0)
+
+    waiter.cancel()
+    slots.release()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    await asyncio.sleep(0)
+
+    assert slots._used == 0
+    await asyncio.wait_for(slots.acquire_async(), timeout=1)
+
+
+async def test_slot_released_by_a_thread_wakes_a_coroutine():
+    slots = _Slots(1)
+    slots.acquire()
+    waiter = asyncio.ensure_future(slots.acquire_async())
+    await asyncio.sleep(0)
+    assert not waiter.done()
+
+    threading.Thread(target=slots.release).start()
+
+    await asyncio.wait_for(waiter, timeout=1)
+    assert slots._used == 1
+
+
+@pytest.fixture
+def one_slot(monkeypatch):
+    slots = _Slots(1)
+    monkeypatch.setattr(openai_client, "_slots", slots)
+    return slots
+
+
+@pytest.fixture
+def embed(tmp_path):
+    from llama_index.core.embeddings import MockEmbedding
+
+    from src.embedding_cache import CachedEmbedding, EmbeddingCache
+
+    return CachedEmbedding(MockEmbedding(embed_dim=4), cache=EmbeddingCache(path=str(tmp_path / "cache.sqlite")))
+
+
+def test_embedding_cache_misses_wait_for_a_slot(one_slot, embed):
+    embed.get_query_embedding("cacheada")
+    one_slot.acquire()
+
+    # A cache hit needs no slot; a miss waits for the one that is taken.
+    embed.get_query_embedding("cacheada")
+    miss = threading.Thread(target=embed.get_query_embedding, args=("nueva",))
+    miss.start()
+    miss.join(0.1)
+    assert miss.is_alive()
+
+    one_slot.release()
+    miss.join(1)
+    assert not miss.is_alive() and one_slot._used == 0
+
+
+def test_embedding_under_a_held_slot_does_not_take_a_second(one_slot, embed):
+    def query():
+        with openai_client.openai_slot():
+            embed.get_query_embedding("dentro")
+            embed.get_text_embedding_batch(["uno", "dos"])
+
+    worker = threading.Thread(target=query)
+    worker.start()
+    worker.join(1)
+
+    assert not worker.is_alive() and one_slot._used == 0
+
+
+async def test_async_embedding_misses_take_a_slot(one_slot, embed):
+    await one_slot.acquire_async()
+    miss = asyncio.ensure_future(embed.aget_query_embedding("asincrona"))
+    await asyncio.sleep(0.05)
+    assert not miss.done()
+
+    one_slot.release()
+    await asyncio.wait_for(miss, timeout=1)
+    assert one_slot._used == 0
@@ -0,0 +1,68 @@
+import sqlite3
+
+from src import response_cache
+from src.response_cache import ResponseCache
+
+EMBEDDING = [1.0, 0.0, 0.0]
+
+
+def _rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT version, key, last_used FROM responses ORDER BY version").fetchall()
+
+
+def test_hits_do_not_write_until_the_next_put(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite"))
+    cache.set_version("v1")
+    cache.put("query", "¿Qué es JSX?", EMBEDDING, "Una sintaxis.", "v1")
+    writes = cache._conn.total_changes
+
+    assert cache.get_exact("query", "¿qué es  jsx?", "v1") == "Una sintaxis."
+    assert cache.get_similar("query", EMBEDDING, "v1") == "Una sintaxis."
+    assert cache._conn.total_changes == writes
+    last_used = _rows(cache.path)[0][2]
+
+    cache.put("query", "¿Qué es CSS?", [0.0, 1.0, 0.0], "Estilos.", "v1")
+
+    last_used_by_key = {key: used for _, key, used in _rows(cache.path)}
+    assert last_used_by_key[response_cache.query_key("¿Qué es JSX?")] > last_used
+
+
+def test_hits_are_flushed_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "TOUCH_FLUSH_EVERY", 2)
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite"))
+    cache.set_version("v1")
+    for query in ("a", "b"):
+        cache.put("query", query, None, query.upper(), "v1")
+    writes = cache._conn.total_changes
+
+    cache.get_exact("query", "a", "v1")
+    assert cache._conn.total_changes == writes
+    cache.get_exact("query", "b", "v1")
+    assert cache._conn.total_changes == writes + 2
+
+
+def test_switching_versions_keeps_other_workers_entries(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    old_worker, new_worker = ResponseCache(path=path), ResponseCache(path=path)
+    old_worker.set_version("v1")
+    old_worker.put("query", "¿Qué es JSX?", EMBEDDING, "Una sintaxis.", "v1")
+
+    new_worker.set_version("v2")
+
+    assert new_worker.get_exact("query", "¿Qué es JSX?", "v2") is None
+    assert old_worker.get_exact("query", "¿Qué es JSX?", "v1") == "Una sintaxis."
+    restarted = ResponseCache(path=path)
+    restarted.set_version("v1")
+    assert restarted.get_exact("query", "¿Qué es JSX?", "v1") == "Una sintaxis."
+
+
+def test_forget_versions_deletes_only_those_versions(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite"))
+    for version in ("v1", "v2", "v3"):
+        cache.set_version(version)
+        cache.put("query", "pregunta", None, f"respuesta {version}", version)
+
+    cache.forget_versions(["v1", "v2"])
+
+    assert [version for version, _, _ in _rows(cache.path)] == ["v3"]
@@ -0,0 +1,131 @@
+import pytest
+
+DOCS = {
+    "css.txt": "Flexbox y grid colocan los elementos de una página. Un selector elige qué elementos reciben cada regla.",
+    "react.txt": "useState guarda el estado de un componente y useEffect ejecuta efectos después de cada render.",
+    "sql.txt": "SELECT con JOIN combina filas de dos tablas; WHERE filtra y ORDER BY ordena el resultado.",
+    "node.txt": "Express encadena middleware antes del router; req.body trae el cuerpo y res.json responde.",
+    "auth.txt": "Un token JWT firmado identifica al usuario en cada petición a la API REST.",
+}
+
+
+@pytest.fixture(scope="module")
+def index(fake_openai, tmp_path_factory):
+    from src.llama_index_template import _build_index
+
+    data_dir = tmp_path_factory.mktemp("data")
+    paths = []
+    for name, text in DOCS.items():
+        path = data_dir / name
+        path.write_text(text, encoding="utf-8")
+        paths.append(str(path))
+    return _build_index(str(tmp_path_factory.mktemp("store")), paths)
+
+
+def _embedded_text(index, file_name):
+    # The exact text the node was embedded from, so a query made of it is
+    # the node's nearest neighbour under the fake's hash embeddings.
+    from llama_index.core.schema import MetadataMode
+
+    for node in index.docstore.docs.values():
+        if node.metadata.get("file_name") == file_name:
+            return node.node_id, node.get_content(metadata_mode=MetadataMode.EMBED)
+    raise KeyError(file_name)
+
+
+def test_vector_mode_ranks_by_cosine_similarity(index):
+    from src.llama_index_template import retrieve_context
+
+    node_id, text = _embedded_text(index, "sql.txt")
+    chunks = retrieve_context(index, text, similarity_top_k=3, mode="vector")
+
+    assert len(chunks) == 3
+    assert chunks[0]["node_id"] == node_id
+    assert chunks[0]["score"] == pytest.approx(1.0, abs=1e-4)
+    scores = [chunk["score"] for chunk in chunks]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_lexical_mode_uses_bm25_without_embedding(index, fake_openai):
+    from src.llama_index_template import retrieve_context
+
+    before = fake_openai.state.requests["embeddings"]
+    chunks = retrieve_context(index, "¿Cómo funciona FLEXBOX?", similarity_top_k=2, mode="lexical")
+
+    assert chunks[0]["file_name"] == "css.txt"
+    assert fake_openai.state.requests["embeddings"] == before
+
+
+def test_hybrid_mode_fuses_both_rankings(index):
+    from src.bm25_index import reciprocal_rank_fusion
+    from src.llama_index_template import retrieve_context
+
+    node_id, text = _embedded_text(index, "sql.txt")
+    vector = retrieve_context(index, text, similarity_top_k=5, mode="vector")
+    lexical = retrieve_context(index, text, similarity_top_k=5, mode="lexical")
+    hybrid = retrieve_context(index, text, similarity_top_k=5, mode="hybrid")
+
+    expected = reciprocal_rank_fusion([
+        [chunk["node_id"] for chunk in vector],
+        [chunk["node_id"] for chunk in lexical],
+    ])
+    assert hybrid[0]["node_id"] == node_id
+    assert [chunk["node_id"] for chunk in hybrid] == [node for node, _ in expected][:5]
+    assert [chunk["score"] for chunk in hybrid] == pytest.approx([score for _, score in expected][:5])
+
+
+def test_mmr_keeps_the_best_hit_and_returns_distinct_chunks(index):
+    from src.llama_index_template import retrieve_context
+
+    node_id, text = _embedded_text(index, "react.txt")
+    chunks = retrieve_context(index, text, similarity_top_k=3, mode="vector", mmr=True, mmr_lambda=0.3)
+
+    assert chunks[0]["node_id"] == node_id
+    assert len({chunk["node_id"] for chunk in chunks}) == 3
+
+
+def test_mmr_with_lambda_one_is_plain_vector_ranking(index):
+    from src.llama_index_template import retrieve_context
+
+    _, text = _embedded_text(index, "node.txt")
+    plain = retrieve_context(index, text, similarity_top_k=3, mode="vector")
+    mmr = retrieve_context(index, text, similarity_top_k=3, mode="vector", mmr=True, mmr_lambda=1.0)
+
+    assert [chunk["node_id"] for chunk in mmr] == [chunk["node_id"] for chunk in plain]
+
+
+def test_max_tokens_truncates_a_single_oversized_chunk(index):
+    from src.llama_index_template import retrieve_context
+    from src.tokens import count_text_tokens
+
+    chunks = retrieve_context(index, "token JWT", similarity_top_k=3, mode="lexical", max_tokens=5)
+
+    assert len(chunks) == 1
+    assert count_text_tokens(chunks[0]["text"]) <= 5
+
+
+def test_unknown_mode_is_rejected(index):
+    from src.llama_index_template import retrieve_context
+
+    with pytest.raises(ValueError):
+        retrieve_context(index, "grid", mode="semantic")
+
+
+@pytest.mark.parametrize("kwargs", [{"similarity_top_k": 0}, {"similarity_top_k": -1}, {"max_tokens": 0}])
+def test_non_positive_limits_are_rejected(index, kwargs):
+    from src.llama_index_template import retrieve_context
+
+    for mode in ("vector", "lexical", "hybrid"):
+        with pytest.raises(ValueError):
+            retrieve_context(index, "grid", mode=mode, **kwargs)
+
+
+@pytest.mark.parametrize("params", [{"top_k": -1}, {"top_k": 0}, {"max_tokens": 0}])
+def test_retrieve_route_validates_limits(params):
+    from fastapi.testclient import TestClient
+
+    from src.app import app
+
+    response = TestClient(app).get("/retrieve", params={"user_query": "grid", **params})
+
+    assert response.status_code == 422
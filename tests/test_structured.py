@@ -0,0 +1,200 @@
+import asyncio
+import json
+from typing import List
+
+import pytest
+from pydantic import BaseModel
+
+from src import structured
+from src.structured import StructuredOutputError, generate_structured, parse_json_object
+
+pytestmark = pytest.mark.anyio
+
+SYSTEM = {"role": "system", "content": "Devuelve un plan en JSON."}
+
+
+class Topic(BaseModel):
+    titulo: str
+    nivel: int
+
+
+class Plan(BaseModel):
+    nombre: str
+    temas: List[Topic]
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    # Scripted model replies, consumed in order; the messages of every call
+    # are kept for inspection.
+    script: List[str] = []
+    calls: List[list] = []
+
+    async def complete(messages, model, temperature):
+        calls.append(messages)
+        return script[len(calls) - 1]
+
+    monkeypatch.setattr(structured, "_complete", complete)
+    return script, calls
+
+
+def _messages(text):
+    return [SYSTEM, {"role": "user", "content": text}]
+
+
+def test_parse_json_object_strips_fences_prose_and_trailing_commas():
+    text = 'Aquí tienes:\n```json\n{"nombre": "x", "temas": [{"titulo": "a", "nivel": 1},],}\n```'
+    assert parse_json_object(text) == {"nombre": "x", "temas": [{"titulo": "a", "nivel": 1}]}
+
+
+async def test_locally_repairable_reply_needs_one_call(replies):
+    script, calls = replies
+    script.append('```json\n{"nombre": "x", "temas": [{"titulo": "a", "nivel": "1"},]}\n```')
+
+    plan = await generate_structured(_messages("local"), Plan, cache=False)
+
+    assert len(calls) == 1
+    assert plan.temas[0].nivel == 1
+
+
+async def test_only_invalid_items_are_sent_back(replies):
+    script, calls = replies
+    script.append(json.dumps({"nombre": "x", "temas": [{"titulo": "a", "nivel": 1}, {"titulo": "b", "nivel": "alto"}]}))
+    script.append(json.dumps({"items": [{"titulo": "b", "nivel": 3}]}))
+
+    plan = await generate_structured(_messages("items"), Plan, list_field="temas", cache=False)
+
+    assert [(t.titulo, t.nivel) for t in plan.temas] == [("a", 1), ("b", 3)]
+    fix_request = calls[1][-1]["content"]
+    assert calls[1][0] == SYSTEM
+    assert '"titulo": "b"' in fix_request and '"titulo": "a"' not in fix_request
+
+
+async def test_items_that_stay_invalid_are_dropped_when_allowed(replies):
+    script, calls = replies
+    script.append(json.dumps({"nombre": "x", "temas": [{"titulo": "a", "nivel": 1}, {"titulo": "b"}]}))
+    script.append("no es JSON")
+
+    plan = await generate_structured(
+        _messages("drop"), Plan, list_field="temas", drop_invalid_items=True, cache=False,
+    )
+
+    assert len(calls) == 2
+    assert [t.titulo for t in plan.temas] == ["a"]
+
+
+async def test_other_errors_are_reasked_with_the_validation_error(replies):
+    script, calls = replies
+    script.append(json.dumps({"temas": []}))
+    script.append(json.dumps({"nombre": "n", "temas": []}))
+
+    plan = await generate_structured(_messages("reask"), Plan, list_field="temas", cache=False)
+
+    assert plan.nombre == "n"
+    assert calls[1][-2] == {"role": "assistant", "content": json.dumps({"temas": []})}
+    assert "nombre" in calls[1][-1]["content"]
+
+
+async def test_unrepairable_reply_raises(replies):
+    script, calls = replies
+    script.extend(["nada", "tampoco"])
+
+    with pytest.raises(StructuredOutputError):
+        await generate_structured(_messages("error"), Plan, cache=False)
+    assert len(calls) == 1 + structured.LLM_REPAIR_ATTEMPTS
+
+
+async def test_valid_replies_are_cached(fake_openai):
+    from src.app import CurriculumAgentOutput
+
+    messages = [{"role": "system", "content": 'Responde con {"curriculum": [...]}'}, {"role": "user", "content": "SQL"}]
+    before = fake_openai.state.requests["chat"]
+
+    first = await generate_structured(messages, CurriculumAgentOutput, list_field="curriculum")
+    second = await generate_structured(messages, CurriculumAgentOutput, list_field="curriculum")
+
+    assert fake_openai.state.requests["chat"] == before + 1
+    assert second == first
+    assert len(first.curriculum) > 0
+
+
+def _bad_request(message, param=None):
+    import httpx
+    from openai import BadRequestError
+
+    response = httpx.Response(400, request=httpx.Request("POST", "http://fake/v1/chat/completions"))
+    return BadRequestError(message, response=response, body={"message": message, "param": param})
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    # Fails JSON-mode calls with the scripted error; plain calls succeed.
+    calls = []
+    errors = []
+
+    async def chat_completion_async(**kwargs):
+        calls.append(kwargs)
+        if "response_format" in kwargs and errors:
+            raise errors.pop(0)
+
+        class Message:
+            content = "{}"
+
+        class Choice:
+            message = Message
+
+        class Response:
+            choices = [Choice]
+
+        return Response
+
+    monkeypatch.setattr(structured, "chat_completion_async", chat_completion_async)
+    monkeypatch.setattr(structured, "_no_json_mode", set())
+    return calls, errors
+
+
+async def test_unrelated_bad_request_is_raised_and_keeps_json_mode(chat):
+    calls, errors = chat
+    errors.append(_bad_request("This model's maximum context length is 128000 tokens.", param="messages"))
+
+    with pytest.raises(Exception, match="context length"):
+        await structured._complete(_messages("largo"), "gpt-test", 0.0)
+
+    assert len(calls) == 1 and not structured._no_json_mode
+    await structured._complete(_messages("corto"), "gpt-test", 0.0)
+    assert "response_format" in calls[-1]
+
+
+async def test_response_format_rejection_falls_back_to_plain_mode(chat):
+    calls, errors = chat
+    errors.append(_bad_request("Invalid parameter: 'response_format' of type 'json_object' is not supported.",
+                               param="response_format"))
+
+    assert await structured._complete(_messages("x"), "gpt-old", 0.0) == "{}"
+    await structured._complete(_messages("y"), "gpt-old", 0.0)
+
+    assert ["response_format" in call for call in calls] == [True, False, False]
+    assert structured._no_json_mode == {"gpt-old"}
+
+
+async def test_attempt_cancelled_by_its_hedge_records_its_latency(monkeypatch):
+    from collections import deque
+
+    valid = json.dumps({"nombre": "x", "temas": []})
+    delays = [1.0, 0.0]
+
+    async def complete(messages, model, temperature):
+        await asyncio.sleep(delays.pop(0))
+        return valid
+
+    window = deque([0.05] * 20, maxlen=structured.LATENCY_WINDOW)
+    monkeypatch.setattr(structured, "_complete", complete)
+    monkeypatch.setattr(structured, "_latencies", {"Plan": window})
+
+    content, plan = await structured._first_valid(_messages("hedge"), Plan, "gpt-test", 0.0, hedge=True)
+    await asyncio.sleep(0)
+
+    assert plan is not None
+    added = list(window)[20:]
+    assert len(added) == 2
+    assert max(added) >= 0.05
@@ -0,0 +1,53 @@
+import pytest
+
+from src.tutor_context import TutorContext, count_message_tokens
+
+pytestmark = pytest.mark.anyio
+
+SYSTEM = "Eres un tutor de programación."
+
+
+def _context(budget):
+    calls = []
+
+    async def summarize(summary, messages):
+        calls.append(len(messages))
+        return "resumen breve"
+
+    return TutorContext(summarize=summarize, budget=budget, keep=2, fold_batch=2), calls
+
+
+def _turns(count, words=3):
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": " ".join(f"palabra{i}" for _ in range(words))}
+        for i in range(count)
+    ]
+
+
+async def test_short_history_is_sent_as_is():
+    context, calls = _context(budget=500)
+    history = _turns(3)
+
+    assert await context.build(SYSTEM, history, "s1") == [{"role": "system", "content": SYSTEM}, *history]
+    assert calls == []
+
+
+async def test_older_turns_are_folded_into_the_summary():
+    context, calls = _context(budget=500)
+    history = _turns(7)
+
+    messages = await context.build(SYSTEM, history, "s1")
+
+    assert calls == [5]
+    assert "resumen breve" in messages[1]["content"]
+    assert messages[2:] == history[5:]
+
+
+async def test_an_oversized_last_message_is_cut_to_the_budget():
+    context, _ = _context(budget=300)
+    history = _turns(3, words=10) + [{"role": "user", "content": "duda " * 2000}]
+
+    messages = await context.build(SYSTEM, history, "s1")
+
+    assert count_message_tokens(messages) <= 300
+    assert messages[-1]["role"] == "user" and messages[-1]["content"].startswith("duda")